@@ -3,7 +3,15 @@ AI服务包装器 - 为Django后端提供统一的AI服务接口
 """
 import logging
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+
+from .ai_services.summarizer import (
+    MapReduceSummarizer, MAP_SYSTEM_PROMPT, needs_map_reduce, summary_template_version
+)
+from .utils import get_llm_client
 
 # 加载环境变量
 try:
@@ -25,6 +33,9 @@ except ImportError:
 
 class AIService:
     """AI服务统一接口"""
+
+    # summarize 生成的摘要对应的长度档位，用于摘要存储的键
+    SUMMARY_LENGTH = 'medium'
     
     def __init__(self):
         self.api_key = os.getenv('GOOGLE_API_KEY')
@@ -90,51 +101,141 @@ class AIService:
             'gemini_available': GEMINI_AVAILABLE
         }
     
+    @staticmethod
+    async def _aget_llm_client():
+        """获取 ai_services 的LLM客户端
+
+        启用 ai_services 时异步方法通过它生成（记录任务日志、使用结果缓存，本地模型的并发请求合并批处理）；
+        未启用或客户端只能返回模拟响应时返回None，改为直接调用Gemini或返回本服务的模拟响应。
+        """
+        llm_client = await sync_to_async(get_llm_client)()
+        if llm_client is None or llm_client.is_mock():
+            return None
+        return llm_client
+
+    @staticmethod
+    def _llm_client_result(llm_client, result: Dict[str, Any]) -> Dict[str, Any]:
+        """把LLM客户端的结果转换为本服务的返回格式"""
+        converted = {
+            'text': result.get('text', ''),
+            'model': result.get('model', llm_client.model_id),
+            'provider': result.get('provider', llm_client.provider),
+            'tokens_used': result.get('tokens_used', 0),
+        }
+        if result.get('error'):
+            converted['provider'] = 'error'
+            converted['error'] = result['error']
+        return converted
+
+    @staticmethod
+    def _build_chat_prompt(query: str, context: str = None) -> str:
+        if context:
+            return f"基于以下上下文回答问题：\n\n{context}\n\n问题：{query}"
+        return query
+
+    @staticmethod
+    def _mock_chat_text(query: str) -> str:
+        return f"[模拟AI回复] 关于您的问题：{query}，这是一个模拟的AI回复。请配置GOOGLE_API_KEY环境变量以启用真实的AI功能。"
+
+    def _chat_result(self, text: str) -> Dict[str, Any]:
+        return {
+            'text': text,
+            'model': self.model_name,
+            'provider': 'gemini',
+            'processing_time': 0.0,
+            'tokens_used': 0
+        }
+
+    def _chat_mock_result(self, query: str) -> Dict[str, Any]:
+        # 离线模式返回模拟响应
+        return {
+            'text': self._mock_chat_text(query),
+            'model': 'mock',
+            'provider': 'mock',
+            'processing_time': 0.1,
+            'tokens_used': 50
+        }
+
+    def _chat_error_result(self, error: Exception) -> Dict[str, Any]:
+        logger.error(f"Chat generation failed: {error}")
+        return {
+            'text': f"抱歉，AI服务暂时不可用。错误：{str(error)}",
+            'model': self.model_name,
+            'provider': 'error',
+            'processing_time': 0.0,
+            'tokens_used': 0,
+            'error': str(error)
+        }
+
     def chat(self, query: str, context: str = None) -> Dict[str, Any]:
         """聊天对话"""
         try:
-            if self.client:
-                # 构建提示词
-                prompt = query
-                if context:
-                    prompt = f"基于以下上下文回答问题：\n\n{context}\n\n问题：{query}"
-
-                # 调用Gemini API
-                response = self.client.generate_content(prompt)
-
-                return {
-                    'text': response.text,
-                    'model': self.model_name,
-                    'provider': 'gemini',
-                    'processing_time': 0.0,
-                    'tokens_used': 0
-                }
-            else:
-                # 离线模式返回模拟响应
-                return {
-                    'text': f"[模拟AI回复] 关于您的问题：{query}，这是一个模拟的AI回复。请配置GOOGLE_API_KEY环境变量以启用真实的AI功能。",
-                    'model': 'mock',
-                    'provider': 'mock',
-                    'processing_time': 0.1,
-                    'tokens_used': 50
-                }
+            if not self.client:
+                return self._chat_mock_result(query)
+            # 调用Gemini API
+            response = self.client.generate_content(self._build_chat_prompt(query, context))
+            return self._chat_result(response.text)
+        except Exception as e:
+            return self._chat_error_result(e)
 
+    async def achat(self, query: str, context: str = None) -> Dict[str, Any]:
+        """聊天对话（异步），等待Gemini响应期间不占用线程"""
+        try:
+            llm_client = await self._aget_llm_client()
+            if llm_client is not None:
+                result = await llm_client.agenerate_text(self._build_chat_prompt(query, context), task_type='chat')
+                return self._llm_client_result(llm_client, result)
+            if not self.client:
+                return self._chat_mock_result(query)
+            response = await self.client.generate_content_async(self._build_chat_prompt(query, context))
+            return self._chat_result(response.text)
         except Exception as e:
-            logger.error(f"Chat generation failed: {e}")
-            return {
-                'text': f"抱歉，AI服务暂时不可用。错误：{str(e)}",
-                'model': self.model_name,
-                'provider': 'error',
-                'processing_time': 0.0,
-                'tokens_used': 0,
-                'error': str(e)
-            }
+            return self._chat_error_result(e)
     
-    def summarize(self, content: str) -> Dict[str, Any]:
-        """文档总结"""
-        try:
-            if self.client:
-                prompt = f"""请对以下内容进行总结，要求：
+    async def achat_stream(self, query: str, context: str = None,
+                           info: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """流式聊天对话，逐段返回生成的文本，在ASGI下收到一段就能立即发送给客户端
+
+        启用 ai_services 时通过其LLM客户端生成（支持本地模型的逐token输出并记录任务日志），
+        否则直接调用Gemini流式API。传入 info 字典时会填入本次回复的 model 和 provider。
+        出错时直接抛出异常，由调用方决定如何通知客户端。
+        """
+        prompt = self._build_chat_prompt(query, context)
+
+        llm_client = await self._aget_llm_client()
+        if llm_client is not None:
+            if info is not None:
+                info['model'] = llm_client.model_id
+                info['provider'] = llm_client.provider
+            async for text in llm_client.agenerate_text_stream(prompt, task_type='chat'):
+                yield text
+            return
+
+        if info is not None:
+            info['model'] = self.model_name if self.client else 'mock'
+            info['provider'] = 'gemini' if self.client else 'mock'
+
+        if not self.client:
+            # 离线模式按小段返回模拟响应
+            text = self._mock_chat_text(query)
+            for start in range(0, len(text), 16):
+                yield text[start:start + 16]
+            return
+
+        # 调用Gemini流式API，收到一段就返回一段
+        response = await self.client.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # 被安全策略拦截等没有文本的片段
+                continue
+            if text:
+                yield text
+
+    @staticmethod
+    def _build_summary_prompt(content: str) -> str:
+        return f"""请对以下内容进行总结，要求：
 1. 提取主要观点和关键信息
 2. 保持逻辑清晰，结构合理
 3. 控制在200-300字以内
@@ -142,40 +243,95 @@ class AIService:
 内容：
 {content}"""
 
-                response = self.client.generate_content(prompt)
+    def summary_template_version(self) -> str:
+        """摘要提示词的版本，提示词或模型变化后已保存的摘要视为过期"""
+        return summary_template_version(self._build_summary_prompt(''), self.model_name)
+
+    def _summary_error_result(self, error: Exception) -> Dict[str, Any]:
+        logger.error(f"Summarization failed: {error}")
+        return {
+            'text': f"总结生成失败：{str(error)}",
+            'model': self.model_name,
+            'provider': 'error',
+            'error': str(error)
+        }
 
-                return {
-                    'text': response.text,
-                    'model': self.model_name,
-                    'provider': 'gemini'
-                }
-            else:
-                return {
-                    'text': f"[模拟总结] 这是对文档的模拟总结。文档长度：{len(content)}字符。请配置API密钥以获得真实的AI总结。",
-                    'model': 'mock',
-                    'provider': 'mock'
-                }
+    @staticmethod
+    def _summary_mock_result(content: str) -> Dict[str, Any]:
+        return {
+            'text': f"[模拟总结] 这是对文档的模拟总结。文档长度：{len(content)}字符。请配置API密钥以获得真实的AI总结。",
+            'model': 'mock',
+            'provider': 'mock'
+        }
 
+    def summarize(self, content: str) -> Dict[str, Any]:
+        """文档总结"""
+        try:
+            if not self.client:
+                return self._summary_mock_result(content)
+            response = self.client.generate_content(self._build_summary_prompt(content))
+            return {
+                'text': response.text,
+                'model': self.model_name,
+                'provider': 'gemini'
+            }
         except Exception as e:
-            logger.error(f"Summarization failed: {e}")
+            return self._summary_error_result(e)
+
+    async def asummarize(self, content: str) -> Dict[str, Any]:
+        """文档总结（异步）"""
+        try:
+            llm_client = await self._aget_llm_client()
+            if llm_client is not None:
+                result = await llm_client.agenerate_text(self._build_summary_prompt(content), task_type='summary')
+                return self._llm_client_result(llm_client, result)
+            if not self.client:
+                return self._summary_mock_result(content)
+            response = await self.client.generate_content_async(self._build_summary_prompt(content))
             return {
-                'text': f"总结生成失败：{str(e)}",
+                'text': response.text,
                 'model': self.model_name,
-                'provider': 'error',
-                'error': str(e)
+                'provider': 'gemini'
             }
+        except Exception as e:
+            return self._summary_error_result(e)
     
-    def generate_quiz(self, content: str = None, topic: str = None, 
-                     question_count: int = 5, question_types: List[str] = None,
-                     difficulty: str = 'medium') -> Dict[str, Any]:
-        """生成测验"""
+    def _generate_partial_summary(self, prompt: str) -> str:
+        response = self.client.generate_content(f"{MAP_SYSTEM_PROMPT}\n\n{prompt}")
+        return response.text
+
+    def summarize_document(self, document) -> Dict[str, Any]:
+        """文档总结，超出单次预算的长文档先逐块概括再合并（分块概括缓存在DocumentChunk上）"""
+        if not self.client or not needs_map_reduce(document.content):
+            return self.summarize(document.content)
+
         try:
-            if question_types is None:
-                question_types = ['MC', 'TF']  # 单选题和判断题
-            
-            if self.client:
-                if content:
-                    prompt = f"""基于以下内容生成{question_count}道测验题目：
+            result, stats = MapReduceSummarizer(self._generate_partial_summary).summarize_document(
+                document, self.summarize
+            )
+        except Exception as e:
+            return self._summary_error_result(e)
+        result['map_reduce'] = stats
+        return result
+
+    async def asummarize_document(self, document) -> Dict[str, Any]:
+        """summarize_document 的异步版本，长文档的分层摘要在独立线程中执行"""
+        if not self.client or not needs_map_reduce(document.content):
+            return await self.asummarize(document.content)
+
+        def run():
+            try:
+                return self.summarize_document(document)
+            finally:
+                connection.close()
+
+        return await sync_to_async(run, thread_sensitive=False)()
+
+    @staticmethod
+    def _build_quiz_prompt(content: str = None, topic: str = None, question_count: int = 5,
+                           question_types: List[str] = None, difficulty: str = 'medium') -> str:
+        if content:
+            return f"""基于以下内容生成{question_count}道测验题目：
 
 内容：
 {content}
@@ -198,66 +354,106 @@ class AIService:
     }}
   ]
 }}"""
-                else:
-                    prompt = f"""生成关于"{topic or '通用知识'}"的{question_count}道测验题目：
+        return f"""生成关于"{topic or '通用知识'}"的{question_count}道测验题目：
 
 要求：
 1. 题目类型：{', '.join(question_types)}
 2. 难度：{difficulty}
 3. 每道题包含：题目、选项（如适用）、正确答案、解释
 4. 以JSON格式返回"""
-                
-                response = self.client.generate_content(prompt)
-                
-                # 尝试解析JSON响应
-                import json
-                try:
-                    result = json.loads(response.text)
-                    return result
-                except json.JSONDecodeError:
-                    # 如果无法解析JSON，返回文本格式
-                    return {
-                        'text': response.text,
-                        'questions': [],
-                        'model': self.model_name,
-                        'provider': 'gemini'
-                    }
-            else:
-                # 生成模拟题目
-                mock_questions = []
-                for i in range(question_count):
-                    if 'MC' in question_types:
-                        mock_questions.append({
-                            'type': 'MC',
-                            'question': f'模拟单选题 {i+1}：这是一道关于{topic or "通用知识"}的测试题目？',
-                            'options': ['A. 选项1', 'B. 选项2', 'C. 选项3', 'D. 选项4'],
-                            'correct_answer': 'A',
-                            'explanation': '这是模拟的解释内容。'
-                        })
-                    elif 'TF' in question_types:
-                        mock_questions.append({
-                            'type': 'TF',
-                            'question': f'模拟判断题 {i+1}：关于{topic or "通用知识"}的陈述是正确的。',
-                            'options': ['正确', '错误'],
-                            'correct_answer': '正确',
-                            'explanation': '这是模拟的解释内容。'
-                        })
-                
-                return {
-                    'questions': mock_questions,
-                    'model': 'mock',
-                    'provider': 'mock'
-                }
-                
-        except Exception as e:
-            logger.error(f"Quiz generation failed: {e}")
+
+    def _parse_quiz_response(self, text: str) -> Dict[str, Any]:
+        # 尝试解析JSON响应
+        import json
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            # 如果无法解析JSON，返回文本格式
             return {
-                'error': f"测验生成失败：{str(e)}",
+                'text': text,
                 'questions': [],
                 'model': self.model_name,
-                'provider': 'error'
+                'provider': 'gemini'
             }
 
+    @staticmethod
+    def _quiz_mock_result(topic: str, question_count: int, question_types: List[str]) -> Dict[str, Any]:
+        # 生成模拟题目
+        mock_questions = []
+        for i in range(question_count):
+            if 'MC' in question_types:
+                mock_questions.append({
+                    'type': 'MC',
+                    'question': f'模拟单选题 {i+1}：这是一道关于{topic or "通用知识"}的测试题目？',
+                    'options': ['A. 选项1', 'B. 选项2', 'C. 选项3', 'D. 选项4'],
+                    'correct_answer': 'A',
+                    'explanation': '这是模拟的解释内容。'
+                })
+            elif 'TF' in question_types:
+                mock_questions.append({
+                    'type': 'TF',
+                    'question': f'模拟判断题 {i+1}：关于{topic or "通用知识"}的陈述是正确的。',
+                    'options': ['正确', '错误'],
+                    'correct_answer': '正确',
+                    'explanation': '这是模拟的解释内容。'
+                })
+
+        return {
+            'questions': mock_questions,
+            'model': 'mock',
+            'provider': 'mock'
+        }
+
+    def _quiz_error_result(self, error: Exception) -> Dict[str, Any]:
+        logger.error(f"Quiz generation failed: {error}")
+        return {
+            'error': f"测验生成失败：{str(error)}",
+            'questions': [],
+            'model': self.model_name,
+            'provider': 'error'
+        }
+
+    def generate_quiz(self, content: str = None, topic: str = None, 
+                     question_count: int = 5, question_types: List[str] = None,
+                     difficulty: str = 'medium') -> Dict[str, Any]:
+        """生成测验"""
+        try:
+            if question_types is None:
+                question_types = ['MC', 'TF']  # 单选题和判断题
+
+            if not self.client:
+                return self._quiz_mock_result(topic, question_count, question_types)
+
+            prompt = self._build_quiz_prompt(content, topic, question_count, question_types, difficulty)
+            response = self.client.generate_content(prompt)
+            return self._parse_quiz_response(response.text)
+        except Exception as e:
+            return self._quiz_error_result(e)
+
+    async def agenerate_quiz(self, content: str = None, topic: str = None,
+                             question_count: int = 5, question_types: List[str] = None,
+                             difficulty: str = 'medium') -> Dict[str, Any]:
+        """生成测验（异步）"""
+        try:
+            if question_types is None:
+                question_types = ['MC', 'TF']  # 单选题和判断题
+
+            prompt = self._build_quiz_prompt(content, topic, question_count, question_types, difficulty)
+            llm_client = await self._aget_llm_client()
+            if llm_client is not None:
+                result = await llm_client.agenerate_text(prompt, task_type='quiz_generation')
+                if result.get('error'):
+                    raise RuntimeError(result['error'])
+                return self._parse_quiz_response(result['text'])
+
+            if not self.client:
+                return self._quiz_mock_result(topic, question_count, question_types)
+
+            response = await self.client.generate_content_async(prompt)
+            return self._parse_quiz_response(response.text)
+        except Exception as e:
+            return self._quiz_error_result(e)
+
 
 # 全局AI服务实例
 ai_service = AIService()
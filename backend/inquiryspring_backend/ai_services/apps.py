@@ -1,10 +1,33 @@
 from django.apps import AppConfig
 import logging
+import os
+import sys
+import threading
+from django.conf import settings
 from django.db import connection
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_migrate, post_save, post_delete
 
 logger = logging.getLogger(__name__)
 
+# 通过 manage.py 运行时只有这些命令是服务进程
+SERVER_COMMANDS = {'runserver'}
+
+
+def _is_server_process(argv=None) -> bool:
+    """判断当前进程是否为Web服务进程
+
+    gunicorn、uvicorn 等服务器直接导入 wsgi/asgi 模块，视为服务进程；
+    manage.py 只有 runserver 算，且自动重载时只有实际处理请求的子进程（RUN_MAIN=true）算。
+    migrate、shell、run_ingestion_worker 等管理命令不是服务进程。
+    """
+    argv = sys.argv if argv is None else argv
+    if not argv or os.path.basename(argv[0]) not in ('manage.py', 'django-admin', 'django-admin.py'):
+        return True
+    if len(argv) < 2 or argv[1] not in SERVER_COMMANDS:
+        return False
+    return '--noreload' in argv or os.environ.get('RUN_MAIN') == 'true'
+
+
 class AiServicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inquiryspring_backend.ai_services'
@@ -51,4 +74,20 @@ class AiServicesConfig(AppConfig):
                 initialize_services()
         
         post_migrate.connect(post_migrate_callback, sender=self)
-            
\ No newline at end of file
+
+        # 模型配置变更后清除缓存的LLM客户端
+        from .models import AIModel
+        post_save.connect(LLMClientFactory.clear_cache, sender=AIModel,
+                          dispatch_uid='llm_client_cache_post_save')
+        post_delete.connect(LLMClientFactory.clear_cache, sender=AIModel,
+                            dispatch_uid='llm_client_cache_post_delete')
+
+        # 在Web服务进程的后台线程中预加载嵌入模型，避免第一个请求承担模型加载耗时；
+        # 管理命令和文档处理进程不预加载，需要时再按需加载
+        if getattr(settings, 'AI_EMBEDDING_WARMUP', True) and _is_server_process():
+            from .embedding_provider import embedding_provider
+            threading.Thread(
+                target=embedding_provider.warm_up,
+                name='embedding-warmup',
+                daemon=True
+            ).start()
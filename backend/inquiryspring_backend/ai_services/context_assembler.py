@@ -0,0 +1,139 @@
+"""
+上下文组装模块 - 在token预算内按相关度挑选检索到的分块，并去除相邻分块之间的重叠文本
+
+本模块不依赖Django模型，未启用ai_services时也可以导入使用。
+"""
+import logging
+from typing import Callable, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+# 默认的上下文token预算
+DEFAULT_TOKEN_BUDGET = 2000
+
+# 相邻分块之间的重叠至少达到该长度才会被去除，避免误删偶然相同的标点
+MIN_OVERLAP_CHARS = 16
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本包含的token数量 (简单估算)
+
+    Args:
+        text: 要估算的文本
+
+    Returns:
+        估计的token数量
+    """
+    # 简单估算：每个汉字约等于1个token，每4个英文字符约等于1个token
+    # 这是一个简化估算，实际token数会根据模型分词器的具体实现有所不同
+    chinese_count = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
+    english_chars = sum(1 for c in text if c.isascii() and (c.isalnum() or c.isspace()))
+    english_tokens = english_chars / 4
+
+    return int(chinese_count + english_tokens)
+
+
+class ContextAssembler:
+    """按token预算组装检索上下文
+
+    分块按相似度从高到低依次放入，放不下的分块会被跳过（后面更短的分块仍可能放入）。
+    同一文档中相邻的分块如果都被选中，后放入的分块会去掉与邻居重叠的部分。
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET,
+                 token_counter: Callable[[str], int] = None,
+                 max_overlap: int = 200, separator: str = "\n\n---\n\n"):
+        self.token_budget = token_budget
+        self.token_counter = token_counter or estimate_tokens
+        self.max_overlap = max_overlap
+        self.separator = separator
+
+    def _overlap_length(self, previous: str, current: str) -> int:
+        """previous 的后缀与 current 的前缀重叠的字符数"""
+        limit = min(len(previous), len(current), self.max_overlap)
+        for size in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+            if previous.endswith(current[:size]):
+                return size
+        return 0
+
+    def truncate(self, text: str, token_budget: int = None) -> str:
+        """将文本截断到token预算以内"""
+        if token_budget is None:
+            token_budget = self.token_budget
+        if self.token_counter(text) <= token_budget:
+            return text
+
+        # 二分查找能放入预算的最长前缀
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.token_counter(text[:middle]) <= token_budget:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+    def assemble(self, chunks: List[Any]) -> Dict[str, Any]:
+        """组装上下文
+
+        Args:
+            chunks: 检索到的DocumentChunk列表，按相关度从高到低排列（向量得分、融合得分或重排序得分），
+                超出预算时先舍弃靠后的分块
+
+        Returns:
+            包含 context、sections（(分块, 去重后文本) 列表，按文档和分块顺序排列）、
+            tokens、dropped 的字典
+        """
+        ranked = list(chunks)
+        separator_tokens = self.token_counter(self.separator)
+
+        selected = {}
+        used_tokens = 0
+        dropped = 0
+
+        for chunk in ranked:
+            key = (chunk.document_id, chunk.chunk_index)
+            if key in selected:
+                continue
+
+            text = chunk.content.strip()
+            if any(text in kept.content for kept, _ in selected.values()):
+                # 完全包含在已选分块中的重复内容
+                dropped += 1
+                continue
+
+            # 去掉与已选相邻分块重叠的部分
+            previous = selected.get((chunk.document_id, chunk.chunk_index - 1))
+            if previous:
+                text = text[self._overlap_length(previous[0].content.strip(), text):]
+            following = selected.get((chunk.document_id, chunk.chunk_index + 1))
+            if following:
+                overlap = self._overlap_length(text, following[0].content.strip())
+                text = text[:len(text) - overlap]
+            text = text.strip()
+            if not text:
+                dropped += 1
+                continue
+
+            tokens = self.token_counter(text) + (separator_tokens if selected else 0)
+            if used_tokens + tokens > self.token_budget:
+                if selected:
+                    dropped += 1
+                    continue
+                # 最相关的分块本身就超出预算时，截断后放入
+                text = self.truncate(text)
+                tokens = self.token_counter(text)
+
+            selected[key] = (chunk, text)
+            used_tokens += tokens
+
+        sections = [selected[key] for key in sorted(selected)]
+        if dropped:
+            logger.debug(f"上下文组装跳过了 {dropped} 个分块（重复或超出 {self.token_budget} token 预算）")
+
+        return {
+            'context': self.separator.join(text for _, text in sections),
+            'sections': sections,
+            'tokens': used_tokens,
+            'dropped': dropped,
+        }
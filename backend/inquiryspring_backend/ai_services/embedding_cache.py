@@ -0,0 +1,161 @@
+"""
+嵌入向量缓存 - 按（嵌入模型名, 规范化文本的SHA-256）持久化分块向量
+
+课程大纲、固定的页眉页脚、小幅修改后重新上传的文档会产生大量相同的分块文本，
+命中缓存的分块直接读取之前的向量，不再运行嵌入模型。
+缓存保存在SQLite文件中（WAL模式），多个进程可以同时读写；更换嵌入模型后旧条目自然不会命中。
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# SQLite 单条语句的参数数量有限，批量查询时分段
+_QUERY_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    """规范化分块文本：合并连续空白并去掉首尾空白
+
+    嵌入模型的分词器本身忽略空白的数量，只有空白差异的文本得到相同的向量。
+    """
+    return ' '.join((text or '').split())
+
+
+def text_hash(text: str) -> str:
+    """规范化文本的SHA-256，作为缓存键的一部分"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """基于SQLite的嵌入向量缓存
+
+    向量按 float32 存储。每个线程（以及fork出的子进程）使用独立的连接，连接在第一次使用时创建。
+
+    Args:
+        path: SQLite文件路径
+        enabled: 为False时查询总是未命中，写入被忽略
+    """
+
+    def __init__(self, path: str, enabled: bool = True):
+        self.path = path
+        self.enabled = enabled
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'model TEXT NOT NULL, text_hash TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL, '
+            'PRIMARY KEY (model, text_hash)) WITHOUT ROWID'
+        )
+        conn.commit()
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        """批量读取缓存的向量，返回 {文本哈希: 向量}，未命中的哈希不在结果中"""
+        hashes = list(dict.fromkeys(hashes))
+        if not self.enabled or not hashes:
+            return {}
+
+        found = {}
+        try:
+            conn = self._connect()
+            for start in range(0, len(hashes), _QUERY_BATCH):
+                batch = hashes[start:start + _QUERY_BATCH]
+                rows = conn.execute(
+                    f'SELECT text_hash, vector FROM embeddings WHERE model = ? '
+                    f'AND text_hash IN ({",".join("?" * len(batch))})',
+                    [model, *batch]
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        except sqlite3.Error as e:
+            logger.warning(f"读取嵌入向量缓存失败: {e}")
+            found = {}
+
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def set_many(self, model: str, items: Iterable[Tuple[str, List[float]]]) -> None:
+        """批量写入 (文本哈希, 向量)，已有条目被覆盖"""
+        if not self.enabled:
+            return
+
+        rows = []
+        for key, vector in items:
+            vector = np.asarray(vector, dtype=np.float32)
+            rows.append((model, key, int(vector.shape[0]), vector.tobytes()))
+        if not rows:
+            return
+
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector) VALUES (?, ?, ?, ?)',
+                    rows
+                )
+        except sqlite3.Error as e:
+            # 写入失败只影响之后的命中率，不影响本次向量化
+            logger.warning(f"写入嵌入向量缓存失败: {e}")
+
+    def clear(self, model: Optional[str] = None) -> int:
+        """删除指定模型（默认全部）的缓存条目，返回删除的数量"""
+        conn = self._connect()
+        with conn:
+            if model is None:
+                cursor = conn.execute('DELETE FROM embeddings')
+            else:
+                cursor = conn.execute('DELETE FROM embeddings WHERE model = ?', [model])
+        return cursor.rowcount
+
+    def get_stats(self) -> Dict[str, object]:
+        """获取缓存条目数和进程内的命中统计"""
+        entries = 0
+        if self.enabled:
+            try:
+                entries = self._connect().execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            except sqlite3.Error as e:
+                logger.warning(f"统计嵌入向量缓存失败: {e}")
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'path': self.path,
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# 全局嵌入向量缓存实例
+embedding_cache = EmbeddingCache(
+    path=getattr(settings, 'EMBEDDING_CACHE_PATH',
+                 os.path.join(settings.BASE_DIR, 'vector_store', 'embedding_cache.sqlite3')),
+    enabled=getattr(settings, 'EMBEDDING_CACHE_ENABLED', True),
+)
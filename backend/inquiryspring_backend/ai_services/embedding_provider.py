@@ -0,0 +1,163 @@
+"""
+嵌入模型提供器 - 进程内共享的句向量模型，避免每个RAGEngine重复加载
+"""
+import logging
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from .embedding_cache import embedding_cache, text_hash
+
+logger = logging.getLogger(__name__)
+
+# 默认嵌入模型
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+
+
+class EmbeddingProvider:
+    """进程级嵌入模型提供器
+
+    模型在第一次使用时加载（或由 warm_up 预加载），之后所有 RAGEngine 共享同一实例。
+    加载过程由锁保护，并发请求只会触发一次加载。
+    """
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._embeddings: Optional[HuggingFaceEmbeddings] = None
+        self._lock = threading.Lock()
+
+        # 加载指标
+        self.load_time: Optional[float] = None
+        self.memory_bytes: Optional[int] = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._embeddings is not None
+
+    def get_embeddings(self) -> HuggingFaceEmbeddings:
+        """获取共享的嵌入模型，首次调用时加载"""
+        if self._embeddings is None:
+            with self._lock:
+                # 双重检查，避免等待锁的线程重复加载
+                if self._embeddings is None:
+                    self._embeddings = self._load()
+        return self._embeddings
+
+    def _load(self) -> HuggingFaceEmbeddings:
+        logger.info(f"正在加载嵌入模型 {self.model_name}...")
+        start_time = time.time()
+
+        embeddings = HuggingFaceEmbeddings(model_name=self.model_name)
+
+        self.load_time = time.time() - start_time
+        self.memory_bytes = self._measure_memory(embeddings)
+        logger.info(
+            f"嵌入模型 {self.model_name} 加载完成，耗时 {self.load_time:.2f}s，"
+            f"参数内存约 {self.memory_bytes / 1024 / 1024:.1f}MB"
+        )
+        return embeddings
+
+    @staticmethod
+    def _get_model(embeddings: HuggingFaceEmbeddings):
+        """取出底层的 SentenceTransformer 模型（不同版本的属性名不同）"""
+        model = getattr(embeddings, '_client', None)
+        if model is None:
+            model = getattr(embeddings, 'client', None)
+        return model
+
+    @classmethod
+    def _measure_memory(cls, embeddings: HuggingFaceEmbeddings) -> int:
+        """统计模型参数和缓冲区占用的内存字节数"""
+        try:
+            model = cls._get_model(embeddings)
+            total = sum(p.numel() * p.element_size() for p in model.parameters())
+            total += sum(b.numel() * b.element_size() for b in model.buffers())
+            return total
+        except Exception as e:
+            logger.warning(f"统计嵌入模型内存失败: {e}")
+            return 0
+
+    def embed_documents(self, texts: List[str], batch_size: int = None) -> List[List[float]]:
+        """批量编码文本
+
+        直接调用 SentenceTransformer.encode，由其按 batch_size 做向量化批处理。
+
+        Args:
+            texts: 待编码的文本列表
+            batch_size: 每批编码的文本数，默认使用模型的 encode_kwargs 配置
+
+        Returns:
+            与 texts 一一对应的向量列表
+        """
+        if not texts:
+            return []
+
+        embeddings = self.get_embeddings()
+        model = self._get_model(embeddings)
+        if model is None:
+            # 无法取得底层模型时退回 LangChain 接口
+            return embeddings.embed_documents(texts)
+
+        encode_kwargs = dict(embeddings.encode_kwargs or {})
+        if batch_size:
+            encode_kwargs['batch_size'] = batch_size
+
+        # 与 HuggingFaceEmbeddings 保持一致：编码前将换行替换为空格
+        texts = [text.replace("\n", " ") for text in texts]
+        vectors = model.encode(texts, show_progress_bar=False, **encode_kwargs)
+        return vectors.tolist()
+
+    def embed_documents_cached(self, texts: List[str], batch_size: int = None) -> Tuple[List[List[float]], int]:
+        """批量编码文本，先查询持久化的嵌入向量缓存
+
+        缓存按（模型名, 规范化文本的哈希）查找，只有未命中的文本会运行模型，结果写回缓存。
+        同一批中重复的文本只编码一次。
+
+        Returns:
+            (与 texts 一一对应的向量列表, 命中缓存的文本数)
+        """
+        if not texts:
+            return [], 0
+
+        hashes = [text_hash(text) for text in texts]
+        cached = embedding_cache.get_many(self.model_name, hashes)
+
+        missing = {}
+        for text, key in zip(texts, hashes):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embed_documents(list(missing.values()), batch_size=batch_size)
+            computed = dict(zip(missing, vectors))
+            embedding_cache.set_many(self.model_name, computed.items())
+            cached.update(computed)
+
+        hits = sum(1 for key in hashes if key not in missing)
+        return [cached[key] for key in hashes], hits
+
+    def embed_query(self, text: str) -> List[float]:
+        """编码单条查询文本"""
+        return self.get_embeddings().embed_query(text)
+
+    def warm_up(self) -> None:
+        """预加载模型，加载失败只记录日志"""
+        try:
+            self.get_embeddings()
+        except Exception as e:
+            logger.exception(f"预加载嵌入模型失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取加载耗时和内存占用指标"""
+        return {
+            'model_name': self.model_name,
+            'loaded': self.is_loaded,
+            'load_time': self.load_time,
+            'memory_bytes': self.memory_bytes,
+            'cache': embedding_cache.get_stats(),
+        }
+
+
+# 全局嵌入模型提供器实例
+embedding_provider = EmbeddingProvider()
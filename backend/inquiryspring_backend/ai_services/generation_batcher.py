@@ -0,0 +1,183 @@
+"""
+本地模型动态批处理 - 在短时间窗口内收集并发请求，合并为一个批次调用 model.generate
+
+CPU上逐条生成时，并发请求只能排队执行，每次调用都要承担完整的前向开销。
+批处理器把生成参数相同的请求左填充到同一长度后一起生成，再把结果分发给各自的调用方。
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Deque, Dict, List, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class _GenerationRequest:
+    __slots__ = ('prompt', 'gen_kwargs', 'key', 'future', 'enqueued_at')
+
+    def __init__(self, prompt: str, gen_kwargs: Dict[str, Any]):
+        self.prompt = prompt
+        self.gen_kwargs = gen_kwargs
+        # 只有生成参数完全相同的请求才能合并到同一批次
+        self.key = tuple(sorted(gen_kwargs.items()))
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class GenerationBatcher:
+    """本地模型的批处理调度器
+
+    Args:
+        model: 已加载的因果语言模型
+        tokenizer: 对应的分词器
+        device: 模型所在设备
+        max_batch_size: 每批最多合并的请求数
+        max_wait: 收到第一个请求后最多等待多久（秒）以凑满批次
+    """
+
+    def __init__(self, model, tokenizer, device: str, max_batch_size: int = 8, max_wait: float = 0.02):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+
+        # 批量生成需要左填充，保证每条序列的末尾都紧接着生成的内容
+        self.tokenizer.padding_side = 'left'
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        self._pending: Deque[_GenerationRequest] = deque()
+        self._condition = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+
+        # 统计信息
+        self.batches = 0
+        self.requests = 0
+        self.generated_tokens = 0
+        self.busy_time = 0.0
+        self.queue_wait_time = 0.0
+
+    def submit(self, prompt: str, gen_kwargs: Dict[str, Any]) -> Future:
+        """提交一个生成请求，返回的Future结果为包含 text、input_tokens、output_tokens 的字典"""
+        request = _GenerationRequest(prompt, gen_kwargs)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("批处理器已关闭")
+            self._ensure_worker()
+            self._pending.append(request)
+            self._condition.notify()
+        return request.future
+
+    def generate(self, prompt: str, gen_kwargs: Dict[str, Any], timeout: float = None) -> Dict[str, Any]:
+        """提交请求并等待结果"""
+        return self.submit(prompt, gen_kwargs).result(timeout=timeout)
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='local-model-batcher', daemon=True)
+            self._worker.start()
+
+    def _collect_batch(self) -> List[_GenerationRequest]:
+        """等待第一个请求，然后在 max_wait 内收集生成参数相同的请求"""
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if not self._pending:
+                return []
+
+            first = self._pending.popleft()
+            batch = [first]
+            deadline = first.enqueued_at + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                # 取出队列中所有可合并的请求，其余保持原有顺序
+                remaining = deque()
+                while self._pending and len(batch) < self.max_batch_size:
+                    request = self._pending.popleft()
+                    if request.key == first.key:
+                        batch.append(request)
+                    else:
+                        remaining.append(request)
+                remaining.extend(self._pending)
+                self._pending = remaining
+
+                timeout = deadline - time.perf_counter()
+                if len(batch) >= self.max_batch_size or timeout <= 0 or self._closed:
+                    break
+                self._condition.wait(timeout)
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            if not batch:
+                return
+            try:
+                self._generate_batch(batch)
+            except Exception as e:
+                logger.exception(f"本地模型批量生成失败: {e}")
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _generate_batch(self, batch: List[_GenerationRequest]) -> None:
+        start_time = time.perf_counter()
+        prompts = [request.prompt for request in batch]
+
+        with torch.no_grad():
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+            padded_length = inputs.input_ids.shape[1]
+            outputs = self.model.generate(
+                **inputs,
+                **batch[0].gen_kwargs,
+                pad_token_id=self.tokenizer.pad_token_id
+            )
+
+        input_lengths = inputs.attention_mask.sum(dim=1).tolist()
+        batch_tokens = 0
+        for request, output, input_length in zip(batch, outputs, input_lengths):
+            new_tokens = output[padded_length:]
+            output_tokens = int((new_tokens != self.tokenizer.pad_token_id).sum())
+            batch_tokens += output_tokens
+            request.future.set_result({
+                'text': self.tokenizer.decode(new_tokens, skip_special_tokens=True),
+                'input_tokens': int(input_length),
+                'output_tokens': output_tokens,
+                'batch_size': len(batch),
+            })
+
+        elapsed = time.perf_counter() - start_time
+        with self._condition:
+            self.batches += 1
+            self.requests += len(batch)
+            self.generated_tokens += batch_tokens
+            self.busy_time += elapsed
+            self.queue_wait_time += sum(start_time - request.enqueued_at for request in batch)
+        logger.debug(f"批量生成完成: {len(batch)} 个请求, {batch_tokens} tokens, 耗时 {elapsed:.2f}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取批处理统计信息"""
+        with self._condition:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait': self.max_wait,
+                'pending': len(self._pending),
+                'batches': self.batches,
+                'requests': self.requests,
+                'avg_batch_size': round(self.requests / self.batches, 2) if self.batches else 0.0,
+                'generated_tokens': self.generated_tokens,
+                'tokens_per_second': round(self.generated_tokens / self.busy_time, 2) if self.busy_time else 0.0,
+                'avg_queue_wait': round(self.queue_wait_time / self.requests, 4) if self.requests else 0.0,
+            }
+
+    def close(self) -> None:
+        """停止后台线程，已在队列中的请求仍会处理完"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
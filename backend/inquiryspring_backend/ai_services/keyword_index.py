@@ -0,0 +1,177 @@
+"""
+关键词索引 - 基于 DocumentChunk.content 的BM25倒排索引
+
+向量检索对公式名、课程代码等精确词语不敏感，关键词检索作为补充与向量检索结果融合。
+每个文档的倒排索引在第一次检索时从数据库构建并缓存在进程内；分块数量或最大ID变化时自动重建。
+跨文档检索时合并各文档的词频统计，得分与在所有分块上建立单个索引一致。
+"""
+import logging
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from inquiryspring_backend.documents.models import DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+# 中文分词库为可选依赖，未安装时中文按相邻两个字切分
+try:
+    import jieba
+    jieba.setLogLevel(logging.WARNING)
+    JIEBA_AVAILABLE = True
+except ImportError:
+    JIEBA_AVAILABLE = False
+
+# 英文单词、数字及带连接符的代码（如 cs-101、v2.0），或连续的中文字符
+TOKEN_RE = re.compile(r'[a-z0-9]+(?:[._\-][a-z0-9]+)*|[\u4e00-\u9fff]+')
+CJK_RUN_RE = re.compile(r'[\u4e00-\u9fff]+')
+
+
+def _cjk_bigrams(run: str) -> List[str]:
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def tokenize(text: str) -> List[str]:
+    """把文本切分为检索用的词项
+
+    英文和数字按单词切分并转为小写；中文在安装 jieba 时使用搜索引擎模式分词，否则按相邻两个字切分。
+    """
+    text = (text or '').lower()
+    tokens = []
+    for match in TOKEN_RE.finditer(text):
+        token = match.group()
+        if not CJK_RUN_RE.fullmatch(token):
+            tokens.append(token)
+        elif JIEBA_AVAILABLE:
+            tokens.extend(word for word in jieba.lcut_for_search(token) if word.strip())
+        else:
+            tokens.extend(_cjk_bigrams(token))
+    return tokens
+
+
+class BM25Index:
+    """单个文档的倒排索引"""
+
+    def __init__(self, chunks: List[Tuple[int, str]]):
+        # 词项 -> [(分块ID, 词频)]
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        # 分块ID -> 词项数
+        self.lengths: Dict[int, int] = {}
+        for chunk_id, content in chunks:
+            term_counts = Counter(tokenize(content))
+            self.lengths[chunk_id] = sum(term_counts.values())
+            for term, count in term_counts.items():
+                self.postings.setdefault(term, []).append((chunk_id, count))
+        self.total_length = sum(self.lengths.values())
+
+
+def bm25_search(indexes: List[BM25Index], query: str, k: int,
+                k1: float = 1.5, b: float = 0.75) -> List[Tuple[int, float]]:
+    """在多个倒排索引上按BM25检索，返回得分最高的 k 个 (分块ID, 得分)"""
+    terms = set(tokenize(query))
+    chunk_count = sum(len(index.lengths) for index in indexes)
+    if not terms or not chunk_count:
+        return []
+    avg_length = sum(index.total_length for index in indexes) / chunk_count or 1.0
+
+    scores: Dict[int, float] = {}
+    for term in terms:
+        postings = [(index, index.postings[term]) for index in indexes if term in index.postings]
+        doc_freq = sum(len(entries) for _, entries in postings)
+        if not doc_freq:
+            continue
+        idf = math.log(1 + (chunk_count - doc_freq + 0.5) / (doc_freq + 0.5))
+        for index, entries in postings:
+            for chunk_id, freq in entries:
+                norm = k1 * (1 - b + b * index.lengths[chunk_id] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * freq * (k1 + 1) / (freq + norm)
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return ranked[:k]
+
+
+class KeywordIndex:
+    """按文档缓存倒排索引
+
+    Args:
+        max_documents: 进程内最多缓存的文档索引数，超出后按LRU淘汰
+    """
+
+    def __init__(self, max_documents: int = 64):
+        self.max_documents = max(1, max_documents)
+        self._indexes: "OrderedDict[int, Tuple[tuple, BM25Index]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signatures(document_ids: List[int]) -> Dict[int, tuple]:
+        """各文档当前的分块数量和最大分块ID，用于判断缓存的索引是否过期"""
+        rows = (
+            DocumentChunk.objects.filter(document_id__in=document_ids)
+            .values('document_id')
+            .annotate(count=Count('id'), max_id=Max('id'))
+        )
+        return {row['document_id']: (row['count'], row['max_id']) for row in rows}
+
+    def _get_index(self, document_id: int, signature: tuple) -> BM25Index:
+        with self._lock:
+            cached = self._indexes.get(document_id)
+            if cached and cached[0] == signature:
+                self._indexes.move_to_end(document_id)
+                return cached[1]
+
+        chunks = list(
+            DocumentChunk.objects.filter(document_id=document_id).values_list('id', 'content')
+        )
+        index = BM25Index(chunks)
+        logger.info(f"已为文档 {document_id} 构建关键词索引，共 {len(chunks)} 个分块、{len(index.postings)} 个词项")
+
+        with self._lock:
+            self._indexes[document_id] = (signature, index)
+            self._indexes.move_to_end(document_id)
+            while len(self._indexes) > self.max_documents:
+                self._indexes.popitem(last=False)
+        return index
+
+    def search(self, query: str, document_ids: List[int], k: int) -> List[Tuple[int, float]]:
+        """在指定文档的分块中检索，返回按得分从高到低排序的 (分块ID, 得分)"""
+        signatures = self._signatures(document_ids)
+        indexes = [self._get_index(document_id, signature) for document_id, signature in signatures.items()]
+        return bm25_search(indexes, query, k)
+
+    def invalidate_document(self, document_id: int) -> None:
+        """丢弃文档的缓存索引，下次检索时重建"""
+        with self._lock:
+            self._indexes.pop(document_id, None)
+
+
+def reciprocal_rank_fusion(rankings: List[Tuple[List[int], float]], rrf_k: int = 60) -> List[Tuple[int, float]]:
+    """按倒数排名融合（RRF）多路检索结果
+
+    Args:
+        rankings: [(按相关度排序的分块ID列表, 权重)]
+        rrf_k: 平滑常数，越大排名靠后的结果权重下降越慢
+
+    Returns:
+        按融合得分从高到低排序的 (分块ID, 得分)，得分已除以最高可能得分，范围为 0~1
+    """
+    scores: Dict[int, float] = {}
+    for ranked_ids, weight in rankings:
+        for rank, chunk_id in enumerate(ranked_ids, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (rrf_k + rank)
+    max_score = sum(weight for _, weight in rankings) / (rrf_k + 1) or 1.0
+    return sorted(
+        ((chunk_id, score / max_score) for chunk_id, score in scores.items()),
+        key=lambda item: item[1],
+        reverse=True
+    )
+
+
+# 全局关键词索引实例
+keyword_index = KeywordIndex(max_documents=getattr(settings, 'KEYWORD_INDEX_MAX_DOCUMENTS', 64))
@@ -0,0 +1,140 @@
+"""
+LLM结果缓存 - 相同模型、相同提示词和生成参数的请求直接返回之前的结果
+
+支持两种后端：
+- memory: 进程内LRU缓存
+- django: 使用Django缓存框架（CACHES中配置的别名），配合 FileBasedCache 即可持久化到磁盘，
+  配合 Redis/Memcached 可在多个进程间共享
+"""
+import copy
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 缓存键前缀，缓存结构变化时修改版本号即可使旧条目失效
+CACHE_KEY_PREFIX = "llm:v1:"
+
+
+def make_cache_key(model_id: str, system_prompt: Optional[str], prompt: str,
+                   temperature: float, max_tokens: int) -> str:
+    """根据模型和生成参数计算缓存键"""
+    payload = json.dumps(
+        [model_id, system_prompt, prompt, temperature, max_tokens],
+        ensure_ascii=False
+    )
+    return CACHE_KEY_PREFIX + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryLLMCache:
+    """进程内LRU缓存
+
+    写入和读取时都复制结果字典，调用方修改返回的结果（如添加检索到的分块）不会影响缓存的条目。
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(value)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'backend': 'memory',
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class DjangoLLMCache:
+    """基于Django缓存框架的缓存"""
+
+    def __init__(self, alias: str = 'default', timeout: Optional[int] = None):
+        from django.core.cache import caches
+
+        self.alias = alias
+        self.timeout = timeout
+        self._cache = caches[alias]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._cache.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self._cache.set(key, value, self.timeout)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'backend': 'django',
+            'alias': self.alias,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """按配置获取进程内共享的LLM结果缓存，LLM_CACHE_BACKEND 为 none 时返回None"""
+    global _llm_cache
+    backend = getattr(settings, 'LLM_CACHE_BACKEND', 'memory')
+    if not backend or backend == 'none':
+        return None
+
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                if backend == 'django':
+                    _llm_cache = DjangoLLMCache(
+                        alias=getattr(settings, 'LLM_CACHE_ALIAS', 'default'),
+                        timeout=getattr(settings, 'LLM_CACHE_TIMEOUT', None)
+                    )
+                else:
+                    if backend != 'memory':
+                        logger.warning(f"未知的LLM缓存后端: {backend}，使用内存缓存")
+                    _llm_cache = MemoryLLMCache(
+                        max_entries=getattr(settings, 'LLM_CACHE_MAX_ENTRIES', 512)
+                    )
+    return _llm_cache
@@ -1,26 +1,44 @@
 """
 LLM客户端模块 - 用于与不同的LLM服务提供商进行通信
 """
+import asyncio
 import os
 import json
 import time
 import logging
-from typing import Dict, Any, Optional, List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Iterator, AsyncIterator, Tuple
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from .models import AIModel, AITaskLog
+from .context_assembler import estimate_tokens
+from .llm_cache import get_llm_cache, make_cache_key
+from .model_registry import local_model_registry
+from .task_log_writer import task_log_writer
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import StoppingCriteriaList, TextIteratorStreamer
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
 from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
 class LLMClientFactory:
+    """LLM客户端工厂
+
+    创建的客户端按 (model_id, provider) 缓存并在线程间共享，热路径上不再查询数据库或重新初始化SDK。
+    AIModel 保存或删除时通过信号清空缓存（见 apps.py）；使用 QuerySet.update() 批量修改后需手动调用 clear_cache()。
+    """
     
-    @staticmethod
-    def create_client(model_id=None, provider=None):
+    _clients: Dict[tuple, "BaseLLMClient"] = {}
+    _lock = threading.Lock()
+    
+    @classmethod
+    def create_client(cls, model_id=None, provider=None):
         """
-        创建LLM客户端
+        获取LLM客户端，相同参数的调用返回同一个实例
         
         Args:
             model_id: 模型ID，如果提供则直接使用该ID查找模型
@@ -29,6 +47,29 @@ class LLMClientFactory:
         Returns:
             LLMClient子类的实例
         """
+        key = (model_id, provider)
+        client = cls._clients.get(key)
+        if client is not None:
+            return client
+        
+        with cls._lock:
+            client = cls._clients.get(key)
+            if client is None:
+                client = cls._build_client(model_id, provider)
+                cls._clients[key] = client
+        return client
+    
+    @classmethod
+    def clear_cache(cls, *args, **kwargs) -> None:
+        """清空客户端缓存，可直接作为 AIModel 的 post_save/post_delete 信号处理器"""
+        with cls._lock:
+            if cls._clients:
+                logger.info(f"AI模型配置已变更，清除 {len(cls._clients)} 个缓存的LLM客户端")
+            cls._clients = {}
+    
+    @staticmethod
+    def _build_client(model_id=None, provider=None):
+        """查询模型配置并创建对应的客户端"""
         try:
             # 获取模型配置
             if model_id:
@@ -73,6 +114,9 @@ class LLMClientFactory:
 class BaseLLMClient:
     """LLM客户端基类"""
     
+    # 提供商名称，与 AIModel.provider 一致
+    provider = None
+    
     def __init__(self, model_config: Optional[AIModel]):
         self.model_config = model_config
         self.model_id = model_config.model_id if model_config else "gpt-3.5-turbo"
@@ -92,13 +136,19 @@ class BaseLLMClient:
             self.api_base = None
     
     def _create_task_log(self, task_type: str, input_data: Dict) -> AITaskLog:
-        """创建任务日志"""
-        return AITaskLog.objects.create(
+        """创建任务日志
+
+        开启 AI_TASK_LOG_ASYNC 时只在内存中创建，完成后由 task_log_writer 在后台写入数据库
+        """
+        task_log = AITaskLog(
             task_type=task_type,
             model=self.model_config,
             input_data=input_data,
             status='processing'
         )
+        if not getattr(settings, 'AI_TASK_LOG_ASYNC', True):
+            task_log.save()
+        return task_log
     
     def _update_task_log(self, task_log: AITaskLog, output_data: Dict, 
                         status: str, tokens_used: int, 
@@ -110,13 +160,154 @@ class BaseLLMClient:
         task_log.processing_time = processing_time
         task_log.error_message = error_msg
         task_log.completed_at = timezone.now()
-        task_log.save()
+        if getattr(settings, 'AI_TASK_LOG_ASYNC', True):
+            task_log_writer.submit(task_log)
+        else:
+            task_log.save()
+    
+    def _estimate_tokens(self, text: str) -> int:
+        """估算文本包含的token数量 (简单估算)"""
+        return estimate_tokens(text)
+    
+    def count_tokens(self, text: str) -> int:
+        """计算文本的 token 数量，子类可使用模型自带的分词器覆盖"""
+        return self._estimate_tokens(text)
+    
+    def _cache_available(self) -> bool:
+        """当前客户端的结果是否可以缓存（模拟响应不缓存）"""
+        return True
+    
+    def is_mock(self) -> bool:
+        """当前客户端是否只能返回模拟响应（未配置API密钥、本地模型加载失败等）"""
+        return not self._cache_available()
+    
+    def _should_use_cache(self, temperature: float, use_cache: Optional[bool]) -> bool:
+        if use_cache is False or not self._cache_available():
+            return False
+        if use_cache is None and temperature > 0:
+            # 采样生成的结果本身是随机的，默认不缓存，除非显式开启
+            return getattr(settings, 'LLM_CACHE_SAMPLED_RESPONSES', False)
+        return True
     
     def generate_text(self, prompt: str, system_prompt: str = None, 
                     max_tokens: int = None, temperature: float = None,
-                    task_type: str = "chat") -> Dict[str, Any]:
+                    task_type: str = "chat", use_cache: Optional[bool] = None) -> Dict[str, Any]:
         """
-        生成文本（由子类实现）
+        生成文本，相同模型和参数的请求优先从缓存返回
+        
+        Args:
+            prompt: 主提示词
+            system_prompt: 系统提示词
+            max_tokens: 最大生成令牌数
+            temperature: 温度参数
+            task_type: 任务类型
+            use_cache: None 时仅缓存 temperature 为0的请求，True 强制使用缓存，False 跳过缓存
+            
+        Returns:
+            包含生成结果的字典，命中缓存时 cached 为 True
+        """
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+        if temperature is None:
+            temperature = self.temperature
+        
+        cache_key, cached = self._lookup_cache(prompt, system_prompt, max_tokens, temperature, task_type, use_cache)
+        if cached is not None:
+            return cached
+        
+        result = self._generate_text(prompt, system_prompt, max_tokens, temperature, task_type)
+        self._store_cache(cache_key, result)
+        return result
+    
+    async def agenerate_text(self, prompt: str, system_prompt: str = None,
+                             max_tokens: int = None, temperature: float = None,
+                             task_type: str = "chat", use_cache: Optional[bool] = None) -> Dict[str, Any]:
+        """generate_text 的异步版本，参数和返回值相同，可在ASGI视图中直接 await"""
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+        if temperature is None:
+            temperature = self.temperature
+        
+        cache_key, cached = self._lookup_cache(prompt, system_prompt, max_tokens, temperature, task_type, use_cache)
+        if cached is not None:
+            return cached
+        
+        result = await self._agenerate_text(prompt, system_prompt, max_tokens, temperature, task_type)
+        self._store_cache(cache_key, result)
+        return result
+    
+    def _lookup_cache(self, prompt: str, system_prompt: Optional[str], max_tokens: int,
+                      temperature: float, task_type: str,
+                      use_cache: Optional[bool]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """查询LLM结果缓存
+        
+        Returns:
+            (缓存键, 命中的结果)；不使用缓存时缓存键为None，未命中时结果为None
+        """
+        cache = get_llm_cache() if self._should_use_cache(temperature, use_cache) else None
+        if cache is None:
+            return None, None
+        cache_key = make_cache_key(self.model_id, system_prompt, prompt, temperature, max_tokens)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"LLM缓存命中: {task_type} ({self.model_id})")
+            return cache_key, dict(cached, cached=True)
+        return cache_key, None
+    
+    @staticmethod
+    def _store_cache(cache_key: Optional[str], result: Dict[str, Any]) -> None:
+        # 出错的结果和模型加载失败时返回的模拟响应不缓存
+        cache = get_llm_cache() if cache_key is not None else None
+        if cache is not None and not result.get("error") and result.get("provider") != "mock":
+            cache.set(cache_key, result)
+    
+    def generate_text_stream(self, prompt: str, system_prompt: str = None,
+                             max_tokens: int = None, temperature: float = None,
+                             task_type: str = "chat") -> Iterator[str]:
+        """
+        流式生成文本，逐段返回；不支持流式输出的客户端一次性返回完整结果
+        
+        Raises:
+            RuntimeError: 生成失败
+        """
+        result = self.generate_text(prompt, system_prompt, max_tokens, temperature, task_type, use_cache=False)
+        if result.get("error"):
+            raise RuntimeError(result["error"])
+        yield result["text"]
+    
+    async def agenerate_text_stream(self, prompt: str, system_prompt: str = None,
+                                    max_tokens: int = None, temperature: float = None,
+                                    task_type: str = "chat") -> AsyncIterator[str]:
+        """generate_text_stream 的异步版本，可在ASGI视图中直接 async for
+        
+        同步生成器在专用线程中逐段推进。调用方提前结束迭代（如客户端断开）时，
+        在同一线程中关闭生成器，由它停止生成并记录任务日志。
+        """
+        stream = self.generate_text_stream(prompt, system_prompt, max_tokens, temperature, task_type)
+        loop = asyncio.get_running_loop()
+        # 单线程执行器保证关闭生成器时不会与正在进行的 next 并发
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-stream")
+        
+        def close():
+            try:
+                stream.close()
+            finally:
+                connection.close()
+        
+        try:
+            while True:
+                piece = await loop.run_in_executor(executor, next, stream, None)
+                if piece is None:
+                    return
+                yield piece
+        finally:
+            await loop.run_in_executor(executor, close)
+            executor.shutdown(wait=False)
+    
+    def _generate_text(self, prompt: str, system_prompt: Optional[str],
+                       max_tokens: int, temperature: float, task_type: str) -> Dict[str, Any]:
+        """
+        调用模型生成文本（由子类实现）
         
         Args:
             prompt: 主提示词
@@ -129,14 +320,40 @@ class BaseLLMClient:
             包含生成结果的字典
         """
         raise NotImplementedError("子类必须实现此方法")
+    
+    async def _agenerate_text(self, prompt: str, system_prompt: Optional[str],
+                              max_tokens: int, temperature: float, task_type: str) -> Dict[str, Any]:
+        """异步生成文本，默认在线程池中执行同步实现；支持原生异步调用的子类可覆盖"""
+        return await sync_to_async(self._generate_text, thread_sensitive=False)(
+            prompt, system_prompt, max_tokens, temperature, task_type
+        )
+
+
+def _configure_genai(api_key: str) -> None:
+    """配置Gemini SDK，同一个API密钥只配置一次"""
+    global _configured_api_key
+    with _genai_lock:
+        if _configured_api_key != api_key:
+            genai.configure(api_key=api_key)
+            _configured_api_key = api_key
+
+
+# genai.configure 是进程级的全局设置
+_genai_lock = threading.Lock()
+_configured_api_key = None
 
 
 class GeminiClient(BaseLLMClient):
     """Google Gemini API客户端"""
     
+    provider = "gemini"
+    
     def __init__(self, model_config: Optional[AIModel]):
         super().__init__(model_config)
         
+        # 按模型ID复用的 GenerativeModel 实例
+        self._models: Dict[str, Any] = {}
+        
         api_key = self.api_key
         if model_config and model_config.api_key:
             api_key = model_config.api_key
@@ -158,7 +375,7 @@ class GeminiClient(BaseLLMClient):
             return
             
         try:
-            genai.configure(api_key=api_key)
+            _configure_genai(api_key)
             self.genai = genai
         except Exception as e:
             logger.error(f"配置Gemini API失败: {str(e)}，将使用模拟响应")
@@ -173,23 +390,6 @@ class GeminiClient(BaseLLMClient):
         else:
             logger.info(f"GeminiClient: Using pre-existing model_id: {self.model_id}")
     
-    def _estimate_tokens(self, text: str) -> int:
-        """估算文本包含的token数量 (简单估算)
-        
-        Args:
-            text: 要估算的文本
-            
-        Returns:
-            估计的token数量
-        """
-        # 简单估算：每个汉字约等于1个token，每4个英文字符约等于1个token
-        # 这是一个简化估算，实际token数会根据模型分词器的具体实现有所不同
-        chinese_count = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-        english_chars = sum(1 for c in text if c.isascii() and (c.isalnum() or c.isspace()))
-        english_tokens = english_chars / 4
-        
-        return int(chinese_count + english_tokens)
-    
     def count_tokens(self, text: str) -> int:
         """使用 Gemini API 准确计算文本的 token 数量
         
@@ -205,7 +405,7 @@ class GeminiClient(BaseLLMClient):
             
         try:
             # 使用模型的 countTokens 方法准确计算
-            model = self.genai.GenerativeModel(self.model_id)
+            model = self._get_model()
             result = model.count_tokens(text)
             return result.total_tokens
         except Exception as e:
@@ -213,16 +413,167 @@ class GeminiClient(BaseLLMClient):
             # 出错时回退到估算方法
             return self._estimate_tokens(text)
     
-    def generate_text(self, prompt: str, system_prompt: str = None, 
-                    max_tokens: int = None, temperature: float = None,
-                    task_type: str = "chat") -> Dict[str, Any]:
-        """使用Gemini API生成文本"""
-        if not max_tokens:
+    def _get_model(self):
+        """获取当前模型ID对应的 GenerativeModel，创建后复用"""
+        model = self._models.get(self.model_id)
+        if model is None:
+            model = self.genai.GenerativeModel(self.model_id)
+            self._models[self.model_id] = model
+        return model
+    
+    def _cache_available(self) -> bool:
+        return self.genai is not None
+    
+    @staticmethod
+    def _build_generation_args(max_tokens: int, temperature: float):
+        """构建生成参数和安全设置"""
+        generation_config = {
+            "temperature": temperature,
+            "max_output_tokens": max_tokens,
+            "top_p": 0.95,
+            "top_k": 40,
+        }
+        
+        safety_settings = {
+            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+        }
+        return generation_config, safety_settings
+    
+    def generate_text_stream(self, prompt: str, system_prompt: str = None,
+                             max_tokens: int = None, temperature: float = None,
+                             task_type: str = "chat") -> Iterator[str]:
+        """使用Gemini流式API生成文本，逐段返回"""
+        if not self.genai:
+            yield from super().generate_text_stream(prompt, system_prompt, max_tokens, temperature, task_type)
+            return
+        
+        if max_tokens is None:
             max_tokens = self.max_tokens
-            
-        if not temperature:
+        if temperature is None:
             temperature = self.temperature
+        if not system_prompt:
+            system_prompt = "你是一名资深教学问答专家。请根据用户的问题提供准确、有用的回答。"
+        
+        task_log = self._create_task_log(task_type, {
+            "prompt": prompt,
+            "system_prompt": system_prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True
+        })
+        start_time = time.time()
+        full_prompt = f"{system_prompt}\n\n{prompt}"
+        pieces = []
+        
+        try:
+            generation_config, safety_settings = self._build_generation_args(max_tokens, temperature)
+            model = self._get_model()
+            response = model.generate_content(
+                full_prompt,
+                generation_config=generation_config,
+                safety_settings=safety_settings,
+                stream=True
+            )
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # 被安全策略拦截等没有文本的片段
+                    continue
+                if text:
+                    pieces.append(text)
+                    yield text
+        except GeneratorExit:
+            self._update_task_log(task_log, {}, "failed", 0, time.time() - start_time, "客户端中断了流式响应")
+            raise
+        except Exception as e:
+            logger.exception(f"Gemini流式API调用失败: {e}")
+            self._update_task_log(task_log, {}, "failed", 0, time.time() - start_time, str(e))
+            raise
+        
+        response_text = "".join(pieces)
+        usage = getattr(response, "usage_metadata", None)
+        tokens_used = getattr(usage, "total_token_count", 0) or (
+            self._estimate_tokens(full_prompt) + self._estimate_tokens(response_text)
+        )
+        self._update_task_log(
+            task_log,
+            {"result": {"text": response_text, "tokens_used": tokens_used, "model": self.model_id}},
+            "completed",
+            tokens_used,
+            time.time() - start_time
+        )
+    
+    async def _agenerate_text(self, prompt: str, system_prompt: Optional[str],
+                              max_tokens: int, temperature: float, task_type: str) -> Dict[str, Any]:
+        """使用Gemini异步API生成文本，等待响应期间不占用线程"""
+        if not self.genai:
+            return await super()._agenerate_text(prompt, system_prompt, max_tokens, temperature, task_type)
+        
+        if not system_prompt:
+            system_prompt = "你是一名资深教学问答专家。请根据用户的问题提供准确、有用的回答。"
+        
+        task_log = await sync_to_async(self._create_task_log)(task_type, {
+            "prompt": prompt,
+            "system_prompt": system_prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        })
+        start_time = time.time()
+        full_prompt = f"{system_prompt}\n\n{prompt}"
+        
+        try:
+            generation_config, safety_settings = self._build_generation_args(max_tokens, temperature)
+            response = await self._get_model().generate_content_async(
+                full_prompt,
+                generation_config=generation_config,
+                safety_settings=safety_settings
+            )
+            
+            # 处理响应，确保text属性存在
+            try:
+                response_text = response.text
+            except Exception as text_error:
+                candidate = response.candidates[0] if getattr(response, 'candidates', None) else None
+                if candidate is None or not getattr(candidate, 'content', None):
+                    raise ValueError(f"响应中缺少文本内容: {str(text_error)}")
+                response_text = str(candidate.content)
+            
+            # 优先使用响应自带的用量，避免额外的 countTokens 请求
+            usage = getattr(response, "usage_metadata", None)
+            tokens_used = getattr(usage, "total_token_count", 0) or (
+                self._estimate_tokens(full_prompt) + self._estimate_tokens(response_text)
+            )
+            
+            result = {
+                "text": response_text,
+                "tokens_used": tokens_used,
+                "model": self.model_id,
+                "finish_reason": "stop"
+            }
+            await sync_to_async(self._update_task_log)(
+                task_log, {"result": result}, "completed", tokens_used, time.time() - start_time
+            )
+            return result
             
+        except Exception as e:
+            error_msg = str(e)
+            logger.exception(f"Gemini异步API调用失败: {error_msg}")
+            await sync_to_async(self._update_task_log)(
+                task_log, {}, "failed", 0, time.time() - start_time, error_msg
+            )
+            return {
+                "error": error_msg,
+                "text": "很抱歉，Gemini服务暂时不可用，请稍后再试。",
+                "model": self.model_id
+            }
+    
+    def _generate_text(self, prompt: str, system_prompt: Optional[str],
+                       max_tokens: int, temperature: float, task_type: str) -> Dict[str, Any]:
+        """使用Gemini API生成文本"""
         if not system_prompt:
             system_prompt = "你是一名资深教学问答专家。请根据用户的问题提供准确、有用的回答。"
             
@@ -243,21 +594,8 @@ class GeminiClient(BaseLLMClient):
                 response_text = f"[Gemini模拟响应] 对于问题: {prompt}"
                 tokens_used = 50
             else:
-                # 配置生成参数
-                generation_config = {
-                    "temperature": temperature,
-                    "max_output_tokens": max_tokens,
-                    "top_p": 0.95,
-                    "top_k": 40,
-                }
-                
-                # 安全设置配置
-                safety_settings = {
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
+                # 配置生成参数和安全设置
+                generation_config, safety_settings = self._build_generation_args(max_tokens, temperature)
                 
                 # 合并system_prompt和prompt
                 full_prompt = prompt
@@ -265,7 +603,7 @@ class GeminiClient(BaseLLMClient):
                     full_prompt = f"{system_prompt}\n\n{prompt}"
                 
                 # 调用Gemini API
-                model = self.genai.GenerativeModel(self.model_id)
+                model = self._get_model()
                 response = model.generate_content(
                     full_prompt,
                     generation_config=generation_config,
@@ -333,6 +671,9 @@ class GeminiClient(BaseLLMClient):
                 "model": self.model_id,
                 "finish_reason": "stop"
             }
+            if not self.genai:
+                # 标记模拟响应，语义响应缓存不会保存
+                result["provider"] = "mock"
             
             # 更新任务日志
             processing_time = time.time() - start_time
@@ -369,8 +710,23 @@ class GeminiClient(BaseLLMClient):
             }
 
 
+class _CancelledCriteria:
+    """model.generate 的停止条件：取消标志被设置后在下一个token处结束生成"""
+    
+    def __init__(self, cancelled: threading.Event):
+        self.cancelled = cancelled
+    
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.cancelled.is_set()
+
+
 class LocalModelClient(BaseLLMClient):
-    """本地模型客户端"""
+    """本地模型客户端
+
+    模型权重由 local_model_registry 在第一次生成时加载，并在所有客户端之间共享。
+    """
+    
+    provider = "local"
     
     def __init__(self, model_config: Optional[AIModel]):
         super().__init__(model_config)
@@ -378,58 +734,116 @@ class LocalModelClient(BaseLLMClient):
         # 设置默认模型ID
         if not self.model_id:
             self.model_id = "local-model"
-            
-        # 初始化本地模型
-        self.model = None
-        self.tokenizer = None
-        try:
-
-            # 检查是否有CUDA
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
-            logger.info(f"本地模型将使用设备: {self.device}")
-            
-            # 获取模型路径
-            model_path = self.model_id
-            if self.model_config and self.model_config.api_base:
-                # 如果api_base字段包含了模型路径
-                model_path = self.model_config.api_base
-                
-            # 初始化模型和分词器
-            logger.info(f"正在从 {model_path} 加载本地模型...")
-            
-            try:
-                self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    model_path,
-                    device_map=self.device,
-                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                    trust_remote_code=True
-                )
-                logger.info(f"本地模型 {model_path} 加载成功")
-            except Exception as load_error:
-                logger.error(f"加载本地模型失败: {str(load_error)}")
-                self.model = None
-                self.tokenizer = None
-        except ImportError as e:
-            logger.warning(f"无法导入必要的库以支持本地模型: {str(e)}")
-            logger.warning("请确保已安装 torch 和 transformers 库")
-            self.model = None
-            self.tokenizer = None
-        except Exception as e:
-            logger.exception(f"初始化本地模型失败: {str(e)}")
-            self.model = None
-            self.tokenizer = None
+        
+        # 检查是否有CUDA
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        
+        # 获取模型路径
+        self.model_path = self.model_id
+        if self.model_config and self.model_config.api_base:
+            # 如果api_base字段包含了模型路径
+            self.model_path = self.model_config.api_base
     
-    def generate_text(self, prompt: str, system_prompt: str = None, 
-                    max_tokens: int = None, temperature: float = None,
-                    task_type: str = "chat") -> Dict[str, Any]:
-        """使用本地模型生成文本"""
-        if not max_tokens:
+    def _cache_available(self) -> bool:
+        # 只检查注册表状态，查询缓存前不加载模型权重
+        return local_model_registry.is_available(self.model_path, self.device)
+    
+    @staticmethod
+    def _build_generation_kwargs(max_tokens: int, temperature: float) -> Dict[str, Any]:
+        return {
+            "max_new_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": 0.95,
+            "top_k": 50,
+            "do_sample": temperature > 0.1  # 当温度大于0.1时使用采样
+        }
+    
+    def generate_text_stream(self, prompt: str, system_prompt: str = None,
+                             max_tokens: int = None, temperature: float = None,
+                             task_type: str = "chat") -> Iterator[str]:
+        """使用 TextIteratorStreamer 流式生成文本，生成在后台线程中进行"""
+        with local_model_registry.acquire(self.model_path, self.device) as loaded:
+            if loaded is None:
+                yield from super().generate_text_stream(prompt, system_prompt, max_tokens, temperature, task_type)
+                return
+            yield from self._stream_with_model(loaded, prompt, system_prompt, max_tokens, temperature, task_type)
+    
+    def _stream_with_model(self, loaded, prompt: str, system_prompt: Optional[str],
+                           max_tokens: Optional[int], temperature: Optional[float],
+                           task_type: str) -> Iterator[str]:
+        if max_tokens is None:
             max_tokens = self.max_tokens
-            
-        if not temperature:
+        if temperature is None:
             temperature = self.temperature
-            
+        
+        task_log = self._create_task_log(task_type, {
+            "prompt": prompt,
+            "system_prompt": system_prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True
+        })
+        start_time = time.time()
+        
+        full_prompt = prompt
+        if system_prompt:
+            full_prompt = f"{system_prompt}\n\n{prompt}"
+        
+        inputs = loaded.tokenizer(full_prompt, return_tensors="pt").to(self.device)
+        input_ids_length = inputs.input_ids.shape[1]
+        streamer = TextIteratorStreamer(loaded.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        cancelled = threading.Event()
+        errors = []
+        
+        def run_generation():
+            try:
+                with torch.no_grad():
+                    loaded.model.generate(
+                        **inputs,
+                        **self._build_generation_kwargs(max_tokens, temperature),
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([_CancelledCriteria(cancelled)])
+                    )
+            except Exception as e:
+                errors.append(e)
+                # 结束迭代，避免消费方一直等待
+                streamer.end()
+        
+        thread = threading.Thread(target=run_generation, name="local-model-stream", daemon=True)
+        thread.start()
+        
+        pieces = []
+        try:
+            for text in streamer:
+                if text:
+                    pieces.append(text)
+                    yield text
+        except GeneratorExit:
+            # 停止生成并等待后台线程结束，之后 acquire 才会释放模型，模型不会在生成期间被卸载
+            cancelled.set()
+            thread.join()
+            self._update_task_log(task_log, {}, "failed", 0, time.time() - start_time, "客户端中断了流式响应")
+            raise
+        thread.join()
+        
+        if errors:
+            logger.error(f"本地模型流式生成失败: {errors[0]}")
+            self._update_task_log(task_log, {}, "failed", 0, time.time() - start_time, str(errors[0]))
+            raise errors[0]
+        
+        response_text = "".join(pieces)
+        tokens_used = input_ids_length + len(loaded.tokenizer(response_text).input_ids)
+        self._update_task_log(
+            task_log,
+            {"result": {"text": response_text, "tokens_used": tokens_used, "model": self.model_id}},
+            "completed",
+            tokens_used,
+            time.time() - start_time
+        )
+    
+    def _generate_text(self, prompt: str, system_prompt: Optional[str],
+                       max_tokens: int, temperature: float, task_type: str) -> Dict[str, Any]:
+        """使用本地模型生成文本"""
         # 创建任务日志
         input_data = {
             "prompt": prompt,
@@ -442,42 +856,43 @@ class LocalModelClient(BaseLLMClient):
         start_time = time.time()
         
         try:
-            # 如果本地模型未初始化成功，返回模拟响应
-            if not self.model or not self.tokenizer:
-                response_text = f"[本地模型模拟响应] 对于问题: {prompt}"
-                tokens_used = 50
-            else:
-                # 构建完整提示词
-                full_prompt = prompt
-                if system_prompt:
-                    full_prompt = f"{system_prompt}\n\n{prompt}"
-                
-                # 设置生成参数
-                gen_kwargs = {
-                    "max_new_tokens": max_tokens,
-                    "temperature": temperature,
-                    "top_p": 0.95,
-                    "top_k": 50,
-                    "do_sample": temperature > 0.1  # 当温度大于0.1时使用采样
-                }
-                
-
-                with torch.no_grad():
-                    inputs = self.tokenizer(full_prompt, return_tensors="pt").to(self.device)
-                    input_ids_length = inputs.input_ids.shape[1]
+            with local_model_registry.acquire(self.model_path, self.device) as loaded:
+                # 如果本地模型加载失败，返回模拟响应
+                is_mock = loaded is None
+                if is_mock:
+                    response_text = f"[本地模型模拟响应] 对于问题: {prompt}"
+                    tokens_used = 50
+                else:
+                    # 构建完整提示词
+                    full_prompt = prompt
+                    if system_prompt:
+                        full_prompt = f"{system_prompt}\n\n{prompt}"
                     
-                    # 生成文本
-                    outputs = self.model.generate(
-                        **inputs,
-                        **gen_kwargs
-                    )
-                    
-                    # 只保留新生成的部分
-                    new_tokens = outputs[0][input_ids_length:]
-                    response_text = self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+                    # 设置生成参数
+                    gen_kwargs = self._build_generation_kwargs(max_tokens, temperature)
                     
-                    # 计算token使用量
-                    tokens_used = input_ids_length + len(new_tokens)
+                    if loaded.batcher:
+                        # 交给批处理器，与其他并发请求一起生成
+                        batch_result = loaded.batcher.generate(full_prompt, gen_kwargs)
+                        response_text = batch_result["text"]
+                        tokens_used = batch_result["input_tokens"] + batch_result["output_tokens"]
+                    else:
+                        with torch.no_grad():
+                            inputs = loaded.tokenizer(full_prompt, return_tensors="pt").to(self.device)
+                            input_ids_length = inputs.input_ids.shape[1]
+                            
+                            # 生成文本
+                            outputs = loaded.model.generate(
+                                **inputs,
+                                **gen_kwargs
+                            )
+                            
+                            # 只保留新生成的部分
+                            new_tokens = outputs[0][input_ids_length:]
+                            response_text = loaded.tokenizer.decode(new_tokens, skip_special_tokens=True)
+                            
+                            # 计算token使用量
+                            tokens_used = input_ids_length + len(new_tokens)
             
             # 构建结果
             result = {
@@ -486,6 +901,8 @@ class LocalModelClient(BaseLLMClient):
                 "model": self.model_id,
                 "finish_reason": "stop"
             }
+            if is_mock:
+                result["provider"] = "mock"
             
             # 更新任务日志
             processing_time = time.time() - start_time
@@ -519,4 +936,4 @@ class LocalModelClient(BaseLLMClient):
                 "error": error_msg,
                 "text": "很抱歉，本地模型服务暂时不可用，请稍后再试。",
                 "model": self.model_id
-            } 
\ No newline at end of file
+            }
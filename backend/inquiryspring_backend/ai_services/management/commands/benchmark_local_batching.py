@@ -0,0 +1,117 @@
+"""
+本地模型批处理基准测试 - 对比逐条生成与动态批处理在并发请求下的吞吐量
+
+CPU上批处理的收益取决于模型大小和 torch 线程数，与GPU上的结果差别较大，
+记录结果时需同时记录最后一行输出的模型、设备和线程数。在有GPU的机器上可以用 --device cpu
+测量只用CPU时的吞吐量，例如：
+
+    python manage.py benchmark_local_batching --model-path <模型路径> --device cpu
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from inquiryspring_backend.ai_services.generation_batcher import GenerationBatcher
+from inquiryspring_backend.ai_services.models import AIModel
+
+SAMPLE_PROMPTS = [
+    "请用一句话解释什么是机器学习。",
+    "列举三种常见的排序算法。",
+    "What is the capital of France?",
+    "简述TCP和UDP的区别。",
+    "Explain recursion to a beginner.",
+    "光合作用的主要产物是什么？",
+    "Give an example of a Python list comprehension.",
+    "什么是数据库索引？",
+]
+
+
+class Command(BaseCommand):
+    help = '在并发请求下对比本地模型逐条生成与动态批处理的吞吐量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model-path', help='模型路径或HuggingFace模型名')
+        parser.add_argument('--model-id', type=int, help='使用AIModel配置中的本地模型')
+        parser.add_argument('--requests', type=int, default=32, help='请求总数')
+        parser.add_argument('--concurrency', type=int, default=8, help='并发请求数')
+        parser.add_argument('--max-tokens', type=int, default=32, help='每个请求生成的最大token数')
+        parser.add_argument('--device', choices=['auto', 'cpu', 'cuda'], default='auto',
+                            help='运行设备，auto 表示有GPU时使用GPU')
+        parser.add_argument('--max-batch-size', type=int,
+                            default=getattr(settings, 'LOCAL_MODEL_MAX_BATCH_SIZE', 8))
+        parser.add_argument('--max-wait-ms', type=float,
+                            default=getattr(settings, 'LOCAL_MODEL_BATCH_WAIT_MS', 20))
+
+    def handle(self, *args, **options):
+        model_path = options['model_path']
+        if options['model_id']:
+            model_config = AIModel.objects.filter(id=options['model_id'], provider='local').first()
+            if not model_config:
+                raise CommandError(f"找不到本地模型配置: {options['model_id']}")
+            model_path = model_config.api_base or model_config.model_id
+        if not model_path:
+            raise CommandError('请通过 --model-path 或 --model-id 指定模型')
+
+        device = options['device']
+        if device == 'auto':
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        elif device == 'cuda' and not torch.cuda.is_available():
+            raise CommandError('没有可用的GPU')
+        self.stdout.write(f'加载模型 {model_path} ({device})...')
+        tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path,
+            device_map=device,
+            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+            trust_remote_code=True
+        )
+        model.eval()
+
+        # 贪心解码，保证两种方式生成的token数量可比
+        gen_kwargs = {"max_new_tokens": options['max_tokens'], "do_sample": False}
+        prompts = [SAMPLE_PROMPTS[i % len(SAMPLE_PROMPTS)] for i in range(options['requests'])]
+
+        # 预热一次，排除首次调用的初始化开销
+        GenerationBatcher(model, tokenizer, device, max_batch_size=1).generate(prompts[0], gen_kwargs)
+
+        unbatched = self._run('逐条生成', GenerationBatcher(model, tokenizer, device, max_batch_size=1, max_wait=0),
+                              prompts, gen_kwargs, options['concurrency'])
+        batched = self._run('动态批处理', GenerationBatcher(model, tokenizer, device,
+                                                      max_batch_size=options['max_batch_size'],
+                                                      max_wait=options['max_wait_ms'] / 1000),
+                            prompts, gen_kwargs, options['concurrency'])
+
+        self.stdout.write(
+            f'{model_path} ({device}，{torch.get_num_threads()} 线程，并发 {options["concurrency"]}，'
+            f'批大小上限 {options["max_batch_size"]})：逐条生成 {unbatched:.2f} 请求/秒，'
+            f'动态批处理 {batched:.2f} 请求/秒，提升 {batched / unbatched:.2f} 倍'
+        )
+
+    def _run(self, label, batcher, prompts, gen_kwargs, concurrency):
+        latencies = []
+
+        def call(prompt):
+            start_time = time.perf_counter()
+            result = batcher.generate(prompt, gen_kwargs)
+            latencies.append(time.perf_counter() - start_time)
+            return result
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(call, prompts))
+        elapsed = time.perf_counter() - start_time
+        batcher.close()
+
+        output_tokens = sum(result['output_tokens'] for result in results)
+        stats = batcher.get_stats()
+        self.stdout.write(
+            f'{label}: {len(prompts)} 个请求耗时 {elapsed:.2f}s，'
+            f'{len(prompts) / elapsed:.2f} 请求/秒，{output_tokens / elapsed:.1f} tokens/秒，'
+            f'平均批大小 {stats["avg_batch_size"]}，延迟中位数 {median(latencies):.2f}s'
+        )
+        return len(prompts) / elapsed
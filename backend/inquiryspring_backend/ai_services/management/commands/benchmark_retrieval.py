@@ -0,0 +1,101 @@
+"""
+检索基准测试 - 对比向量检索、关键词检索和混合检索的召回率与延迟，以及不同候选数量下重排序的效果
+"""
+import json
+import random
+import re
+import time
+from statistics import mean
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inquiryspring_backend.ai_services.rag_engine import RAGEngine
+from inquiryspring_backend.documents.models import DocumentChunk
+
+SENTENCE_RE = re.compile(r'[^。！？!?\.\n]+')
+
+
+class Command(BaseCommand):
+    help = '在指定文档上对比向量、关键词和混合检索的 recall@k 与延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--document-id', type=int, nargs='+', required=True, help='参与检索的文档ID')
+        parser.add_argument('--queries', help='JSON文件，格式为 [{"query": "...", "chunk_ids": [1, 2]}]')
+        parser.add_argument('--samples', type=int, default=50,
+                            help='未提供 --queries 时，从分块中抽取句子作为查询的数量')
+        parser.add_argument('--k', type=int, nargs='+', default=[1, 3, 5, 10], help='计算 recall@k 的 k 值')
+        parser.add_argument('--modes', nargs='+', default=['vector', 'keyword', 'hybrid'],
+                            choices=['vector', 'keyword', 'hybrid'])
+        parser.add_argument('--threshold', type=float, help='覆盖 retrieval_threshold')
+        parser.add_argument('--rerank-candidates', type=int, nargs='+', default=[],
+                            help='额外测试启用重排序时的候选分块数量，如 10 20 40')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        document_ids = options['document_id']
+        if options['queries']:
+            with open(options['queries'], encoding='utf-8') as f:
+                cases = [(case['query'], set(case['chunk_ids'])) for case in json.load(f)]
+        else:
+            cases = self._sample_queries(document_ids, options['samples'], options['seed'])
+        if not cases:
+            raise CommandError('没有可用的查询，请确认文档已完成分块')
+
+        ks = sorted(set(options['k']))
+        self.stdout.write(f'共 {len(cases)} 个查询，文档: {document_ids}')
+
+        for mode in options['modes']:
+            config = {'retrieval_mode': mode, 'rerank_enabled': False}
+            if options['threshold'] is not None:
+                config['retrieval_threshold'] = options['threshold']
+            self._run(mode, config, cases, document_ids, ks)
+
+            for candidates in options['rerank_candidates']:
+                self._run(f'{mode}+rerank@{candidates}',
+                          dict(config, rerank_enabled=True, rerank_candidates=candidates),
+                          cases, document_ids, ks)
+
+    def _run(self, label, config, cases, document_ids, ks):
+        engine = RAGEngine(config=config)
+
+        # 预热一次，排除首次加载模型和构建索引的开销
+        engine.retrieve_from_documents(cases[0][0], document_ids, top_k=ks[-1])
+
+        recalls = {k: [] for k in ks}
+        latencies = []
+        retrieval_times = []
+        rerank_times = []
+        for query, relevant in cases:
+            start_time = time.perf_counter()
+            chunks = engine.retrieve_from_documents(query, document_ids, top_k=ks[-1])
+            latencies.append(time.perf_counter() - start_time)
+            retrieval_times.append(engine.last_retrieval_stats.get('retrieval_ms', 0.0))
+            rerank_times.append(engine.last_retrieval_stats.get('rerank_ms', 0.0))
+
+            retrieved = [chunk.id for chunk in chunks]
+            for k in ks:
+                recalls[k].append(len(relevant.intersection(retrieved[:k])) / len(relevant))
+
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        recall_text = '，'.join(f'recall@{k} {mean(recalls[k]):.3f}' for k in ks)
+        self.stdout.write(
+            f'{label}: {recall_text}，平均延迟 {mean(latencies) * 1000:.1f}ms，p95 {p95 * 1000:.1f}ms'
+            f'（检索 {mean(retrieval_times):.1f}ms，重排序 {mean(rerank_times):.1f}ms）'
+        )
+
+    @staticmethod
+    def _sample_queries(document_ids, samples, seed):
+        """随机抽取分块中的一句话作为查询，该分块即为相关结果"""
+        rng = random.Random(seed)
+        chunks = list(DocumentChunk.objects.filter(document_id__in=document_ids).values_list('id', 'content'))
+        rng.shuffle(chunks)
+
+        cases = []
+        for chunk_id, content in chunks:
+            sentences = [s.strip() for s in SENTENCE_RE.findall(content) if len(s.strip()) >= 10]
+            if sentences:
+                cases.append((rng.choice(sentences)[:80], {chunk_id}))
+            if len(cases) >= samples:
+                break
+        return cases
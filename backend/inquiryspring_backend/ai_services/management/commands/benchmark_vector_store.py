@@ -0,0 +1,136 @@
+"""
+向量存储对比 - 比较共享Chroma集合、float32 mmap 存储与 int8 量化存储的召回率、打开和查询延迟、内存和磁盘占用
+
+以精确的 float32 暴力检索结果为基准计算 recall@k。查询向量由已存储的向量加少量噪声生成，不需要加载嵌入模型。
+使用 --migrate numpy/int8 时把Chroma中的向量写入对应的存储，之后切换 VECTOR_STORE_BACKEND 无需重新向量化。
+"""
+import os
+import tempfile
+import time
+from statistics import mean
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from inquiryspring_backend.ai_services.numpy_vector_store import (
+    NumpyVectorStore, QuantizedVectorStore, normalize
+)
+from inquiryspring_backend.ai_services.rag_engine import RAGEngine
+from inquiryspring_backend.ai_services.vector_store import ChromaVectorStore, get_vector_store
+from inquiryspring_backend.documents.models import DocumentChunk
+
+
+def _directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def _mb(size):
+    return f'{size / 1024 / 1024:.2f}MB'
+
+
+class Command(BaseCommand):
+    help = '对比Chroma、numpy与int8向量存储的recall@k、延迟和内存/磁盘占用，可选迁移向量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--document-id', type=int, nargs='+', help='参与对比的文档ID，默认全部已分块的文档')
+        parser.add_argument('--queries', type=int, default=50, help='查询数量')
+        parser.add_argument('--k', type=int, default=10, help='每次查询返回的结果数')
+        parser.add_argument('--noise', type=float, default=0.05, help='生成查询向量时添加的噪声标准差')
+        parser.add_argument('--rescore-factor', type=int,
+                            default=RAGEngine.DEFAULT_CONFIG['quantized_rescore_factor'])
+        parser.add_argument('--migrate', choices=['numpy', 'int8'], help='把Chroma中的向量写入该后端的存储目录')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        config = RAGEngine.DEFAULT_CONFIG
+        chroma_store = get_vector_store(dict(config, vector_store_backend='chroma'))
+
+        document_ids = options['document_id'] or sorted(
+            DocumentChunk.objects.values_list('document_id', flat=True).distinct()
+        )
+        exported = {}
+        for document_id in document_ids:
+            ids, embeddings = chroma_store.export(document_id)
+            if ids:
+                exported[document_id] = (ids, embeddings)
+        if not exported:
+            raise CommandError('Chroma中没有这些文档的向量')
+
+        all_ids = np.array([int(vector_id) for ids, _ in exported.values() for vector_id in ids])
+        all_vectors = normalize([vector for _, embeddings in exported.values() for vector in embeddings])
+        count, dim = all_vectors.shape
+        document_ids = list(exported)
+        self.stdout.write(f'{len(document_ids)} 个文档，{count} 个 {dim} 维向量')
+
+        rng = np.random.default_rng(options['seed'])
+        queries = all_vectors[rng.integers(0, count, options['queries'])]
+        queries = normalize(queries + rng.normal(0, options['noise'], queries.shape).astype(np.float32))
+        k = min(options['k'], count)
+
+        # 精确检索结果作为基准
+        exact = [set(all_ids[np.argsort(-(all_vectors @ query))[:k]].tolist()) for query in queries]
+
+        with tempfile.TemporaryDirectory() as numpy_dir, tempfile.TemporaryDirectory() as int8_dir:
+            for store in (NumpyVectorStore(numpy_dir), QuantizedVectorStore(int8_dir)):
+                for document_id, (ids, embeddings) in exported.items():
+                    store.upsert(document_id, ids, embeddings, [], [])
+                store.persist()
+
+            # 每个后端都新建实例，测量冷启动（打开存储并完成第一次查询）的耗时
+            factories = {
+                'chroma': lambda: ChromaVectorStore(
+                    persist_directory=chroma_store.persist_directory,
+                    collection_name=chroma_store.collection_name,
+                    shard_count=chroma_store.shard_count
+                ),
+                'numpy': lambda: NumpyVectorStore(numpy_dir),
+                # 共用同一份文件，只用量化向量打分
+                'int8': lambda: QuantizedVectorStore(int8_dir, rescore=False),
+                'int8+rescore': lambda: QuantizedVectorStore(
+                    int8_dir, rescore=True, rescore_factor=options['rescore_factor']
+                ),
+            }
+            for label, factory in factories.items():
+                start_time = time.perf_counter()
+                store = factory()
+                store.query(queries[0].tolist(), k=k, document_ids=document_ids)
+                open_time = time.perf_counter() - start_time
+
+                recalls, latencies = [], []
+                for query, expected in zip(queries, exact):
+                    start_time = time.perf_counter()
+                    hits = store.query(query.tolist(), k=k, document_ids=document_ids)
+                    latencies.append(time.perf_counter() - start_time)
+                    recalls.append(len(expected.intersection(int(hit['chunk_id']) for hit in hits)) / k)
+                self.stdout.write(
+                    f'{label}: recall@{k} {mean(recalls):.4f}，冷启动 {open_time * 1000:.2f}ms，'
+                    f'平均查询延迟 {mean(latencies) * 1000:.2f}ms'
+                )
+
+            int8_usage = QuantizedVectorStore(int8_dir).memory_usage(document_ids)
+            numpy_disk = _directory_size(numpy_dir)
+            int8_disk = _directory_size(int8_dir)
+
+        float_bytes = count * dim * 4
+        self.stdout.write(
+            f'向量内存: float32 {_mb(float_bytes)}，int8 扫描 {_mb(int8_usage["scan_bytes"])}'
+            f'（{int8_usage["scan_bytes"] / float_bytes:.1%}），重新打分时按需读取 float16 向量'
+        )
+        self.stdout.write(
+            f'磁盘: Chroma 目录 {_mb(_directory_size(chroma_store.persist_directory))}（包含所有文档），'
+            f'numpy {_mb(numpy_disk)}，'
+            f'int8 {_mb(int8_disk)}（包含用于重新打分的 float16 向量 {_mb(int8_usage["float_bytes"])}）'
+        )
+
+        if options['migrate']:
+            target = get_vector_store(dict(config, vector_store_backend=options['migrate']))
+            for document_id, (ids, embeddings) in exported.items():
+                target.delete_document(document_id)
+                target.upsert(document_id, ids, embeddings, [], [])
+                target.persist(document_id)
+            self.stdout.write(self.style.SUCCESS(
+                f'已将 {len(exported)} 个文档的 {count} 个向量写入 {target.root_dir}'
+            ))
@@ -0,0 +1,133 @@
+"""
+向量存储迁移管理命令 - 将旧版按文档划分的Chroma目录合并到共享集合中
+"""
+import logging
+import os
+import shutil
+import time
+from statistics import mean
+
+import chromadb
+from chromadb.config import Settings as ChromaSettings
+from django.core.management.base import BaseCommand
+
+from inquiryspring_backend.ai_services.rag_engine import RAGEngine
+from inquiryspring_backend.ai_services.vector_store import (
+    ChromaVectorStore, get_vector_store, LEGACY_COLLECTION_NAME
+)
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = '将 vector_store/<document_id>/ 下的旧向量库合并到共享集合，并对比迁移前后的打开/查询延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批迁移的向量数量')
+        parser.add_argument('--top-k', type=int, default=RAGEngine.DEFAULT_CONFIG['top_k_retrieval'],
+                            help='基准测试时每次查询返回的结果数')
+        parser.add_argument('--dry-run', action='store_true', help='只测量旧向量库的延迟，不写入共享集合')
+        parser.add_argument('--delete-old', action='store_true', help='迁移成功后删除旧的按文档目录')
+
+    def handle(self, *args, **options):
+        config = RAGEngine.DEFAULT_CONFIG
+        root_dir = config['vector_store_dir']
+
+        legacy_dirs = sorted(
+            (int(name), os.path.join(root_dir, name))
+            for name in os.listdir(root_dir)
+            if name.isdigit() and os.path.isdir(os.path.join(root_dir, name))
+        )
+        if not legacy_dirs:
+            self.stdout.write('没有找到需要迁移的旧向量库目录。')
+            return
+
+        self.stdout.write(f'找到 {len(legacy_dirs)} 个旧向量库目录，开始迁移...')
+
+        shared_store = None if options['dry_run'] else get_vector_store(dict(config, vector_store_backend='chroma'))
+        probes = {}
+        before_open, before_query = [], []
+        migrated_documents = 0
+        migrated_vectors = 0
+
+        for document_id, path in legacy_dirs:
+            # 迁移前：每次请求都要打开一个独立的持久化目录
+            start_time = time.perf_counter()
+            client = chromadb.PersistentClient(path=path, settings=ChromaSettings(anonymized_telemetry=False))
+            try:
+                collection = client.get_collection(LEGACY_COLLECTION_NAME)
+            except Exception as e:
+                self.stderr.write(f'跳过文档 {document_id}：无法打开旧集合 ({e})')
+                continue
+            before_open.append(time.perf_counter() - start_time)
+
+            total = collection.count()
+            if total == 0:
+                continue
+
+            for offset in range(0, total, options['batch_size']):
+                batch = collection.get(
+                    limit=options['batch_size'],
+                    offset=offset,
+                    include=['embeddings', 'documents', 'metadatas']
+                )
+                if document_id not in probes and len(batch['embeddings']):
+                    # 使用第一条已存储的向量作为基准查询，避免加载嵌入模型
+                    probes[document_id] = list(batch['embeddings'][0])
+                    start_time = time.perf_counter()
+                    collection.query(query_embeddings=[probes[document_id]], n_results=options['top_k'])
+                    before_query.append(time.perf_counter() - start_time)
+
+                if shared_store is not None:
+                    shared_store.upsert(
+                        document_id=document_id,
+                        ids=batch['ids'],
+                        embeddings=[list(vector) for vector in batch['embeddings']],
+                        texts=batch['documents'],
+                        metadatas=[dict(metadata or {}) for metadata in batch['metadatas']]
+                    )
+                    migrated_vectors += len(batch['ids'])
+
+            migrated_documents += 1
+            self.stdout.write(f'文档 {document_id}: {total} 个向量')
+
+        self._report('迁移前（按文档目录）', before_open, before_query)
+
+        if shared_store is None:
+            self.stdout.write('dry-run 模式，未写入共享集合。')
+            return
+
+        # 迁移后：共享集合在进程内只打开一次，查询通过document_id过滤
+        # 新建一个实例来测量冷启动打开耗时
+        start_time = time.perf_counter()
+        shared_store = ChromaVectorStore(
+            persist_directory=shared_store.persist_directory,
+            collection_name=shared_store.collection_name,
+            shard_count=shared_store.shard_count
+        )
+        shared_store.count(legacy_dirs[0][0])
+        after_open = [time.perf_counter() - start_time]
+
+        after_query = []
+        for document_id, probe in probes.items():
+            start_time = time.perf_counter()
+            shared_store.query(probe, k=options['top_k'], document_ids=[document_id])
+            after_query.append(time.perf_counter() - start_time)
+
+        self._report('迁移后（共享集合）', after_open, after_query)
+        self.stdout.write(self.style.SUCCESS(
+            f'迁移完成：{migrated_documents} 个文档，{migrated_vectors} 个向量。'
+        ))
+
+        if options['delete_old']:
+            for document_id, path in legacy_dirs:
+                shutil.rmtree(path, ignore_errors=True)
+            self.stdout.write(f'已删除 {len(legacy_dirs)} 个旧向量库目录。')
+
+    def _report(self, label, open_times, query_times):
+        if not open_times:
+            return
+        query_avg = f'{mean(query_times) * 1000:.1f}ms' if query_times else '-'
+        self.stdout.write(
+            f'{label}: 打开平均 {mean(open_times) * 1000:.1f}ms，'
+            f'查询平均 {query_avg}（{len(query_times)} 次）'
+        )
@@ -0,0 +1,286 @@
+"""
+本地模型注册表 - 每个本地模型在进程内只加载一次，由所有 LocalModelClient 共享
+
+模型在第一次使用时加载。设置了内存上限时，加载新模型后会按最近最少使用的顺序
+卸载当前没有在生成的模型；也可以卸载空闲超过一定时间的模型。
+"""
+import gc
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import torch
+from django.conf import settings
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from .generation_batcher import GenerationBatcher
+
+logger = logging.getLogger(__name__)
+
+# 加载失败后多久才允许重试（秒）
+LOAD_RETRY_INTERVAL = 60
+
+
+class LoadedModel:
+    """已加载的本地模型及其分词器、批处理器"""
+
+    def __init__(self, key: Tuple[str, str], model, tokenizer, batcher: Optional[GenerationBatcher],
+                 load_time: float, memory_bytes: int):
+        self.key = key
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batcher = batcher
+        self.load_time = load_time
+        self.memory_bytes = memory_bytes
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.in_use = 0
+
+    @property
+    def model_path(self) -> str:
+        return self.key[0]
+
+    @property
+    def device(self) -> str:
+        return self.key[1]
+
+
+class LocalModelRegistry:
+    """进程级本地模型注册表"""
+
+    def __init__(self, memory_limit_bytes: Optional[int] = None, idle_timeout: Optional[float] = None):
+        self.memory_limit_bytes = memory_limit_bytes
+        self.idle_timeout = idle_timeout
+
+        self._models: "OrderedDict[Tuple[str, str], LoadedModel]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._failures: Dict[Tuple[str, str], float] = {}
+
+        # 最近的加载/卸载记录
+        self.events = deque(maxlen=100)
+
+    @staticmethod
+    def _measure_memory(model) -> int:
+        """统计模型参数和缓冲区占用的字节数"""
+        try:
+            return sum(
+                tensor.numel() * tensor.element_size()
+                for tensor in list(model.parameters()) + list(model.buffers())
+            )
+        except Exception:
+            return 0
+
+    def get(self, model_path: str, device: str, pin: bool = False) -> Optional[LoadedModel]:
+        """获取共享的模型，首次调用时加载；加载失败返回None
+
+        Args:
+            pin: 是否在返回前（与查找在同一个锁内）将模型标记为使用中，调用方用完后需减少 in_use
+        """
+        key = (model_path, device)
+        while True:
+            with self._lock:
+                loaded = self._models.get(key)
+                if loaded:
+                    self._models.move_to_end(key)
+                    if pin:
+                        loaded.in_use += 1
+                    return loaded
+                failed_at = self._failures.get(key)
+                if failed_at and time.time() - failed_at < LOAD_RETRY_INTERVAL:
+                    return None
+                load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+            # 同一模型的并发请求只加载一次，不同模型的加载互不阻塞
+            with load_lock:
+                with self._lock:
+                    loaded = self._models.get(key)
+                if loaded is None and self._load(key) is None:
+                    return None
+            # 回到循环开头在锁内重新查找；加载后立即被卸载时会重新加载
+
+    def is_available(self, model_path: str, device: str) -> bool:
+        """模型是否可用：已加载，或最近没有加载失败
+
+        只检查注册表的状态，不会触发加载，也不改变LRU顺序。
+        """
+        key = (model_path, device)
+        with self._lock:
+            if key in self._models:
+                return True
+            failed_at = self._failures.get(key)
+            return not (failed_at and time.time() - failed_at < LOAD_RETRY_INTERVAL)
+
+    @contextmanager
+    def acquire(self, model_path: str, device: str) -> Iterator[Optional[LoadedModel]]:
+        """在使用期间标记模型为忙碌，防止被卸载"""
+        if self.idle_timeout:
+            self.evict_idle(self.idle_timeout)
+
+        loaded = self.get(model_path, device, pin=True)
+        if loaded is None:
+            yield None
+            return
+
+        try:
+            yield loaded
+        finally:
+            with self._lock:
+                loaded.in_use -= 1
+                loaded.last_used = time.time()
+
+    def _load(self, key: Tuple[str, str]) -> Optional[LoadedModel]:
+        model_path, device = key
+        logger.info(f"正在从 {model_path} 加载本地模型 ({device})...")
+        start_time = time.perf_counter()
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+            model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                device_map=device,
+                torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+                trust_remote_code=True
+            )
+            model.eval()
+        except Exception as e:
+            logger.error(f"加载本地模型失败: {str(e)}")
+            with self._lock:
+                self._failures[key] = time.time()
+            return None
+
+        # 并发请求合并为批次生成
+        batcher = None
+        if getattr(settings, 'LOCAL_MODEL_BATCHING', True):
+            batcher = GenerationBatcher(
+                model,
+                tokenizer,
+                device,
+                max_batch_size=getattr(settings, 'LOCAL_MODEL_MAX_BATCH_SIZE', 8),
+                max_wait=getattr(settings, 'LOCAL_MODEL_BATCH_WAIT_MS', 20) / 1000
+            )
+
+        load_time = time.perf_counter() - start_time
+        loaded = LoadedModel(key, model, tokenizer, batcher, load_time, self._measure_memory(model))
+        with self._lock:
+            self._models[key] = loaded
+            self._failures.pop(key, None)
+            self.events.append({
+                'event': 'load',
+                'model_path': model_path,
+                'device': device,
+                'seconds': round(load_time, 3),
+                'memory_mb': round(loaded.memory_bytes / 1024 / 1024, 1),
+                'at': time.time(),
+            })
+        logger.info(
+            f"本地模型 {model_path} 加载成功，耗时 {load_time:.2f}s，"
+            f"约占用 {loaded.memory_bytes / 1024 / 1024:.1f}MB"
+        )
+
+        self._enforce_memory_limit(keep=key)
+        return loaded
+
+    def _unload(self, loaded: LoadedModel, reason: str) -> bool:
+        """卸载模型，模型在此期间重新被使用时放弃卸载并返回False"""
+        start_time = time.perf_counter()
+        with self._lock:
+            if loaded.in_use or self._models.get(loaded.key) is not loaded:
+                return False
+            self._models.pop(loaded.key)
+        if loaded.batcher:
+            loaded.batcher.close()
+        loaded.model = None
+        loaded.tokenizer = None
+        loaded.batcher = None
+        gc.collect()
+        if loaded.device == "cuda" and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+        unload_time = time.perf_counter() - start_time
+        with self._lock:
+            self.events.append({
+                'event': 'unload',
+                'model_path': loaded.model_path,
+                'device': loaded.device,
+                'reason': reason,
+                'seconds': round(unload_time, 3),
+                'memory_mb': round(loaded.memory_bytes / 1024 / 1024, 1),
+                'at': time.time(),
+            })
+        logger.info(f"已卸载本地模型 {loaded.model_path} ({reason})，耗时 {unload_time:.2f}s")
+        return True
+
+    def _enforce_memory_limit(self, keep: Tuple[str, str] = None) -> None:
+        """超出内存上限时，按LRU顺序卸载空闲模型"""
+        if not self.memory_limit_bytes:
+            return
+        with self._lock:
+            total = sum(loaded.memory_bytes for loaded in self._models.values())
+            candidates = [
+                loaded for key, loaded in self._models.items()
+                if key != keep and loaded.in_use == 0
+            ]
+        for loaded in candidates:
+            if total <= self.memory_limit_bytes:
+                break
+            if self._unload(loaded, 'memory_limit'):
+                total -= loaded.memory_bytes
+        if total > self.memory_limit_bytes:
+            logger.warning(
+                f"本地模型占用 {total / 1024 / 1024:.1f}MB，超过上限 "
+                f"{self.memory_limit_bytes / 1024 / 1024:.1f}MB，但没有可卸载的空闲模型"
+            )
+
+    def evict_idle(self, idle_seconds: float) -> int:
+        """卸载空闲超过 idle_seconds 的模型，返回卸载数量"""
+        now = time.time()
+        with self._lock:
+            idle = [
+                loaded for loaded in self._models.values()
+                if loaded.in_use == 0 and now - loaded.last_used > idle_seconds
+            ]
+        return sum(1 for loaded in idle if self._unload(loaded, 'idle'))
+
+    def unload(self, model_path: str, device: str) -> bool:
+        """主动卸载模型，模型正在使用时返回False"""
+        with self._lock:
+            loaded = self._models.get((model_path, device))
+            if loaded is None:
+                return False
+        return self._unload(loaded, 'manual')
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取已加载模型和加载/卸载耗时"""
+        with self._lock:
+            return {
+                'memory_limit_mb': round(self.memory_limit_bytes / 1024 / 1024, 1) if self.memory_limit_bytes else None,
+                'total_memory_mb': round(sum(m.memory_bytes for m in self._models.values()) / 1024 / 1024, 1),
+                'models': [
+                    {
+                        'model_path': loaded.model_path,
+                        'device': loaded.device,
+                        'load_seconds': round(loaded.load_time, 3),
+                        'memory_mb': round(loaded.memory_bytes / 1024 / 1024, 1),
+                        'in_use': loaded.in_use,
+                        'idle_seconds': round(time.time() - loaded.last_used, 1),
+                        'batcher': loaded.batcher.get_stats() if loaded.batcher else None,
+                    }
+                    for loaded in self._models.values()
+                ],
+                'events': list(self.events),
+            }
+
+
+def _memory_limit_from_settings() -> Optional[int]:
+    limit_mb = getattr(settings, 'LOCAL_MODEL_MEMORY_LIMIT_MB', None)
+    return int(limit_mb * 1024 * 1024) if limit_mb else None
+
+
+# 全局本地模型注册表实例
+local_model_registry = LocalModelRegistry(
+    memory_limit_bytes=_memory_limit_from_settings(),
+    idle_timeout=getattr(settings, 'LOCAL_MODEL_IDLE_TIMEOUT', None)
+)
@@ -0,0 +1,319 @@
+"""
+基于NumPy的向量存储 - 向量保存为连续数组文件，查询时以 mmap 方式打开
+
+NumpyVectorStore 保存 float32 向量，查询时用矩阵乘法暴力计算全部相似度，适合中小规模的文档。
+文件以只读 mmap 方式打开，同一台机器上的多个 worker 进程通过操作系统页缓存共享同一份数据，
+不需要像Chroma那样在每个进程中加载SQLite和HNSW索引。
+
+QuantizedVectorStore 在此基础上把每个向量按自身的最大绝对值缩放为 int8（查询时扫描的数据约为 float32 的 1/4），
+查询时先用量化向量近似打分选出候选，再读取候选的 float16 原始向量重新打分，
+只有候选所在的页会被读入内存。开启重新打分时磁盘占用约为 float32 的 3/4（int8 编码 + float16 向量），
+关闭时约为 1/4。
+
+每个文档一个目录，写入新版本时先写入新的版本目录，再原子地替换 CURRENT 文件，
+正在查询旧版本的进程不受影响。向量ID即 DocumentChunk 的ID。
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILENAME = "CURRENT"
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行归一化为单位向量，内积即余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """对称 int8 量化，每行一个缩放系数
+
+    Returns:
+        (int8 编码, float32 缩放系数)，原向量 ≈ 编码 * 缩放系数
+    """
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回得分最高的 k 个下标（不保证顺序）"""
+    k = min(k, len(scores))
+    if k == len(scores):
+        return np.arange(len(scores))
+    return np.argpartition(-scores, k - 1)[:k]
+
+
+class _Segment:
+    """一个文档已持久化的向量（mmap 方式打开），不存在的数组为None"""
+
+    def __init__(self, path: str):
+        self.ids = np.load(os.path.join(path, "ids.npy"))
+        self.vectors = self._load(path, "vectors.npy", mmap_mode='r')
+        self.codes = self._load(path, "codes.npy", mmap_mode='r')
+        self.scales = self._load(path, "scales.npy")
+
+    @staticmethod
+    def _load(path: str, filename: str, mmap_mode: str = None) -> Optional[np.ndarray]:
+        file_path = os.path.join(path, filename)
+        return np.load(file_path, mmap_mode=mmap_mode) if os.path.exists(file_path) else None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def dequantize(self) -> np.ndarray:
+        return self.codes.astype(np.float32) * self.scales[:, None]
+
+
+class NumpyVectorStore:
+    """float32 向量存储，接口与 ChromaVectorStore 一致
+
+    写入（upsert/delete）先在内存中累积，persist 时一次写入文件；查询只读取已持久化的版本。
+
+    Args:
+        root_dir: 存储根目录
+        block_rows: 计算相似度时每次处理的行数，限制临时数组的大小
+    """
+
+    def __init__(self, root_dir: str, block_rows: int = 8192):
+        self.root_dir = root_dir
+        self.block_rows = max(1, block_rows)
+
+        # 文档ID -> {向量ID: 归一化向量}，尚未持久化的修改
+        self._pending: Dict[int, Dict[int, np.ndarray]] = {}
+        # 文档ID -> (CURRENT 文件状态, 已打开的版本)
+        self._segments: Dict[int, Tuple[tuple, _Segment]] = {}
+        # 修改时需要在持锁状态下载入已持久化的版本，使用可重入锁
+        self._lock = threading.RLock()
+
+    def _document_dir(self, document_id: int) -> str:
+        return os.path.join(self.root_dir, str(int(document_id)))
+
+    def _segment(self, document_id: int) -> Optional[_Segment]:
+        """获取文档当前持久化的版本，其他进程写入新版本后自动重新打开"""
+        current_path = os.path.join(self._document_dir(document_id), CURRENT_FILENAME)
+        try:
+            stat = os.stat(current_path)
+        except FileNotFoundError:
+            with self._lock:
+                self._segments.pop(document_id, None)
+            return None
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+
+        with self._lock:
+            cached = self._segments.get(document_id)
+            if cached and cached[0] == stamp:
+                return cached[1]
+
+        with open(current_path, encoding='utf-8') as f:
+            version = f.read().strip()
+        segment = _Segment(os.path.join(self._document_dir(document_id), version))
+        with self._lock:
+            self._segments[document_id] = (stamp, segment)
+        return segment
+
+    def _writable(self, document_id: int) -> Dict[int, np.ndarray]:
+        """获取文档待写入的向量，首次修改时从已持久化的版本载入"""
+        pending = self._pending.get(document_id)
+        if pending is None:
+            segment = self._segment(document_id)
+            pending = {}
+            if segment is not None and len(segment):
+                if segment.vectors is not None:
+                    vectors = np.asarray(segment.vectors, dtype=np.float32)
+                else:
+                    vectors = segment.dequantize()
+                pending = {int(vector_id): vector for vector_id, vector in zip(segment.ids, vectors)}
+            self._pending[document_id] = pending
+        return pending
+
+    def upsert(self, document_id: int, ids: List[str], embeddings: List[List[float]],
+               texts: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """写入或更新一个文档的若干向量；文本和元数据不保存，检索结果通过分块ID从数据库获取"""
+        if not ids:
+            return
+        vectors = normalize(embeddings)
+        with self._lock:
+            pending = self._writable(document_id)
+            for vector_id, vector in zip(ids, vectors):
+                pending[int(vector_id)] = vector
+
+    def delete(self, document_id: int, ids: List[str]) -> None:
+        """删除一个文档的指定向量"""
+        if not ids:
+            return
+        with self._lock:
+            pending = self._writable(document_id)
+            for vector_id in ids:
+                pending.pop(int(vector_id), None)
+
+    def delete_document(self, document_id: int) -> None:
+        """删除一个文档的全部向量"""
+        with self._lock:
+            self._pending[document_id] = {}
+
+    def discard(self, document_id: int) -> None:
+        """丢弃一个文档尚未持久化的修改"""
+        with self._lock:
+            self._pending.pop(document_id, None)
+
+    def count(self, document_id: int) -> int:
+        """统计一个文档的向量数量（包括尚未持久化的修改）"""
+        with self._lock:
+            pending = self._pending.get(document_id)
+        if pending is not None:
+            return len(pending)
+        segment = self._segment(document_id)
+        return len(segment) if segment is not None else 0
+
+    def persist(self, document_id: int = None) -> None:
+        """把内存中的修改写入文件，document_id 为空时写入所有文档"""
+        with self._lock:
+            document_ids = [document_id] if document_id is not None else list(self._pending)
+            snapshots = {
+                doc_id: self._pending.pop(doc_id)
+                for doc_id in document_ids if doc_id in self._pending
+            }
+        for doc_id, pending in snapshots.items():
+            self._write(doc_id, pending)
+
+    def _save_arrays(self, version_dir: str, ids: np.ndarray, vectors: np.ndarray) -> None:
+        np.save(os.path.join(version_dir, "ids.npy"), ids)
+        np.save(os.path.join(version_dir, "vectors.npy"), vectors)
+
+    def _write(self, document_id: int, pending: Dict[int, np.ndarray]) -> None:
+        document_dir = self._document_dir(document_id)
+        if not pending:
+            shutil.rmtree(document_dir, ignore_errors=True)
+            return
+
+        version = f"v{time.time_ns()}"
+        version_dir = os.path.join(document_dir, version)
+        os.makedirs(version_dir, exist_ok=True)
+
+        ids = np.fromiter(pending.keys(), dtype=np.int64, count=len(pending))
+        vectors = np.stack(list(pending.values())).astype(np.float32)
+        self._save_arrays(version_dir, ids, vectors)
+
+        # 原子地切换到新版本，再删除旧版本（已打开旧版本的进程仍可继续读取）
+        current_path = os.path.join(document_dir, CURRENT_FILENAME)
+        tmp_path = f"{current_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(tmp_path, current_path)
+        for name in os.listdir(document_dir):
+            if name.startswith('v') and name != version:
+                shutil.rmtree(os.path.join(document_dir, name), ignore_errors=True)
+        logger.info(f"文档 {document_id} 的 {len(ids)} 个向量已写入 {version_dir}")
+
+    def _search_segment(self, segment: _Segment, query: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        """暴力计算全部向量与查询的内积，返回得分最高的 k 个 (得分, 向量ID)"""
+        scores = np.empty(len(segment), dtype=np.float32)
+        for start in range(0, len(segment), self.block_rows):
+            end = start + self.block_rows
+            scores[start:end] = segment.vectors[start:end] @ query
+        candidates = top_k(scores, k)
+        return list(zip(scores[candidates].tolist(), segment.ids[candidates].tolist()))
+
+    def _document_ids(self) -> List[int]:
+        if not os.path.isdir(self.root_dir):
+            return []
+        return [int(name) for name in os.listdir(self.root_dir) if name.isdigit()]
+
+    def query(self, query_embedding: List[float], k: int,
+              document_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """检索与查询向量最相近的分块，返回格式与 ChromaVectorStore.query 相同"""
+        query = normalize(query_embedding)
+        hits = []
+        for document_id in (document_ids or self._document_ids()):
+            segment = self._segment(int(document_id))
+            if segment is None or not len(segment):
+                continue
+            for score, vector_id in self._search_segment(segment, query, k):
+                hits.append({
+                    "id": str(vector_id),
+                    "chunk_id": str(vector_id),
+                    "document_id": str(document_id),
+                    "text": "",
+                    "score": float(score),
+                })
+
+        hits.sort(key=lambda hit: hit["score"], reverse=True)
+        return hits[:k]
+
+    def memory_usage(self, document_ids: Optional[List[int]] = None) -> Dict[str, int]:
+        """统计已持久化向量的字节数：查询时需要扫描的数据与按需读取的原始向量"""
+        usage = {'vectors': 0, 'scan_bytes': 0, 'float_bytes': 0}
+        for document_id in (document_ids or self._document_ids()):
+            segment = self._segment(int(document_id))
+            if segment is None:
+                continue
+            usage['vectors'] += len(segment)
+            usage['scan_bytes'] += self._scan_bytes(segment)
+            if segment.vectors is not None:
+                usage['float_bytes'] += segment.vectors.nbytes
+        return usage
+
+    @staticmethod
+    def _scan_bytes(segment: _Segment) -> int:
+        return segment.vectors.nbytes + segment.ids.nbytes
+
+
+class QuantizedVectorStore(NumpyVectorStore):
+    """int8 量化的向量存储
+
+    Args:
+        root_dir: 存储根目录
+        rescore: 是否另外保存 float16 原始向量并对候选重新打分
+        rescore_factor: 重新打分的候选数量为 k 的倍数
+        block_rows: 近似打分时每次反量化的行数，限制临时数组的大小
+    """
+
+    def __init__(self, root_dir: str, rescore: bool = True, rescore_factor: int = 4,
+                 block_rows: int = 8192):
+        super().__init__(root_dir, block_rows=block_rows)
+        self.rescore = rescore
+        self.rescore_factor = max(1, rescore_factor)
+
+    def _save_arrays(self, version_dir: str, ids: np.ndarray, vectors: np.ndarray) -> None:
+        codes, scales = quantize(vectors)
+        np.save(os.path.join(version_dir, "ids.npy"), ids)
+        np.save(os.path.join(version_dir, "codes.npy"), codes)
+        np.save(os.path.join(version_dir, "scales.npy"), scales)
+        if self.rescore:
+            # float16 的相似度误差约为 1e-3，远小于 int8 近似打分的误差，磁盘占用只有 float32 的一半
+            np.save(os.path.join(version_dir, "vectors.npy"), vectors.astype(np.float16))
+
+    def _approximate_scores(self, segment: _Segment, query: np.ndarray) -> np.ndarray:
+        """用 int8 向量计算近似相似度，分块反量化以限制临时内存"""
+        scores = np.empty(len(segment), dtype=np.float32)
+        for start in range(0, len(segment), self.block_rows):
+            end = start + self.block_rows
+            scores[start:end] = segment.codes[start:end].astype(np.float32) @ query
+        return scores * segment.scales
+
+    def _search_segment(self, segment: _Segment, query: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        scores = self._approximate_scores(segment, query)
+        rescore = self.rescore and segment.vectors is not None
+        candidates = top_k(scores, k * self.rescore_factor if rescore else k)
+        if rescore:
+            # 只读取候选行的原始向量
+            candidates.sort()
+            scores = segment.vectors[candidates].astype(np.float32) @ query
+            return list(zip(scores.tolist(), segment.ids[candidates].tolist()))
+        return list(zip(scores[candidates].tolist(), segment.ids[candidates].tolist()))
+
+    @staticmethod
+    def _scan_bytes(segment: _Segment) -> int:
+        return segment.codes.nbytes + segment.scales.nbytes + segment.ids.nbytes
@@ -1,23 +1,34 @@
 """
 RAG引擎模块 - 负责文档处理、向量化、检索和生成
 """
+import bisect
 import logging
+import hashlib
 import json
 import re
 import time
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
+
+import numpy as np
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings  # 新版本导入方式
 from langchain.chains import RetrievalQA
 
 from inquiryspring_backend.documents.models import Document, DocumentChunk
 from .llm_client import LLMClientFactory
 from .prompt_manager import PromptManager
+from .embedding_provider import embedding_provider
+from .vector_store import get_vector_store
+from .keyword_index import keyword_index, reciprocal_rank_fusion
+from .reranker import reranker
+from .context_assembler import ContextAssembler
+from .response_cache import response_cache
+from .summarizer import MapReduceSummarizer, MAP_SYSTEM_PROMPT, needs_map_reduce, summary_template_version
+from inquiryspring_backend.documents.summary_store import summary_store
 from inquiryspring_backend.quiz.models import Quiz, Question
 from django.conf import settings
+from django.db import transaction
 
 logger = logging.getLogger(__name__)
 
@@ -33,13 +44,30 @@ class RAGEngine:
         # 文档处理参数
         'chunk_size': 1000,  # 文本块大小
         'chunk_overlap': 100,  # 文本块重叠大小
+        'embedding_batch_size': 64,  # 每批向量化并写入向量库的分块数
         
         # 检索参数
         'top_k_retrieval': 3,  # 检索结果数量
-        'retrieval_threshold': 0.6,  # 检索相似度阈值
+        'top_k_project_retrieval': 5,  # 跨文档（项目级）检索结果数量
+        'top_k_context': 8,  # 组装上下文时的候选分块数量，最终数量由token预算决定
+        'context_token_budget': 2000,  # 参考资料部分的token预算
+        'retrieval_threshold': 0.6,  # 检索相似度阈值，低于该值的向量检索结果被丢弃
+        'retrieval_mode': 'hybrid',  # 检索方式：hybrid（向量+关键词）/ vector / keyword
+        'retrieval_candidate_multiplier': 4,  # 混合检索时每一路召回 top_k 的倍数作为候选
+        'rrf_k': 60,  # 倒数排名融合的平滑常数
+        'keyword_only_hits': True,  # 混合检索时是否保留只被关键词命中的分块（这类分块没有余弦相似度，不受 retrieval_threshold 约束）
+        'vector_weight': 1.0,  # 融合时向量检索结果的权重
+        'keyword_weight': 1.0,  # 融合时关键词检索结果的权重
+        'rerank_enabled': getattr(settings, 'RERANK_ENABLED', False),  # 是否用交叉编码器重排序
+        'rerank_candidates': getattr(settings, 'RERANK_CANDIDATES', 20),  # 重排序的候选分块数量
         
         # 向量数据库
         'vector_store_dir': VECTOR_STORE_DIR,  # 向量存储目录
+        'vector_collection': 'document_chunks',  # 所有文档共享的Chroma集合名
+        'vector_store_shards': 1,  # 按document_id分片的集合数量
+        'vector_store_backend': getattr(settings, 'VECTOR_STORE_BACKEND', 'chroma'),  # chroma / numpy / int8
+        'quantized_rescore': True,  # int8 模式下是否另存 float16 向量并对候选重新打分（磁盘占用从 float32 的 1/4 增加到 3/4）
+        'quantized_rescore_factor': 4,  # 重新打分的候选数量为 k 的倍数
         
         # 测验生成参数
         'default_question_count': 5,  # 默认题目数量
@@ -56,6 +84,16 @@ class RAGEngine:
         self.document_chunks = []
         self.vector_store = None
         
+        # 最近一次处理文档时的分块统计（总数、复用、新向量化、删除）
+        self.last_embedding_stats = {}
+        
+        # 最近一次检索的耗时统计（检索与重排序分别计时）
+        self.last_retrieval_stats = {}
+        
+        # 分块索引：chunk_id -> 分块，内容哈希 -> 分块
+        self._chunk_index = {}
+        self._content_index = {}
+        
         # 合并配置
         self.config = self.DEFAULT_CONFIG.copy()
         if config:
@@ -65,6 +103,7 @@ class RAGEngine:
             try:
                 self.document = Document.objects.get(id=document_id)
                 self.document_chunks = list(self.document.chunks.all())
+                self._build_chunk_indexes()
             except Document.DoesNotExist:
                 logger.error(f"文档ID {document_id} 不存在.")
                 # 可以选择抛出异常或允许在没有文档的情况下初始化
@@ -72,10 +111,8 @@ class RAGEngine:
         # 初始化LLM客户端
         self.llm_client = llm_client if llm_client else LLMClientFactory.create_client()
         
-        # 修改嵌入模型初始化
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-mpnet-base-v2"  # 明确指定模型名称
-        )
+        # 使用进程内共享的嵌入模型，避免每次请求重新加载
+        self.embeddings = embedding_provider.get_embeddings()
         
         # 如果文档已处理，则加载向量存储
         if self.document and self.document.is_processed and self.document_chunks:
@@ -96,8 +133,18 @@ class RAGEngine:
         chunks = text_splitter.split_text(content)
         return chunks
 
-    def process_and_embed_document(self, force_reprocess: bool = False) -> bool:
-        """处理并嵌入文档"""
+    def process_and_embed_document(self, force_reprocess: bool = False,
+                                   progress_callback: Callable[[str, int], None] = None) -> bool:
+        """处理并嵌入文档
+
+        重新处理时按内容哈希复用未变化的分块及其向量，只向量化新增或修改的分块，
+        统计结果保存在 last_embedding_stats 中。新分块全部向量化成功后才在一个事务中修改分块，
+        处理失败时文档原有的分块和向量保持不变。
+
+        Args:
+            force_reprocess: 已处理的文档是否重新处理
+            progress_callback: 进度回调，参数为 (阶段, 百分比)
+        """
         if not self.document:
             logger.error("未加载文档，无法处理。")
             return False
@@ -108,83 +155,253 @@ class RAGEngine:
                 self._load_vector_store()
             return True
 
+        # 已写入向量存储但可能随事务回滚的向量ID，失败时撤销
+        upserted_ids = []
         try:
             logger.info(f"开始处理文档: {self.document.title}")
             
-            # 1. 获取文档内容 (优先使用文件内容，其次是文本内容字段)
-            doc_content = ""
-            if self.document.file:
+            # 文档内容即将变化，清除基于旧内容的缓存回答
+            response_cache.invalidate_document(self.document.id)
+            
+            # 1. 获取文档内容 (优先使用已提取的文本内容，分块位置和页码都基于该内容；其次读取文件)
+            doc_content = self.document.content
+            if not doc_content and self.document.file:
                 try:
                     doc_content = self.document.file.read().decode('utf-8')
                 except Exception as e:
                     logger.error(f"读取文件内容失败: {e}")
-                    doc_content = self.document.content # 后备方案
-            else:
-                doc_content = self.document.content
             
             if not doc_content:
                 logger.error(f"文档 {self.document.title} 内容为空，无法处理。")
                 return False
 
-            # 2. 分割文档
+            # 2. 分割文档，并记录每个分块的位置和页码
             text_chunks = self._split_document(doc_content)
             if not text_chunks:
                 logger.error(f"文档 {self.document.title} 分块失败。")
                 return False
+            chunk_metadata = self._locate_chunks(
+                doc_content, text_chunks, (self.document.metadata or {}).get('page_offsets')
+            )
+
+            # 3. 按内容哈希匹配已有分块：内容未变的分块保留ID和向量，只向量化新增或修改的分块
+            self.vector_store = get_vector_store(self.config)
+            existing_chunks = list(self.document.chunks.order_by('chunk_index'))
+            rebuild = bool(existing_chunks) and self.vector_store.count(self.document.id) != len(existing_chunks)
+
+            reusable = {}
+            if rebuild:
+                # 向量与分块不一致（如向量库被清空），不能复用旧向量，旧分块全部作为过期分块删除
+                logger.warning(f"文档 {self.document.title} 的向量与分块数量不一致，全部重新向量化")
+                reusable[None] = existing_chunks
+            else:
+                for chunk in existing_chunks:
+                    reusable.setdefault(chunk.content_hash or self._hash_text(chunk.content), []).append(chunk)
+
+            reused_chunks = []
+            new_chunks = []
+            for index, chunk_text in enumerate(text_chunks):
+                content_hash = self._hash_text(chunk_text)
+                candidates = reusable.get(content_hash)
+                if candidates:
+                    chunk = candidates.pop(0)
+                    chunk.chunk_index = index
+                    chunk.metadata = chunk_metadata[index]
+                    chunk.content_hash = content_hash
+                    reused_chunks.append(chunk)
+                else:
+                    new_chunks.append(DocumentChunk(
+                        document=self.document,
+                        content=chunk_text,
+                        content_hash=content_hash,
+                        chunk_index=index,
+                        metadata=chunk_metadata[index]
+                    ))
+            stale_ids = [chunk.id for candidates in reusable.values() for chunk in candidates]
 
-            # 3. 清理旧的文档分块 (如果存在)
-            self.document.chunks.all().delete()
-            self.document_chunks = []
-
-            # 4. 创建并存储DocumentChunk对象
-            chunk_objects = []
-            current_char_offset = 0
-            for i, chunk_text in enumerate(text_chunks):
-                chunk_obj = DocumentChunk(
-                    document=self.document,
-                    content=chunk_text,
-                    chunk_index=i,
-                    start_char=current_char_offset,
-                    end_char=current_char_offset + len(chunk_text) -1
+            # 4. 先分批向量化新分块，此时还没有修改数据库和向量存储，向量化失败时旧分块和向量保持不变
+            # 模型每次只处理一批，结果以 float32 数组暂存
+            batch_size = self.config['embedding_batch_size']
+            total_new = len(new_chunks)
+            cache_hits = 0
+            batch_vectors = []
+            for batch_start in range(0, total_new, batch_size):
+                batch = new_chunks[batch_start:batch_start + batch_size]
+                # 内容相同的分块直接使用缓存的向量，不再运行嵌入模型
+                vectors, batch_hits = embedding_provider.embed_documents_cached(
+                    [chunk.content for chunk in batch],
+                    batch_size=batch_size
                 )
-                chunk_objects.append(chunk_obj)
-                current_char_offset += len(chunk_text)
-            
-            DocumentChunk.objects.bulk_create(chunk_objects)
-            self.document_chunks = list(self.document.chunks.all())
-            logger.info(f"文档 {self.document.title} 分块完成，共 {len(self.document_chunks)} 块。")
-
-            # 5. 创建或更新向量存储
-            # 使用Chroma作为向量数据库并启用持久化
-            persist_directory = os.path.join(self.config['vector_store_dir'], str(self.document.id))
-            os.makedirs(persist_directory, exist_ok=True)
-            
-            # 为每个chunk准备metadata，包含chunk_id和document_id
-            metadatas = [{'chunk_id': str(chunk.id), 'document_id': str(self.document.id)} for chunk in self.document_chunks]
-            
-            self.vector_store = Chroma.from_texts(
-                texts=[chunk.content for chunk in self.document_chunks],
-                embedding=self.embeddings,
-                ids=[str(chunk.id) for chunk in self.document_chunks],  # 使用DocumentChunk的ID作为向量ID
-                metadatas=metadatas,  # 添加元数据以便检索时能够直接获取chunk_id
-                persist_directory=persist_directory  # 启用持久化
-            )
+                cache_hits += batch_hits
+                batch_vectors.append(np.asarray(vectors, dtype=np.float32))
+                self._report_progress('embedding', batch_start + len(batch), total_new, progress_callback)
+
+            # 5. 在一个事务中更新保留分块的位置、删除过期分块并创建新分块，同时写入新向量
+            # 失败时事务回滚，已写入的新向量在下面的异常处理中撤销
+            with transaction.atomic():
+                if stale_ids:
+                    DocumentChunk.objects.filter(id__in=stale_ids).delete()
+                if reused_chunks:
+                    DocumentChunk.objects.bulk_update(reused_chunks, ['chunk_index', 'metadata', 'content_hash'])
+                if rebuild:
+                    self.vector_store.delete_document(self.document.id)
+
+                created_chunks = []
+                for batch_start, vectors in zip(range(0, total_new, batch_size), batch_vectors):
+                    batch = new_chunks[batch_start:batch_start + batch_size]
+                    DocumentChunk.objects.bulk_create(batch)
+                    # 过期分块已删除、保留分块已移到新位置，这些位置上只有刚创建的分块
+                    batch_chunks = sorted(
+                        self.document.chunks.filter(chunk_index__in=[chunk.chunk_index for chunk in batch]),
+                        key=lambda chunk: chunk.chunk_index
+                    )
+                    # 使用DocumentChunk的ID作为向量ID，metadata中记录chunk_id以便检索时直接获取
+                    upserted_ids.extend(str(chunk.id) for chunk in batch_chunks)
+                    self.vector_store.upsert(
+                        document_id=self.document.id,
+                        ids=[str(chunk.id) for chunk in batch_chunks],
+                        embeddings=vectors.tolist(),
+                        texts=[chunk.content for chunk in batch_chunks],
+                        metadatas=[{'chunk_id': str(chunk.id)} for chunk in batch_chunks]
+                    )
+                    created_chunks.extend(batch_chunks)
+
+            # 6. 数据库已提交，新向量不再需要撤销；最后删除过期分块的向量
+            upserted_ids.clear()
+            if stale_ids and not rebuild:
+                self.vector_store.delete(self.document.id, [str(chunk_id) for chunk_id in stale_ids])
+            self.document_chunks = reused_chunks + created_chunks
+            self._build_chunk_indexes()
+            self.document_chunks.sort(key=lambda chunk: chunk.chunk_index)
+            self.last_embedding_stats = {
+                'total_chunks': len(text_chunks),
+                'reused_chunks': len(reused_chunks),
+                'embedded_chunks': total_new,
+                'deleted_chunks': len(stale_ids),
+                'embedding_cache_hits': cache_hits,
+                'embedding_cache_hit_ratio': round(cache_hits / total_new, 4) if total_new else 0.0,
+            }
+
             # 持久化到磁盘
-            self.vector_store.persist()
-            logger.info(f"文档 {self.document.title} 向量化完成并持久化到 {persist_directory}。")
+            self.vector_store.persist(self.document.id)
+            keyword_index.invalidate_document(self.document.id)
+            logger.info(
+                f"文档 {self.document.title} 分块并向量化完成，共 {len(self.document_chunks)} 块，"
+                f"复用 {len(reused_chunks)} 块，新向量化 {total_new} 块（其中 {cache_hits} 块命中向量缓存），"
+                f"删除 {len(stale_ids)} 块，"
+                f"已写入向量存储 ({self.config['vector_store_backend']})。"
+            )
 
-            # 6. 更新文档状态
+            # 7. 更新文档状态
             self.document.is_processed = True
+            self.document.processing_status = 'completed'
             self.document.save()
             
             return True
 
         except Exception as e:
             logger.exception(f"处理文档 {self.document.title} 失败: {e}")
+            self._discard_vector_changes(upserted_ids)
             self.document.is_processed = False # 出错时标记为未处理
+            self.document.processing_status = 'failed'
+            self.document.error_message = str(e)
             self.document.save()
             return False
 
+    def _locate_chunks(self, content: str, text_chunks: List[str],
+                       page_offsets: List[int] = None) -> List[Dict[str, int]]:
+        """计算每个分块在文档内容中的位置；提供每页起始位置时同时计算分块的起止页码（从1开始）"""
+        metadata = []
+        search_from = 0
+        for chunk_text in text_chunks:
+            start = content.find(chunk_text, search_from)
+            if start < 0:
+                # 分割器调整过空白字符时无法精确定位，不记录位置
+                metadata.append({})
+                continue
+            end = start + len(chunk_text)
+            # 相邻分块最多重叠 chunk_overlap 个字符，下一个分块从重叠区域开始查找
+            search_from = max(start + 1, end - self.config['chunk_overlap'])
+            entry = {'start': start, 'end': end}
+            if page_offsets:
+                entry['page_start'] = bisect.bisect_right(page_offsets, start)
+                entry['page_end'] = bisect.bisect_right(page_offsets, max(start, end - 1))
+            metadata.append(entry)
+        return metadata
+
+    def _report_progress(self, stage: str, done: int, total: int,
+                         progress_callback: Callable[[str, int], None] = None) -> None:
+        """将处理进度写入 Document.processing_status，例如 'embedding 40%'"""
+        percent = int(done * 100 / total) if total else 100
+        status_text = f"{stage} {percent}%"
+        self.document.processing_status = status_text
+        # 只更新状态字段，避免覆盖其他字段
+        Document.objects.filter(id=self.document.id).update(processing_status=status_text)
+        if progress_callback:
+            progress_callback(stage, percent)
+
+    def _discard_vector_changes(self, upserted_ids: List[str]) -> None:
+        """处理失败时撤销本次对向量存储的修改
+
+        Chroma 立即写入，需要删除已写入的新向量；numpy/int8 存储丢弃尚未持久化的修改，
+        否则它们会留在进程内共享的存储实例中，被下一次 persist 写入文件。
+        """
+        if not self.vector_store:
+            return
+        try:
+            self.vector_store.delete(self.document.id, upserted_ids)
+            self.vector_store.discard(self.document.id)
+        except Exception as e:
+            logger.warning(f"撤销文档 {self.document.id} 的向量修改失败: {e}")
+
+    @staticmethod
+    def _hash_text(text: str) -> str:
+        """计算分块内容的哈希，用于按内容查找分块和增量向量化"""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _build_chunk_indexes(self) -> None:
+        """根据 self.document_chunks 重建分块索引"""
+        self._chunk_index = {}
+        self._content_index = {}
+        self._index_chunks(self.document_chunks)
+
+    def _index_chunks(self, chunks: List[DocumentChunk]) -> None:
+        for chunk in chunks:
+            self._chunk_index[chunk.id] = chunk
+            self._content_index.setdefault(chunk.content_hash or self._hash_text(chunk.content), chunk)
+
+    def _resolve_chunks(self, hits: List[Dict[str, Any]]) -> List[DocumentChunk]:
+        """将向量检索结果映射回DocumentChunk
+
+        优先使用内存中的ID索引，缺失的ID通过一次 in_bulk 查询获取；
+        没有chunk_id的旧数据按内容哈希匹配。
+        """
+        hit_chunk_ids = [int(hit['chunk_id']) for hit in hits if hit['chunk_id']]
+        missing_ids = [chunk_id for chunk_id in hit_chunk_ids if chunk_id not in self._chunk_index]
+        fetched = DocumentChunk.objects.select_related('document').in_bulk(missing_ids) if missing_ids else {}
+
+        resolved = []
+        for hit in hits:
+            if hit['chunk_id']:
+                chunk_id = int(hit['chunk_id'])
+                chunk = self._chunk_index.get(chunk_id) or fetched.get(chunk_id)
+                if not chunk:
+                    logger.warning(f"检索到的chunk ID {chunk_id} 在数据库中不存在")
+                    continue
+            else:
+                logger.warning("检索结果中未找到chunk_id，使用内容哈希匹配")
+                chunk = self._content_index.get(self._hash_text(hit['text']))
+                if not chunk:
+                    logger.warning(f"无法匹配检索结果: {hit['text'][:100]}...")
+                    continue
+            # 添加相似度分数作为临时属性，只被关键词命中的分块没有余弦相似度，为None
+            chunk.similarity_score = hit['score']
+            for key in ('fusion_score', 'keyword_score'):
+                if key in hit:
+                    setattr(chunk, key, hit[key])
+            resolved.append(chunk)
+        return resolved
+
     def _load_vector_store(self):
         """从持久化存储加载向量数据库"""
         if not self.document or not self.document.is_processed:
@@ -194,18 +411,14 @@ class RAGEngine:
         try:
             logger.info(f"加载文档 {self.document.title} 的向量存储...")
             
-            # 检查持久化目录是否存在
-            persist_directory = os.path.join(self.config['vector_store_dir'], str(self.document.id))
-            if os.path.exists(persist_directory):
-                # 从持久化目录加载向量存储
-                self.vector_store = Chroma(
-                    persist_directory=persist_directory,
-                    embedding_function=self.embeddings
-                )
-                logger.info(f"从持久化目录 {persist_directory} 加载向量存储成功。")
+            # 共享向量存储在进程内只打开一次，这里只需确认该文档已有向量
+            vector_store = get_vector_store(self.config)
+            if vector_store.count(self.document.id) > 0:
+                self.vector_store = vector_store
+                logger.info(f"文档 {self.document.title} 的向量已在共享集合中。")
             else:
-                logger.warning(f"持久化向量存储目录 {persist_directory} 不存在，重新创建")
-                # 如果持久化目录不存在，重新嵌入
+                logger.warning(f"共享向量集合中没有文档 {self.document.title} 的向量，重新创建")
+                # 如果没有向量，重新嵌入
                 if self.document_chunks:
                     success = self.process_and_embed_document(force_reprocess=True)
                     if not success:
@@ -217,6 +430,78 @@ class RAGEngine:
             logger.exception(f"加载向量存储失败: {e}")
             self.vector_store = None # 加载失败则清空
 
+    def _search(self, query: str, document_ids: List[int], top_k: int, vector_store) -> List[Dict[str, Any]]:
+        """按 retrieval_mode 检索，返回与 vector_store.query 相同格式的结果
+
+        score 始终是余弦相似度，没有向量得分的结果为None；关键词检索的BM25得分放在 keyword_score。
+        混合检索时两路各召回更多候选，按倒数排名融合排序，融合得分放在 fusion_score。
+
+        阈值策略：retrieval_threshold 只约束余弦相似度，向量结果低于阈值时不参与融合；
+        只被关键词命中的分块与问题有共同词项，默认不受该阈值约束；
+        keyword_only_hits 为False时丢弃这类分块，使融合结果中的每个分块都满足阈值。
+        """
+        mode = self.config['retrieval_mode']
+        threshold = self.config['retrieval_threshold']
+        candidate_k = top_k * self.config['retrieval_candidate_multiplier'] if mode == 'hybrid' else top_k
+
+        vector_hits = []
+        if mode in ('hybrid', 'vector'):
+            query_embedding = embedding_provider.embed_query(query)
+            vector_hits = [
+                hit for hit in vector_store.query(query_embedding, k=candidate_k, document_ids=document_ids)
+                if threshold is None or hit['score'] >= threshold
+            ]
+            if mode == 'vector':
+                return vector_hits
+
+        keyword_hits = keyword_index.search(query, document_ids, candidate_k)
+        if mode == 'keyword':
+            return [{'chunk_id': chunk_id, 'text': '', 'score': None, 'keyword_score': score}
+                    for chunk_id, score in keyword_hits]
+
+        vector_scores = {int(hit['chunk_id']): hit['score'] for hit in vector_hits if hit['chunk_id']}
+        keyword_scores = dict(keyword_hits)
+        if not self.config['keyword_only_hits']:
+            keyword_hits = [(chunk_id, score) for chunk_id, score in keyword_hits if chunk_id in vector_scores]
+
+        # 没有chunk_id的旧数据无法与关键词结果对应，按原顺序排在融合结果之后
+        legacy_hits = [hit for hit in vector_hits if not hit['chunk_id']]
+        fused = reciprocal_rank_fusion([
+            (list(vector_scores), self.config['vector_weight']),
+            ([chunk_id for chunk_id, _ in keyword_hits], self.config['keyword_weight']),
+        ], rrf_k=self.config['rrf_k'])
+        hits = []
+        for chunk_id, fusion_score in fused:
+            hit = {'chunk_id': str(chunk_id), 'text': '', 'score': vector_scores.get(chunk_id),
+                   'fusion_score': fusion_score}
+            if chunk_id in keyword_scores:
+                hit['keyword_score'] = keyword_scores[chunk_id]
+            hits.append(hit)
+        return (hits + legacy_hits)[:top_k]
+
+    def _retrieve(self, query: str, document_ids: List[int], top_k: int, vector_store) -> List[DocumentChunk]:
+        """检索并映射为DocumentChunk；启用重排序时先检索 rerank_candidates 个候选，重排序后保留前top_k个"""
+        rerank = self.config['rerank_enabled'] and reranker.available
+        candidate_k = max(top_k, self.config['rerank_candidates']) if rerank else top_k
+
+        start_time = time.perf_counter()
+        # 批量将检索结果映射回DocumentChunk对象
+        chunks = self._resolve_chunks(self._search(query, document_ids, candidate_k, vector_store))
+        stats = {'retrieval_ms': round((time.perf_counter() - start_time) * 1000, 2)}
+
+        if rerank:
+            chunks, rerank_stats = reranker.rerank(query, chunks, top_k)
+            stats.update(rerank_stats)
+            logger.info(
+                f"重排序 {rerank_stats['candidates']} 个候选分块（缓存命中 {rerank_stats['cache_hits']}），"
+                f"检索 {stats['retrieval_ms']}ms，重排序 {rerank_stats['rerank_ms']}ms"
+            )
+        elif self.config['rerank_enabled']:
+            logger.warning("未安装 sentence-transformers，跳过重排序")
+
+        self.last_retrieval_stats = stats
+        return chunks
+
     def retrieve_relevant_chunks(self, query: str, top_k: int = 3) -> List[DocumentChunk]:
         """根据查询检索相关的文档分块"""
         if not self.vector_store:
@@ -234,35 +519,8 @@ class RAGEngine:
                 return []
 
         try:
-            # 从向量存储中检索相似文档
-            retrieved_langchain_docs = self.vector_store.similarity_search_with_score(query, k=top_k)
-            
-            # 使用metadata中的chunk_id直接获取DocumentChunk对象
-            retrieved_chunks = []
-            for lc_doc, score in retrieved_langchain_docs:
-                try:
-                    # 从metadata中获取chunk_id
-                    chunk_id = lc_doc.metadata.get('chunk_id')
-                    
-                    if chunk_id:
-                        # 通过ID从数据库获取DocumentChunk
-                        chunk = DocumentChunk.objects.get(id=chunk_id)
-                        # 添加相似度分数作为临时属性
-                        chunk.similarity_score = score
-                        retrieved_chunks.append(chunk)
-                    else:
-                        # 后备方案：通过内容匹配（低效）
-                        logger.warning("检索结果中未找到chunk_id，使用内容匹配")
-                        matched_chunk = next((c for c in self.document_chunks if c.content == lc_doc.page_content), None)
-                        if matched_chunk:
-                            matched_chunk.similarity_score = score
-                            retrieved_chunks.append(matched_chunk)
-                        else:
-                            logger.warning(f"无法匹配检索结果: {lc_doc.page_content[:100]}...")
-                except DocumentChunk.DoesNotExist:
-                    logger.warning(f"检索到的chunk ID {chunk_id} 在数据库中不存在")
-                except Exception as e:
-                    logger.error(f"从检索结果映射回DocumentChunk时出错: {e}")
+            # 在共享向量存储和关键词索引中检索当前文档的相关分块
+            retrieved_chunks = self._retrieve(query, [self.document.id], top_k, self.vector_store)
             
             logger.info(f"为查询 '{query}' 检索到 {len(retrieved_chunks)} 个相关分块。")
             return retrieved_chunks
@@ -271,6 +529,62 @@ class RAGEngine:
             logger.exception(f"检索相关分块失败: {e}")
             return []
 
+    def retrieve_from_documents(self, query: str, document_ids: List[int],
+                                top_k: int = None) -> List[DocumentChunk]:
+        """在多个文档中检索相关分块，合并排序后返回前top_k个
+
+        不依赖 self.document，可用于项目级检索。
+        """
+        if not document_ids:
+            return []
+        if top_k is None:
+            top_k = self.config['top_k_project_retrieval']
+
+        try:
+            vector_store = self.vector_store or get_vector_store(self.config)
+            retrieved_chunks = self._retrieve(query, document_ids, top_k, vector_store)
+
+            logger.info(f"在 {len(document_ids)} 个文档中为查询 '{query}' 检索到 {len(retrieved_chunks)} 个相关分块。")
+            return retrieved_chunks
+
+        except Exception as e:
+            logger.exception(f"跨文档检索失败: {e}")
+            return []
+
+    @staticmethod
+    def build_citations(chunks: List[DocumentChunk]) -> List[Dict[str, Any]]:
+        """根据检索到的分块生成引用信息，PDF分块包含起止页码
+
+        score 为余弦相似度（只被关键词命中时为None，启用重排序时为重排序得分），混合检索的结果另有 fusion_score。
+        """
+        citations = []
+        for chunk in chunks:
+            score = getattr(chunk, 'similarity_score', None)
+            citation = {
+                'document_id': chunk.document_id,
+                'document_title': chunk.document.title,
+                'chunk_id': chunk.id,
+                'chunk_index': chunk.chunk_index,
+                'score': round(score, 4) if score is not None else None,
+            }
+            if getattr(chunk, 'fusion_score', None) is not None:
+                citation['fusion_score'] = round(chunk.fusion_score, 4)
+            metadata = chunk.metadata or {}
+            if 'page_start' in metadata:
+                citation['page_start'] = metadata['page_start']
+                citation['page_end'] = metadata['page_end']
+            citations.append(citation)
+        return citations
+
+    def assemble_context(self, chunks: List[DocumentChunk], token_budget: int = None) -> Dict[str, Any]:
+        """在token预算内组装检索到的分块，去除相邻分块的重叠文本"""
+        assembler = ContextAssembler(
+            token_budget=token_budget or self.config['context_token_budget'],
+            token_counter=self.llm_client._estimate_tokens,
+            max_overlap=self.config['chunk_overlap'],
+        )
+        return assembler.assemble(chunks)
+
     def generate_answer(self, query: str, relevant_chunks: List[DocumentChunk]) -> Dict[str, Any]:
         """根据查询和相关文档块生成答案"""
         if not relevant_chunks:
@@ -283,7 +597,7 @@ class RAGEngine:
             )
             system_prompt = "你是一个专业的学习助手。请基于你的知识尽可能准确地回答用户的问题，明确指出这是基于你的知识而非特定文档的回答。"
         else:
-            context_text = "\n\n---\n\n".join([chunk.content for chunk in relevant_chunks])
+            context_text = self.assemble_context(relevant_chunks)['context']
             prompt_variables = {
                 'query': query,
                 'reference_text': context_text
@@ -309,7 +623,15 @@ class RAGEngine:
         return response
 
     def answer_query(self, query: str, top_k_retrieval: int = None) -> Dict[str, Any]:
-        """处理用户查询，包括检索和生成"""
+        """处理用户查询，包括检索和生成；同一文档下语义相近的问题复用缓存的回答"""
+        response, cache_hit = response_cache.get_or_compute(
+            'rag_answer', query, [self.document.id] if self.document else [],
+            lambda: self._answer_query(query, top_k_retrieval)
+        )
+        response['cache_hit'] = cache_hit
+        return response
+
+    def _answer_query(self, query: str, top_k_retrieval: int = None) -> Dict[str, Any]:
         if top_k_retrieval is None:
             top_k_retrieval = self.config['top_k_retrieval']
             
@@ -567,15 +889,29 @@ class RAGEngine:
             
         return response
 
-    def generate_summary(self, summary_length: str = None, include_outline: bool = None) -> Dict[str, Any]:
-        """为当前文档生成摘要
+    # 摘要系统提示词
+    SUMMARY_SYSTEM_PROMPT = """你是一个专业的文档分析和总结专家。请基于提供的文档内容生成一个全面、结构清晰的摘要。
+摘要应该忠实原文，不添加不存在的内容，保持客观和准确。按照要求的长度和格式进行组织。"""
+    SUMMARY_OUTLINE_PROMPT = "请先生成一个结构化的大纲，然后再提供详细摘要。大纲应当清晰地展示文档的主要章节和关键点。"
+    
+    # 根据长度设置指导
+    SUMMARY_LENGTH_GUIDE = {
+        'short': "生成一个简短摘要，约为原文的5-10%，只包含最核心的信息点。",
+        'medium': "生成一个中等长度的摘要，约为原文的10-15%，包含主要论点和关键细节。",
+        'long': "生成一个详细摘要，约为原文的15-25%，包含主要论点、关键证据和重要细节，但仍保持简洁。"
+    }
+
+    def generate_summary(self, summary_length: str = None, include_outline: bool = None,
+                         force: bool = False) -> Dict[str, Any]:
+        """为当前文档生成摘要，已保存且仍然有效的摘要直接返回
         
         Args:
             summary_length: 摘要长度，可选值 'short'（短）, 'medium'（中）, 'long'（长）
             include_outline: 是否包含结构大纲
+            force: 忽略已保存的摘要，重新生成
             
         Returns:
-            包含生成摘要结果的字典
+            包含生成摘要结果的字典，summary_status 为 fresh（已保存）、stale（已过期，后台重新生成中）或 generated
         """
         # 使用配置的默认值
         if summary_length is None:
@@ -585,52 +921,28 @@ class RAGEngine:
             
         if not self.document:
             return {"error": "未加载文档，无法生成摘要。"}
-
-        doc_content = self.document.content
-        if self.document.file:
-            try:
-                doc_content = self.document.file.read().decode('utf-8')
-            except Exception:
-                pass
-        
-        # 设置系统提示词
-        system_prompt = """你是一个专业的文档分析和总结专家。请基于提供的文档内容生成一个全面、结构清晰的摘要。
-摘要应该忠实原文，不添加不存在的内容，保持客观和准确。按照要求的长度和格式进行组织。"""
-        
-        if include_outline:
-            system_prompt += "请先生成一个结构化的大纲，然后再提供详细摘要。大纲应当清晰地展示文档的主要章节和关键点。"
-        
-        # 根据长度设置指导
-        length_guide = {
-            'short': "生成一个简短摘要，约为原文的5-10%，只包含最核心的信息点。",
-            'medium': "生成一个中等长度的摘要，约为原文的10-15%，包含主要论点和关键细节。",
-            'long': "生成一个详细摘要，约为原文的15-25%，包含主要论点、关键证据和重要细节，但仍保持简洁。"
-        }
         
         # 确保长度参数有效
-        if summary_length not in length_guide:
+        if summary_length not in self.SUMMARY_LENGTH_GUIDE:
             summary_length = 'medium'
-            
-        prompt_variables = {
-            'content': doc_content,
-            'length_requirement': length_guide[summary_length],
-            'outline_requirement': "请先提供一个结构化大纲，然后再给出详细摘要。" if include_outline else ""
-        }
         
-        # 获取渲染后的提示词
-        prompt = PromptManager.render_by_type(
-            template_type='summary',
-            variables=prompt_variables
+        # 模板或提示词变化后，已保存的摘要视为过期
+        template = PromptManager.get_template('summary')
+        template_version = summary_template_version(
+            template.content if template else PromptManager.get_default_summary_template(),
+            self.SUMMARY_SYSTEM_PROMPT,
+            self.SUMMARY_OUTLINE_PROMPT,
+            self.SUMMARY_LENGTH_GUIDE[summary_length]
         )
         
-        # 调用LLM生成摘要
-        response = self.llm_client.generate_text(
-            prompt=prompt, 
-            system_prompt=system_prompt,
-            task_type='summary'
+        response, summary_status = summary_store.get_or_generate(
+            self.document, summary_length, include_outline, template_version,
+            lambda document: self._generate_summary(document, summary_length, include_outline),
+            force=force
         )
         
         # 添加额外信息到响应
+        response['summary_status'] = summary_status
         response['summary_config'] = {
             'length': summary_length,
             'include_outline': include_outline,
@@ -640,6 +952,70 @@ class RAGEngine:
         
         return response
 
+    def _generate_summary(self, document: Document, summary_length: str, include_outline: bool) -> Dict[str, Any]:
+        """调用LLM为文档生成摘要
+
+        总结提取后的文本 document.content，与摘要存储判断是否过期时使用的内容一致
+        """
+        doc_content = document.content
+        if not doc_content:
+            return {"error": "文档内容为空，无法生成摘要。"}
+        
+        # 设置系统提示词
+        system_prompt = self.SUMMARY_SYSTEM_PROMPT
+        if include_outline:
+            system_prompt += self.SUMMARY_OUTLINE_PROMPT
+            
+        def summarize(content: str) -> Dict[str, Any]:
+            prompt_variables = {
+                'content': content,
+                'length_requirement': self.SUMMARY_LENGTH_GUIDE[summary_length],
+                'outline_requirement': "请先提供一个结构化大纲，然后再给出详细摘要。" if include_outline else ""
+            }
+            
+            # 获取渲染后的提示词
+            prompt = PromptManager.render_by_type(
+                template_type='summary',
+                variables=prompt_variables
+            )
+            
+            # 调用LLM生成摘要
+            # 同一文档、同样参数的摘要直接复用缓存结果
+            return self.llm_client.generate_text(
+                prompt=prompt, 
+                system_prompt=system_prompt,
+                task_type='summary',
+                use_cache=True
+            )
+        
+        if needs_map_reduce(doc_content):
+            # 长文档先逐块概括再合并，分块概括缓存在DocumentChunk上
+            summarizer = MapReduceSummarizer(self._generate_partial_summary)
+            try:
+                response, stats = summarizer.summarize_document(
+                    document,
+                    lambda partials: summarize(f"（以下为文档各部分的要点概括）\n\n{partials}")
+                )
+            except Exception as e:
+                logger.exception(f"分层摘要生成失败: {e}")
+                return {"error": f"分层摘要生成失败: {str(e)}"}
+            response['map_reduce'] = stats
+            return response
+        
+        return summarize(doc_content)
+
+    def _generate_partial_summary(self, prompt: str) -> str:
+        """生成分块要点概括，失败时抛出异常"""
+        result = self.llm_client.generate_text(
+            prompt=prompt,
+            system_prompt=MAP_SYSTEM_PROMPT,
+            task_type='summary',
+            use_cache=True
+        )
+        if result.get('error'):
+            raise RuntimeError(result['error'])
+        return result['text']
+
     def generate_explanation(self, question_content: str, user_wrong_answer: str, correct_answer: str) -> Dict[str, Any]:
         """为错误答案生成解释"""
         if not self.document:
@@ -0,0 +1,159 @@
+"""
+交叉编码器重排序 - 在更大的候选集中按（问题, 分块）相关度重新排序，只保留前几个分块
+
+向量检索和关键词检索分别编码问题和分块，相关度判断较粗；交叉编码器把问题和分块一起输入模型，
+排序更准确但开销更大，因此只对检索得到的有限候选集打分，并在CPU上按批次计算。
+相同（问题, 分块内容）的得分缓存在进程内，重复提问时不再计算。
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 交叉编码器为可选依赖
+try:
+    from sentence_transformers import CrossEncoder
+    CROSS_ENCODER_AVAILABLE = True
+except ImportError:
+    CROSS_ENCODER_AVAILABLE = False
+
+# 默认重排序模型（多语言，约1.2亿参数，可在CPU上运行）
+DEFAULT_RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+
+class CrossEncoderReranker:
+    """进程级共享的交叉编码器重排序器
+
+    模型在第一次使用时加载，加载过程由锁保护。
+
+    Args:
+        model_name: 交叉编码器模型名或路径
+        batch_size: 每批打分的（问题, 分块）对数
+        cache_size: 进程内缓存的得分数量，超出后按LRU淘汰
+        device: 运行设备，默认CPU
+    """
+
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL, batch_size: int = 16,
+                 cache_size: int = 10000, device: str = 'cpu'):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.cache_size = cache_size
+        self.device = device
+        self.available = CROSS_ENCODER_AVAILABLE
+
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # 统计信息
+        self.load_time: Optional[float] = None
+        self.pairs_scored = 0
+        self.cache_hits = 0
+
+    def _get_model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    logger.info(f"正在加载重排序模型 {self.model_name}...")
+                    start_time = time.time()
+                    self._model = CrossEncoder(self.model_name, device=self.device)
+                    self.load_time = time.time() - start_time
+                    logger.info(f"重排序模型 {self.model_name} 加载完成，耗时 {self.load_time:.2f}s")
+        return self._model
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def score(self, query: str, texts: List[str]) -> Tuple[List[float], int]:
+        """计算问题与每段文本的相关度得分
+
+        Returns:
+            (与 texts 一一对应的得分, 命中缓存的数量)
+        """
+        query_hash = self._hash(query.strip())
+        keys = [(query_hash, self._hash(text)) for text in texts]
+
+        scores: List[Optional[float]] = []
+        with self._cache_lock:
+            for key in keys:
+                score = self._cache.get(key)
+                if score is not None:
+                    self._cache.move_to_end(key)
+                scores.append(score)
+
+        missing = [index for index, score in enumerate(scores) if score is None]
+        if missing:
+            predicted = self._get_model().predict(
+                [(query, texts[index]) for index in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            with self._cache_lock:
+                for index, score in zip(missing, predicted):
+                    scores[index] = float(score)
+                    self._cache[keys[index]] = scores[index]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        hits = len(texts) - len(missing)
+        with self._cache_lock:
+            self.pairs_scored += len(missing)
+            self.cache_hits += hits
+        return scores, hits
+
+    def rerank(self, query: str, chunks: List[Any], top_n: int) -> Tuple[List[Any], Dict[str, Any]]:
+        """按交叉编码器得分重新排序分块，返回前 top_n 个
+
+        分块原有的 similarity_score 保存到 retrieval_score，similarity_score 替换为重排序得分，
+        组装上下文和生成引用时按新的得分排序。
+
+        Returns:
+            (重排序后的分块, 统计信息)
+        """
+        if not chunks:
+            return [], {'candidates': 0, 'cache_hits': 0, 'rerank_ms': 0.0}
+
+        start_time = time.perf_counter()
+        scores, hits = self.score(query, [chunk.content for chunk in chunks])
+        for chunk, score in zip(chunks, scores):
+            chunk.retrieval_score = getattr(chunk, 'similarity_score', 0.0)
+            chunk.similarity_score = score
+        ranked = sorted(chunks, key=lambda chunk: chunk.similarity_score, reverse=True)[:top_n]
+
+        stats = {
+            'candidates': len(chunks),
+            'cache_hits': hits,
+            'rerank_ms': round((time.perf_counter() - start_time) * 1000, 2),
+        }
+        return ranked, stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取模型加载和缓存命中统计"""
+        with self._cache_lock:
+            total = self.pairs_scored + self.cache_hits
+            return {
+                'model_name': self.model_name,
+                'available': self.available,
+                'loaded': self._model is not None,
+                'load_time': self.load_time,
+                'cached_scores': len(self._cache),
+                'pairs_scored': self.pairs_scored,
+                'cache_hits': self.cache_hits,
+                'hit_rate': round(self.cache_hits / total, 4) if total else 0.0,
+            }
+
+
+# 全局重排序器实例
+reranker = CrossEncoderReranker(
+    model_name=getattr(settings, 'RERANK_MODEL', DEFAULT_RERANK_MODEL),
+    batch_size=getattr(settings, 'RERANK_BATCH_SIZE', 16),
+    cache_size=getattr(settings, 'RERANK_CACHE_SIZE', 10000),
+)
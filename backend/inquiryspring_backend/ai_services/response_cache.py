@@ -0,0 +1,258 @@
+"""
+语义响应缓存 - 针对同一组文档提出的相近问题直接复用之前的回答
+
+缓存键为（文档ID集合，归一化后的问题向量）。新问题与同一文档范围内已缓存问题的
+余弦相似度超过阈值时视为命中。条目有过期时间，超过容量时按LRU淘汰。
+
+每个条目记录生成时各文档的 updated_at，查找时与数据库中的当前值比较，
+文档在其他进程（如 run_ingestion_worker）中重新处理或被删除后，旧回答不会再被返回；
+同一进程内重新处理时 invalidate_document 会立即清除相关条目。
+模拟响应（provider 为 mock）和出错的结果不会被缓存。
+
+问题向量使用共享的嵌入模型计算，嵌入模型不可用时缓存自动停用。
+"""
+import copy
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from ..documents.models import Document
+
+logger = logging.getLogger(__name__)
+
+
+class CacheProbe(NamedTuple):
+    """一次未命中的查找结果，传给 store 以免重复计算问题向量和文档版本"""
+    vector: np.ndarray
+    versions: Tuple[Tuple[int, str], ...]
+
+
+def is_cacheable(response: Dict[str, Any]) -> bool:
+    """出错的结果和模拟响应不缓存，配置API密钥后可以直接得到真实回答"""
+    return not response.get('error') and response.get('provider') != 'mock'
+
+
+class SemanticResponseCache:
+    """按文档范围划分的语义响应缓存"""
+
+    def __init__(self, threshold: float = None, ttl: float = None, max_entries: int = None,
+                 embed_fn: Callable[[str], List[float]] = None):
+        self.threshold = threshold if threshold is not None else getattr(settings, 'RESPONSE_CACHE_THRESHOLD', 0.95)
+        self.ttl = ttl if ttl is not None else getattr(settings, 'RESPONSE_CACHE_TTL', 3600)
+        self.max_entries = max_entries or getattr(settings, 'RESPONSE_CACHE_MAX_ENTRIES', 1000)
+        self.enabled = getattr(settings, 'RESPONSE_CACHE_ENABLED', True)
+
+        self._embed_fn = embed_fn
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._scopes: Dict[Tuple[int, ...], set] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        # 按接口统计的命中情况
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """归一化问题文本：统一大小写和空白，去掉结尾的标点"""
+        query = re.sub(r'\s+', ' ', query.strip().lower())
+        return query.rstrip('?？!！.。 ')
+
+    @staticmethod
+    def make_scope(document_ids: Iterable[int]) -> Tuple[int, ...]:
+        return tuple(sorted({int(doc_id) for doc_id in document_ids}))
+
+    @staticmethod
+    def _document_versions(scope: Tuple[int, ...]) -> Tuple[Tuple[int, str], ...]:
+        """范围内各文档当前的 updated_at，已删除的文档不在结果中"""
+        if not scope:
+            return ()
+        rows = Document.objects.filter(id__in=scope).order_by('id').values_list('id', 'updated_at')
+        return tuple((doc_id, updated_at.isoformat() if updated_at else '') for doc_id, updated_at in rows)
+
+    def _embed(self, query: str) -> Optional[np.ndarray]:
+        if self._embed_fn is None:
+            try:
+                from .embedding_provider import embedding_provider
+                self._embed_fn = embedding_provider.embed_query
+            except ImportError as e:
+                logger.warning(f"嵌入模型不可用，语义响应缓存已停用: {e}")
+                self.enabled = False
+                return None
+
+        vector = np.asarray(self._embed_fn(self.normalize_query(query)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _record(self, endpoint: str, hit: bool, latency: float) -> None:
+        stats = self._stats.setdefault(endpoint, {
+            'requests': 0, 'hits': 0, 'misses': 0,
+            'saved_latency': 0.0, 'miss_latency': 0.0,
+        })
+        stats['requests'] += 1
+        if hit:
+            stats['hits'] += 1
+            stats['saved_latency'] += latency
+        else:
+            stats['misses'] += 1
+            stats['miss_latency'] += latency
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry:
+            scope_ids = self._scopes.get(entry['scope'])
+            if scope_ids is not None:
+                scope_ids.discard(entry_id)
+                if not scope_ids:
+                    del self._scopes[entry['scope']]
+
+    def _lookup(self, scope: Tuple[int, ...], vector: np.ndarray,
+                versions: Tuple[Tuple[int, str], ...]) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        candidates = []
+        for entry_id in list(self._scopes.get(scope, ())):
+            entry = self._entries[entry_id]
+            if now - entry['created_at'] > self.ttl or entry['versions'] != versions:
+                # 过期，或文档在生成回答后被重新处理、删除
+                self._remove(entry_id)
+            else:
+                candidates.append(entry_id)
+        if not candidates:
+            return None
+
+        matrix = np.stack([self._entries[entry_id]['vector'] for entry_id in candidates])
+        similarities = matrix @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        entry_id = candidates[best]
+        self._entries.move_to_end(entry_id)
+        return self._entries[entry_id]
+
+    def _store(self, scope: Tuple[int, ...], probe: CacheProbe,
+               response: Dict[str, Any], latency: float) -> None:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = {
+            'scope': scope,
+            'vector': probe.vector,
+            'versions': probe.versions,
+            'response': response,
+            'latency': latency,
+            'created_at': time.time(),
+        }
+        self._scopes.setdefault(scope, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def lookup(self, endpoint: str, query: str,
+               document_ids: Iterable[int]) -> Tuple[Optional[Dict[str, Any]], Optional[CacheProbe]]:
+        """查找缓存的回答
+
+        Returns:
+            (命中的回答字典或None, CacheProbe或None)；未命中时将第二个值原样传给 store，
+            缓存条目记录的是查找时的文档版本，生成回答期间文档被重新处理时该回答不会被复用
+        """
+        if not self.enabled:
+            return None, None
+        scope = self.make_scope(document_ids)
+        try:
+            vector = self._embed(query)
+            if vector is None:
+                return None, None
+            versions = self._document_versions(scope)
+        except Exception as e:
+            logger.warning(f"计算问题向量或文档版本失败，跳过响应缓存: {e}")
+            return None, None
+
+        probe = CacheProbe(vector, versions)
+        with self._lock:
+            entry = self._lookup(scope, vector, versions)
+            if entry:
+                self._record(endpoint, True, entry['latency'])
+                logger.info(f"语义缓存命中 ({endpoint}): {query[:50]}")
+                # 回答中包含 sources 等嵌套列表，返回深拷贝，调用方修改结果不会影响缓存条目
+                return copy.deepcopy(entry['response']), probe
+        return None, probe
+
+    def store(self, endpoint: str, probe: Optional[CacheProbe], document_ids: Iterable[int],
+              response: Dict[str, Any], latency: float) -> None:
+        """记录一次未命中，并缓存新生成的回答（出错的结果和模拟响应不会被缓存）"""
+        with self._lock:
+            self._record(endpoint, False, latency)
+            if probe is not None and is_cacheable(response):
+                self._store(self.make_scope(document_ids), probe, copy.deepcopy(response), latency)
+
+    def get_or_compute(self, endpoint: str, query: str, document_ids: Iterable[int],
+                       compute_fn: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+        """从缓存获取回答，未命中时调用 compute_fn 生成并缓存
+
+        Args:
+            endpoint: 接口名称，用于分别统计命中率
+            query: 用户问题
+            document_ids: 回答所依据的文档ID，决定缓存范围
+            compute_fn: 生成回答的函数，返回结果字典
+
+        Returns:
+            (回答字典, 是否命中缓存)
+        """
+        document_ids = list(document_ids)
+        cached, probe = self.lookup(endpoint, query, document_ids)
+        if cached is not None:
+            return cached, True
+
+        start_time = time.time()
+        response = compute_fn()
+        self.store(endpoint, probe, document_ids, response, time.time() - start_time)
+        return response, False
+
+    def invalidate_document(self, document_id: int) -> int:
+        """清除所有依据该文档的缓存条目，返回清除的数量"""
+        document_id = int(document_id)
+        with self._lock:
+            stale_scopes = [scope for scope in self._scopes if document_id in scope]
+            removed = 0
+            for scope in stale_scopes:
+                for entry_id in list(self._scopes.get(scope, ())):
+                    self._remove(entry_id)
+                    removed += 1
+        if removed:
+            logger.info(f"文档 {document_id} 已更新，清除 {removed} 条语义缓存")
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            endpoints = {}
+            for endpoint, stats in self._stats.items():
+                endpoints[endpoint] = {
+                    'requests': stats['requests'],
+                    'hits': stats['hits'],
+                    'misses': stats['misses'],
+                    'hit_rate': round(stats['hits'] / stats['requests'], 4) if stats['requests'] else 0.0,
+                    'saved_latency_seconds': round(stats['saved_latency'], 3),
+                    'avg_miss_latency_seconds': round(stats['miss_latency'] / stats['misses'], 3) if stats['misses'] else 0.0,
+                }
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'ttl': self.ttl,
+                'endpoints': endpoints,
+            }
+
+
+# 全局语义响应缓存实例
+response_cache = SemanticResponseCache()
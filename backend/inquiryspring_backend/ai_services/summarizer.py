@@ -0,0 +1,219 @@
+"""
+长文档分层摘要（map-reduce）
+
+整篇文档放进一个提示词会超出模型上下文，成本也随文档长度增长。长文档先逐块生成要点概括（map），
+分块之间并发执行且并发数有上限；再把要点概括合并为最终摘要（reduce），合并内容超出预算时先分组合并。
+
+分块的要点概括与最终摘要的长度要求无关，保存在 DocumentChunk.summary 上，
+以不同长度重新生成摘要时只需重新执行 reduce。
+"""
+import hashlib
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+
+from inquiryspring_backend.documents.models import DocumentChunk
+from .context_assembler import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 分块概括提示词的版本，修改 MAP_PROMPT 时递增，使已缓存的分块概括失效
+MAP_PROMPT_VERSION = '1'
+
+MAP_SYSTEM_PROMPT = "你是一个专业的文档分析专家。请忠实于原文进行概括，不添加原文中不存在的内容。"
+
+MAP_PROMPT = """以下是一篇长文档中的一个片段。请用简洁的要点概括该片段的主要内容，保留关键概念、重要数据和结论。
+
+片段内容:
+{text}
+
+要点概括:"""
+
+COMBINE_PROMPT = """以下是同一文档中连续几个部分的要点概括。请将它们合并为一份更精炼的要点概括，保留所有重要信息，去除重复内容。
+
+{text}
+
+合并后的要点概括:"""
+
+PARTIAL_SEPARATOR = "\n\n"
+
+
+def split_text(content: str, max_chars: int) -> List[str]:
+    """按段落把文本切分为不超过 max_chars 的片段，超长段落按字符截断"""
+    pieces = []
+    current = ""
+    for paragraph in re.split(r'\n\s*\n', content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        while len(paragraph) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class MapReduceSummarizer:
+    """分层摘要生成器
+
+    Args:
+        generate_fn: 调用模型的函数，参数为提示词，返回生成的文本，失败时抛出异常
+        max_workers: map 阶段的最大并发数
+        reduce_token_budget: 一次合并的要点概括总token数上限
+        token_counter: 计算token数的函数
+    """
+
+    def __init__(self, generate_fn: Callable[[str], str], max_workers: int = None,
+                 reduce_token_budget: int = None, token_counter: Callable[[str], int] = None):
+        self.generate_fn = generate_fn
+        self.max_workers = max(1, max_workers or getattr(settings, 'SUMMARY_MAP_CONCURRENCY', 4))
+        self.reduce_token_budget = reduce_token_budget or getattr(settings, 'SUMMARY_REDUCE_TOKEN_BUDGET', 4000)
+        self.token_counter = token_counter or estimate_tokens
+
+    def _generate(self, prompt: str) -> str:
+        try:
+            return self.generate_fn(prompt).strip()
+        finally:
+            # 工作线程中的数据库连接（如任务日志）用完即关闭
+            connection.close()
+
+    def _run_parallel(self, prompts: Dict[int, str],
+                      on_result: Callable[[int, str], None] = None) -> Dict[int, str]:
+        """并发执行提示词，返回 {索引: 生成文本}；任一失败时在其余完成后抛出第一个异常"""
+        results = {}
+        first_error = None
+        if not prompts:
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(prompts)),
+                                thread_name_prefix='summary-map') as executor:
+            futures = {executor.submit(self._generate, prompt): index for index, prompt in prompts.items()}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    logger.error(f"生成第 {index} 个片段的概括失败: {e}")
+                    first_error = first_error or e
+                    continue
+                if on_result:
+                    on_result(index, results[index])
+
+        if first_error:
+            raise first_error
+        return results
+
+    def map(self, texts: List[str], cached: List[Optional[str]] = None,
+            on_result: Callable[[int, str], None] = None) -> List[str]:
+        """为每个片段生成要点概括，cached 中已有的概括直接复用
+
+        Args:
+            texts: 片段文本
+            cached: 与 texts 对应的已缓存概括，None 表示需要生成
+            on_result: 每生成一个概括后在调用线程中回调 (索引, 概括)，用于持久化
+        """
+        summaries = list(cached) if cached else [None] * len(texts)
+        prompts = {
+            index: MAP_PROMPT.format(text=text)
+            for index, text in enumerate(texts)
+            if not summaries[index]
+        }
+        for index, summary in self._run_parallel(prompts, on_result).items():
+            summaries[index] = summary
+        return summaries
+
+    def _group(self, partials: List[str]) -> List[List[str]]:
+        """把相邻的概括分组，每组不超过预算；每组至少两项，保证每轮合并后数量减少"""
+        groups = []
+        current, current_tokens = [], 0
+        for partial in partials:
+            tokens = self.token_counter(partial)
+            if len(current) >= 2 and current_tokens + tokens > self.reduce_token_budget:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(partial)
+            current_tokens += tokens
+        if current:
+            if len(current) == 1 and groups:
+                groups[-1].extend(current)
+            else:
+                groups.append(current)
+        return groups
+
+    def reduce(self, partials: List[str], final_fn: Callable[[str], Any]) -> Any:
+        """合并要点概括，超出预算时逐层分组合并，最后交给 final_fn 生成最终摘要"""
+        partials = [partial for partial in partials if partial]
+        while len(partials) > 1 and self.token_counter(PARTIAL_SEPARATOR.join(partials)) > self.reduce_token_budget:
+            groups = self._group(partials)
+            logger.info(f"合并 {len(partials)} 个要点概括为 {len(groups)} 组")
+            combined = self._run_parallel({
+                index: COMBINE_PROMPT.format(text=PARTIAL_SEPARATOR.join(group))
+                for index, group in enumerate(groups)
+            })
+            partials = [combined[index] for index in range(len(groups))]
+        return final_fn(PARTIAL_SEPARATOR.join(partials))
+
+    def summarize_document(self, document, final_fn: Callable[[str], Any]) -> Tuple[Any, Dict[str, int]]:
+        """为文档生成分层摘要
+
+        有 DocumentChunk 时逐块生成并缓存要点概括；没有分块时按段落切分文档内容，概括不缓存。
+
+        Returns:
+            (final_fn 的返回值, 统计信息)
+        """
+        chunks = list(DocumentChunk.objects.filter(document=document).order_by('chunk_index'))
+        if chunks:
+            texts = [chunk.content for chunk in chunks]
+            cached = [
+                chunk.summary if chunk.summary and chunk.summary_version == MAP_PROMPT_VERSION else None
+                for chunk in chunks
+            ]
+        else:
+            texts = split_text(document.content or '', getattr(settings, 'SUMMARY_SPLIT_CHARS', 2000))
+            cached = None
+        reused = sum(1 for summary in cached if summary) if cached else 0
+
+        updated = []
+
+        def save_summary(index: int, summary: str) -> None:
+            if chunks:
+                chunks[index].summary = summary
+                chunks[index].summary_version = MAP_PROMPT_VERSION
+                updated.append(chunks[index])
+
+        try:
+            partials = self.map(texts, cached, on_result=save_summary)
+        finally:
+            # 失败时也保存已生成的概括，重试时不再重复生成
+            if updated:
+                DocumentChunk.objects.bulk_update(updated, ['summary', 'summary_version'])
+
+        stats = {'chunks': len(texts), 'reused': reused, 'generated': len(texts) - reused}
+        logger.info(f"文档 {document.id} 分块概括完成: {stats}")
+        return self.reduce(partials, final_fn), stats
+
+
+def summary_template_version(*templates: str) -> str:
+    """根据最终摘要使用的模板和分层摘要的提示词计算版本号，任一提示词变化时版本随之变化"""
+    digest = hashlib.sha256()
+    for template in (MAP_PROMPT_VERSION, MAP_SYSTEM_PROMPT, MAP_PROMPT, COMBINE_PROMPT) + templates:
+        digest.update(template.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def needs_map_reduce(content: str) -> bool:
+    """文档是否超出单次摘要的token预算"""
+    return estimate_tokens(content or '') > getattr(settings, 'SUMMARY_DIRECT_TOKEN_BUDGET', 6000)
@@ -0,0 +1,178 @@
+"""
+AI任务日志缓冲写入 - 把 AITaskLog 的写入移出请求路径
+
+每次LLM调用原本要同步写两次数据库（创建时一次、完成时一次），在SQLite上所有请求都会
+排队等待写锁。现在日志在调用完成时才放入内存队列，由后台线程按批次用 bulk_create /
+bulk_update 写入。队列有容量上限，写满时按配置丢弃或阻塞等待；进程退出时会写完队列中的日志。
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import AITaskLog
+
+logger = logging.getLogger(__name__)
+
+# 批量更新时写入的字段
+UPDATE_FIELDS = [
+    'output_data', 'status', 'error_message', 'tokens_used', 'processing_time', 'completed_at',
+]
+
+
+class TaskLogWriter:
+    """后台批量写入任务日志
+
+    Args:
+        max_queue_size: 队列中最多缓存的日志条数
+        batch_size: 每次写入的最大条数
+        flush_interval: 最多隔多久写入一次（秒）
+        overflow: 队列写满时的策略，drop 直接丢弃，block 等待 block_timeout 秒后仍满则丢弃
+        block_timeout: block 策略下的最长等待时间（秒）
+    """
+
+    def __init__(self, max_queue_size: int = 1000, batch_size: int = 100, flush_interval: float = 1.0,
+                 overflow: str = 'drop', block_timeout: float = 1.0):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self._queue: "queue.Queue[AITaskLog]" = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+
+        # 统计信息
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def submit(self, task_log: AITaskLog) -> bool:
+        """放入一条待写入的日志，返回是否成功入队"""
+        if self._closed:
+            # 进程退出阶段直接同步写入
+            self._write([task_log])
+            return True
+
+        self._ensure_worker()
+        try:
+            if self.overflow == 'block':
+                self._queue.put(task_log, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(task_log)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            # 避免在持续满载时刷屏
+            if dropped == 1 or dropped % 100 == 0:
+                logger.warning(f"任务日志队列已满，已丢弃 {dropped} 条日志")
+            return False
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='task-log-writer', daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            if batch:
+                self._write(batch)
+            elif self._closed:
+                return
+
+    def _collect_batch(self) -> List[AITaskLog]:
+        """等待第一条日志，然后在 flush_interval 内凑满一个批次"""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+        return batch
+
+    def _write(self, batch: List[AITaskLog]) -> None:
+        new_logs = [task_log for task_log in batch if task_log.pk is None]
+        saved_logs = [task_log for task_log in batch if task_log.pk is not None]
+        try:
+            if new_logs:
+                AITaskLog.objects.bulk_create(new_logs, batch_size=self.batch_size)
+            if saved_logs:
+                AITaskLog.objects.bulk_update(saved_logs, UPDATE_FIELDS, batch_size=self.batch_size)
+            with self._lock:
+                self.written += len(batch)
+                self.flushes += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            logger.exception(f"写入 {len(batch)} 条任务日志失败: {e}")
+        finally:
+            close_old_connections()
+
+    def flush(self) -> None:
+        """在当前线程中写入队列中剩余的日志"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """停止后台线程并写完队列中的日志，进程退出时自动调用"""
+        self._closed = True
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            worker.join(timeout)
+        self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取写入统计信息"""
+        with self._lock:
+            return {
+                'pending': self._queue.qsize(),
+                'max_queue_size': self._queue.maxsize,
+                'overflow': self.overflow,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'avg_batch_size': round(self.written / self.flushes, 2) if self.flushes else 0.0,
+            }
+
+
+# 全局任务日志写入器实例
+task_log_writer = TaskLogWriter(
+    max_queue_size=getattr(settings, 'AI_TASK_LOG_QUEUE_SIZE', 1000),
+    batch_size=getattr(settings, 'AI_TASK_LOG_BATCH_SIZE', 100),
+    flush_interval=getattr(settings, 'AI_TASK_LOG_FLUSH_INTERVAL', 1.0),
+    overflow=getattr(settings, 'AI_TASK_LOG_OVERFLOW', 'drop'),
+    block_timeout=getattr(settings, 'AI_TASK_LOG_BLOCK_TIMEOUT', 1.0),
+)
+atexit.register(task_log_writer.close)
@@ -0,0 +1,631 @@
+import asyncio
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+
+import numpy as np
+
+from django.test import SimpleTestCase, TestCase
+
+from ..documents.models import Document, DocumentChunk
+from .apps import _is_server_process
+from .llm_cache import MemoryLLMCache
+from .numpy_vector_store import CURRENT_FILENAME, NumpyVectorStore, QuantizedVectorStore, normalize, quantize, top_k
+from .response_cache import SemanticResponseCache
+
+# 本地模型注册表依赖 torch 和 transformers
+try:
+    from .model_registry import LoadedModel, LocalModelRegistry
+    MODEL_REGISTRY_AVAILABLE = True
+except ImportError:
+    MODEL_REGISTRY_AVAILABLE = False
+
+# LLM客户端依赖 google-generativeai、torch，并需要启用 ai_services 应用
+try:
+    from .llm_client import BaseLLMClient, LocalModelClient
+    LLM_CLIENT_AVAILABLE = True
+except (ImportError, RuntimeError):
+    LLM_CLIENT_AVAILABLE = False
+
+# RAG引擎另外依赖 langchain
+try:
+    from .rag_engine import RAGEngine
+    RAG_ENGINE_AVAILABLE = True
+except (ImportError, RuntimeError):
+    RAG_ENGINE_AVAILABLE = False
+
+
+@skipUnless(MODEL_REGISTRY_AVAILABLE, '需要安装 torch 和 transformers')
+class LocalModelRegistryTests(SimpleTestCase):
+
+    def make_registry(self, **kwargs):
+        registry = LocalModelRegistry(**kwargs)
+
+        def fake_load(key):
+            loaded = LoadedModel(key, object(), object(), None, 0.0, 1024)
+            with registry._lock:
+                registry._models[key] = loaded
+            return loaded
+
+        registry._load = fake_load
+        return registry
+
+    def test_acquire_pins_model_before_it_can_be_evicted(self):
+        registry = self.make_registry()
+        with registry.acquire('model', 'cpu') as loaded:
+            self.assertEqual(loaded.in_use, 1)
+            self.assertEqual(registry.evict_idle(0), 0)
+            self.assertIsNotNone(loaded.model)
+        self.assertEqual(loaded.in_use, 0)
+        self.assertEqual(registry.evict_idle(0), 1)
+
+    def test_is_available_does_not_load_or_reorder(self):
+        registry = self.make_registry()
+        registry._load = mock.Mock(side_effect=registry._load)
+        self.assertTrue(registry.is_available('model', 'cpu'))
+        registry._load.assert_not_called()
+
+        registry.get('first', 'cpu')
+        registry.get('second', 'cpu')
+        self.assertTrue(registry.is_available('first', 'cpu'))
+        self.assertEqual(list(registry._models), [('first', 'cpu'), ('second', 'cpu')])
+
+        registry._failures[('broken', 'cpu')] = time.time()
+        self.assertFalse(registry.is_available('broken', 'cpu'))
+
+    def test_eviction_under_load_never_unloads_a_model_in_use(self):
+        registry = self.make_registry()
+        stop = threading.Event()
+        errors = []
+
+        def use_model():
+            while not stop.is_set():
+                with registry.acquire('model', 'cpu') as loaded:
+                    if loaded is None or loaded.model is None:
+                        errors.append(loaded)
+
+        def evict():
+            while not stop.is_set():
+                registry.evict_idle(0)
+
+        # gc.collect 会拖慢卸载，测试中不需要
+        with mock.patch('gc.collect'):
+            threads = [threading.Thread(target=use_model) for _ in range(4)] + [threading.Thread(target=evict)]
+            for thread in threads:
+                thread.start()
+            time.sleep(1)
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(any(event['event'] == 'unload' for event in registry.events))
+
+
+class MemoryLLMCacheTests(SimpleTestCase):
+
+    def test_entries_are_isolated_from_callers(self):
+        cache = MemoryLLMCache()
+        result = {'text': '回答', 'metadata': {'tokens': 10}}
+        cache.set('key', result)
+        result['retrieved_chunks'] = ['chunk']
+        result['metadata']['tokens'] = 99
+
+        hit = cache.get('key')
+        self.assertEqual(hit, {'text': '回答', 'metadata': {'tokens': 10}})
+        hit['summary_status'] = 'fresh'
+        hit['metadata']['tokens'] = 0
+        self.assertEqual(cache.get('key'), {'text': '回答', 'metadata': {'tokens': 10}})
+
+
+@skipUnless(LLM_CLIENT_AVAILABLE, '需要安装 google-generativeai、torch 并启用 ai_services 应用')
+class LLMClientCacheTests(SimpleTestCase):
+
+    def test_caller_mutations_do_not_leak_into_cache_hits(self):
+        class Client(BaseLLMClient):
+            calls = 0
+
+            def _generate_text(self, prompt, system_prompt, max_tokens, temperature, task_type):
+                self.calls += 1
+                return {'text': '回答', 'metadata': {'tokens': 10}}
+
+        client = Client(None)
+        with mock.patch('inquiryspring_backend.ai_services.llm_client.get_llm_cache',
+                        return_value=MemoryLLMCache()):
+            first = client.generate_text('问题', temperature=0)
+            first['retrieved_chunks'] = ['chunk']
+            first['metadata']['tokens'] = 99
+
+            second = client.generate_text('问题', temperature=0)
+
+        self.assertEqual(client.calls, 1)
+        self.assertTrue(second['cached'])
+        self.assertNotIn('retrieved_chunks', second)
+        self.assertEqual(second['metadata'], {'tokens': 10})
+
+    def test_async_generation_shares_the_result_cache(self):
+        class Client(BaseLLMClient):
+            calls = 0
+
+            def _generate_text(self, prompt, system_prompt, max_tokens, temperature, task_type):
+                self.calls += 1
+                return {'text': '回答'}
+
+        client = Client(None)
+        with mock.patch('inquiryspring_backend.ai_services.llm_client.get_llm_cache',
+                        return_value=MemoryLLMCache()):
+            first = asyncio.run(client.agenerate_text('问题', temperature=0))
+            second = client.generate_text('问题', temperature=0)
+            mocked = Client(None)
+            mocked._generate_text = mock.Mock(return_value={'text': '模拟', 'provider': 'mock'})
+            mocked.generate_text('模拟问题', temperature=0)
+            mocked.generate_text('模拟问题', temperature=0)
+
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(first, {'text': '回答'})
+        self.assertTrue(second['cached'])
+        self.assertEqual(mocked._generate_text.call_count, 2)
+
+
+class FakeStreamer:
+    """按 TextIteratorStreamer 的接口收发文本片段"""
+
+    def __init__(self, tokenizer, **kwargs):
+        self.queue = queue.Queue()
+
+    def put(self, text):
+        self.queue.put(text)
+
+    def end(self):
+        self.queue.put(None)
+
+    def __iter__(self):
+        while (text := self.queue.get()) is not None:
+            yield text
+
+
+class FakeInputs(dict):
+    input_ids = mock.Mock(shape=(1, 3))
+
+    def to(self, device):
+        return self
+
+
+@skipUnless(LLM_CLIENT_AVAILABLE, '需要安装 google-generativeai、torch 并启用 ai_services 应用')
+class LLMClientStreamTests(SimpleTestCase):
+
+    def make_client(self):
+        client = LocalModelClient(None)
+        client._create_task_log = mock.Mock()
+        client._update_task_log = mock.Mock()
+        return client
+
+    def test_disconnect_stops_local_generation_before_returning(self):
+        state = {'tokens': 0, 'finished': False}
+
+        def generate(streamer, stopping_criteria, **kwargs):
+            while not any(criteria(None, None) for criteria in stopping_criteria):
+                state['tokens'] += 1
+                streamer.put(f'片段{state["tokens"]}')
+                time.sleep(0.001)
+            state['finished'] = True
+            streamer.end()
+
+        loaded = mock.Mock()
+        loaded.tokenizer.return_value = FakeInputs()
+        loaded.model.generate = generate
+        client = self.make_client()
+
+        with mock.patch('inquiryspring_backend.ai_services.llm_client.TextIteratorStreamer', FakeStreamer), \
+                mock.patch('inquiryspring_backend.ai_services.llm_client.StoppingCriteriaList', list):
+            stream = client._stream_with_model(loaded, '问题', None, 16, 0.0, 'chat')
+            self.assertEqual(next(stream), '片段1')
+            stream.close()
+
+        # 关闭生成器时后台生成已经结束，之后不会再使用模型
+        self.assertTrue(state['finished'])
+        tokens = state['tokens']
+        time.sleep(0.05)
+        self.assertEqual(state['tokens'], tokens)
+        self.assertEqual(client._update_task_log.call_args.args[1:3], ({}, 'failed'))
+
+    def test_async_stream_closes_sync_stream_when_consumer_stops(self):
+        closed = threading.Event()
+
+        class Client(BaseLLMClient):
+            def generate_text_stream(self, *args, **kwargs):
+                try:
+                    for i in range(100):
+                        yield str(i)
+                finally:
+                    closed.set()
+
+        async def consume():
+            stream = Client(None).agenerate_text_stream('问题')
+            pieces = [await anext(stream), await anext(stream)]
+            await stream.aclose()
+            return pieces
+
+        self.assertEqual(asyncio.run(consume()), ['0', '1'])
+        self.assertTrue(closed.is_set())
+
+
+class SemanticResponseCacheTests(TestCase):
+
+    def setUp(self):
+        self.document = Document.objects.create(title='notes.txt', file_type='text', is_processed=True)
+        self.cache = SemanticResponseCache(threshold=0.9, embed_fn=lambda query: [1.0, 0.0])
+
+    def test_reprocessed_document_misses_without_invalidation(self):
+        answer = {'text': '回答', 'provider': 'gemini'}
+        self.cache.get_or_compute('chat', '问题', [self.document.id], lambda: answer)
+        self.assertEqual(self.cache.lookup('chat', '问题', [self.document.id])[0], answer)
+
+        # 另一个进程重新处理文档时不会调用本进程的 invalidate_document
+        self.document.content = '新内容'
+        self.document.save()
+
+        self.assertIsNone(self.cache.lookup('chat', '问题', [self.document.id])[0])
+        self.assertEqual(self.cache.get_stats()['entries'], 0)
+
+    def test_deleted_document_misses(self):
+        document_id = self.document.id
+        self.cache.get_or_compute('chat', '问题', [document_id], lambda: {'text': '回答'})
+        self.document.delete()
+
+        self.assertIsNone(self.cache.lookup('chat', '问题', [document_id])[0])
+
+    def test_mock_and_error_replies_are_not_cached(self):
+        for response in ({'text': '模拟回答', 'provider': 'mock'}, {'text': '', 'error': '超时'}):
+            reply, cache_hit = self.cache.get_or_compute('chat', '问题', [self.document.id], lambda: response)
+            self.assertFalse(cache_hit)
+        self.assertEqual(self.cache.get_stats()['entries'], 0)
+
+
+    def test_callers_cannot_modify_cached_reply(self):
+        answer = {'text': '回答', 'provider': 'gemini', 'sources': [{'chunk_id': 1}]}
+        self.cache.get_or_compute('chat', '问题', [self.document.id], lambda: answer)
+        answer['sources'].append({'chunk_id': 2})
+
+        reply = self.cache.lookup('chat', '问题', [self.document.id])[0]
+        reply['sources'][0]['chunk_id'] = 3
+
+        self.assertEqual(self.cache.lookup('chat', '问题', [self.document.id])[0]['sources'], [{'chunk_id': 1}])
+
+class EmbeddingWarmupTests(SimpleTestCase):
+
+    def test_management_commands_are_not_server_processes(self):
+        for command in ('migrate', 'shell', 'run_ingestion_worker', 'test'):
+            self.assertFalse(_is_server_process(['manage.py', command]), command)
+
+    def test_runserver_warms_up_only_in_reloader_child(self):
+        with mock.patch.dict('os.environ', {'RUN_MAIN': ''}):
+            self.assertFalse(_is_server_process(['manage.py', 'runserver']))
+            self.assertTrue(_is_server_process(['manage.py', 'runserver', '--noreload']))
+        with mock.patch.dict('os.environ', {'RUN_MAIN': 'true'}):
+            self.assertTrue(_is_server_process(['/srv/app/manage.py', 'runserver', '0.0.0.0:8000']))
+
+    def test_wsgi_and_asgi_servers_are_server_processes(self):
+        self.assertTrue(_is_server_process(['/usr/bin/gunicorn', 'inquiryspring_backend.wsgi']))
+        self.assertTrue(_is_server_process(['/usr/bin/uvicorn', 'inquiryspring_backend.asgi:application']))
+
+
+class VectorMathTests(SimpleTestCase):
+
+    def test_quantize_round_trip(self):
+        vectors = normalize(np.random.default_rng(0).normal(size=(100, 32)))
+        vectors[0] = 0
+
+        codes, scales = quantize(vectors)
+
+        self.assertEqual(codes.dtype, np.int8)
+        self.assertEqual(scales.dtype, np.float32)
+        # 每个分量的误差不超过半个量化步长
+        error = np.abs(codes * scales[:, None] - vectors)
+        self.assertTrue(np.all(error <= scales[:, None] / 2 + 1e-6))
+        self.assertTrue(np.all(codes[0] == 0))
+
+    def test_top_k(self):
+        scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3], dtype=np.float32)
+
+        self.assertEqual(set(top_k(scores, 2).tolist()), {1, 3})
+        self.assertEqual(set(top_k(scores, 10).tolist()), {0, 1, 2, 3, 4})
+
+
+class NumpyVectorStoreTests(SimpleTestCase):
+    store_class = NumpyVectorStore
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root_dir, ignore_errors=True)
+        self.vectors = normalize(np.random.default_rng(0).normal(size=(2000, 64)))
+
+    def make_store(self, **kwargs):
+        return self.store_class(self.root_dir, **kwargs)
+
+    def write(self, store, document_id, ids, vectors):
+        store.upsert(document_id, [str(vector_id) for vector_id in ids], vectors, [], [])
+        store.persist(document_id)
+
+    def versions(self, document_id):
+        document_dir = os.path.join(self.root_dir, str(document_id))
+        return sorted(name for name in os.listdir(document_dir) if name.startswith('v'))
+
+    def recall(self, store, k=10):
+        rng = np.random.default_rng(1)
+        queries = normalize(self.vectors[:50] + rng.normal(0, 0.3, (50, self.vectors.shape[1])))
+        recalls = []
+        for query in queries:
+            expected = set(np.argsort(-(self.vectors @ query))[:k].tolist())
+            hits = store.query(query.tolist(), k=k, document_ids=[1])
+            recalls.append(len(expected.intersection(int(hit['chunk_id']) for hit in hits)) / k)
+        return float(np.mean(recalls))
+
+    def test_round_trip_through_new_instance(self):
+        store = self.make_store()
+        store.upsert(1, ['10', '11'], self.vectors[:2], [], [])
+
+        # 查询只读取已持久化的版本
+        self.assertEqual(store.count(1), 2)
+        self.assertEqual(store.query(self.vectors[0].tolist(), k=1), [])
+
+        store.persist(1)
+        reopened = self.make_store()
+
+        self.assertEqual(reopened.count(1), 2)
+        hit = reopened.query(self.vectors[1].tolist(), k=1)[0]
+        self.assertEqual((hit['chunk_id'], hit['document_id']), ('11', '1'))
+        self.assertAlmostEqual(hit['score'], 1.0, places=2)
+
+    def test_persist_swaps_to_new_version(self):
+        store = self.make_store()
+        self.write(store, 1, [10, 11], self.vectors[:2])
+        reader = self.make_store()
+        self.assertEqual(reader.count(1), 2)
+        old_version = self.versions(1)
+
+        store.upsert(1, ['12'], self.vectors[2:3], [], [])
+        store.delete(1, ['10'])
+        store.persist(1)
+
+        new_version = self.versions(1)
+        self.assertEqual(len(new_version), 1)
+        self.assertNotEqual(new_version, old_version)
+        with open(os.path.join(self.root_dir, '1', CURRENT_FILENAME), encoding='utf-8') as f:
+            self.assertEqual(f.read().strip(), new_version[0])
+        # 其他实例（进程）检测到 CURRENT 变化后打开新版本
+        self.assertEqual(reader.count(1), 2)
+        self.assertEqual(reader.query(self.vectors[2].tolist(), k=1)[0]['chunk_id'], '12')
+
+    def test_discard_drops_pending_changes(self):
+        store = self.make_store()
+        self.write(store, 1, [10, 11], self.vectors[:2])
+
+        store.upsert(1, ['12'], self.vectors[2:3], [], [])
+        store.discard(1)
+        store.persist()
+
+        self.assertEqual(self.make_store().count(1), 2)
+
+    def test_delete_document_removes_files(self):
+        store = self.make_store()
+        self.write(store, 1, [10, 11], self.vectors[:2])
+
+        store.delete_document(1)
+        store.persist(1)
+
+        self.assertFalse(os.path.exists(os.path.join(self.root_dir, '1')))
+        self.assertEqual(store.count(1), 0)
+
+    def test_recall(self):
+        store = self.make_store()
+        self.write(store, 1, range(len(self.vectors)), self.vectors)
+
+        self.assertEqual(self.recall(store), 1.0)
+
+
+class QuantizedVectorStoreTests(NumpyVectorStoreTests):
+    store_class = QuantizedVectorStore
+
+    def test_recall(self):
+        store = self.make_store()
+        self.write(store, 1, range(len(self.vectors)), self.vectors)
+
+        self.assertGreaterEqual(self.recall(store), 0.99)
+
+    def test_recall_without_rescore(self):
+        store = self.make_store(rescore=False)
+        self.write(store, 1, range(len(self.vectors)), self.vectors)
+
+        self.assertGreaterEqual(self.recall(store), 0.95)
+
+    def test_rescore_vectors_are_stored_as_float16(self):
+        store = self.make_store()
+        self.write(store, 1, range(len(self.vectors)), self.vectors)
+
+        segment = store._segment(1)
+        self.assertEqual(segment.vectors.dtype, np.float16)
+        self.assertEqual(segment.codes.dtype, np.int8)
+        # int8 编码加 float16 向量小于 float32 向量
+        self.assertLess(segment.codes.nbytes + segment.vectors.nbytes, self.vectors.nbytes)
+        self.assertEqual(store.memory_usage([1])['float_bytes'], self.vectors.nbytes // 2)
+
+    def test_without_rescore_only_codes_are_stored(self):
+        store = self.make_store(rescore=False)
+        self.write(store, 1, [10, 11], self.vectors[:2])
+
+        segment = store._segment(1)
+        self.assertIsNone(segment.vectors)
+        # 重新写入时从量化向量恢复
+        store.upsert(1, ['12'], self.vectors[2:3], [], [])
+        store.persist(1)
+        self.assertEqual(store.count(1), 3)
+        self.assertEqual(store.query(self.vectors[0].tolist(), k=1)[0]['chunk_id'], '10')
+
+
+@skipUnless(RAG_ENGINE_AVAILABLE, '需要安装 langchain、google-generativeai、torch 并启用 ai_services 应用')
+class HybridSearchTests(SimpleTestCase):
+
+    def search(self, **config):
+        vector_store = mock.Mock()
+        vector_store.query.return_value = [
+            {'chunk_id': '1', 'text': '', 'score': 0.9},
+            {'chunk_id': '2', 'text': '', 'score': 0.7},
+            {'chunk_id': '3', 'text': '', 'score': 0.3},
+        ]
+        # 分块3的向量得分低于阈值，分块4只被关键词命中
+        keyword_hits = [(2, 5.0), (3, 4.0), (4, 3.0)]
+        with mock.patch('inquiryspring_backend.ai_services.rag_engine.embedding_provider'), \
+                mock.patch('inquiryspring_backend.ai_services.rag_engine.keyword_index') as keyword_index:
+            keyword_index.search.return_value = keyword_hits
+            engine = RAGEngine(llm_client=mock.Mock(), config={'retrieval_threshold': 0.6, **config})
+            return {hit['chunk_id']: hit for hit in engine._search('问题', [1], 10, vector_store)}
+
+    def test_fused_hits_keep_cosine_score(self):
+        hits = self.search()
+
+        self.assertEqual(hits['1']['score'], 0.9)
+        self.assertEqual(hits['2']['score'], 0.7)
+        self.assertEqual(hits['2']['keyword_score'], 5.0)
+        self.assertGreater(hits['2']['fusion_score'], hits['1']['fusion_score'])
+        # 低于阈值的向量得分不保留，分块3只作为关键词结果参与融合
+        self.assertIsNone(hits['3']['score'])
+        self.assertIsNone(hits['4']['score'])
+
+    def test_keyword_only_hits_can_be_dropped(self):
+        hits = self.search(keyword_only_hits=False)
+
+        self.assertEqual(set(hits), {'1', '2'})
+        self.assertTrue(all(hit['score'] >= 0.6 for hit in hits.values()))
+
+
+@skipUnless(RAG_ENGINE_AVAILABLE, '需要安装 langchain、google-generativeai、torch 并启用 ai_services 应用')
+class SummaryContentTests(SimpleTestCase):
+
+    def test_summary_uses_extracted_content_not_raw_file(self):
+        llm_client = mock.Mock()
+        llm_client.generate_text.return_value = {'text': '摘要'}
+        document = mock.Mock(content='提取后的文本')
+        document.file.read.return_value = b'%PDF-1.4 raw bytes'
+
+        with mock.patch('inquiryspring_backend.ai_services.rag_engine.embedding_provider'), \
+                mock.patch('inquiryspring_backend.ai_services.rag_engine.PromptManager') as prompt_manager:
+            prompt_manager.render_by_type.side_effect = lambda template_type, variables: variables['content']
+            engine = RAGEngine(llm_client=llm_client)
+            result = engine._generate_summary(document, 'medium', False)
+
+        self.assertEqual(result['text'], '摘要')
+        self.assertEqual(llm_client.generate_text.call_args.kwargs['prompt'], '提取后的文本')
+        document.file.read.assert_not_called()
+
+
+@skipUnless(RAG_ENGINE_AVAILABLE, '需要安装 langchain、google-generativeai、torch 并启用 ai_services 应用')
+class IncrementalEmbeddingTests(TestCase):
+
+    def setUp(self):
+        self.vector_store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.vector_store_dir, ignore_errors=True)
+        self.document = Document.objects.create(title='notes.txt', file_type='text', content='alpha\nbeta\ngamma')
+        self.embedded_texts = []
+
+    def fake_embed(self, texts, batch_size=None):
+        self.embedded_texts.extend(texts)
+        return [[float(ord(text[0])), float(len(text)), 1.0] for text in texts], 0
+
+    def process(self, content, embed=None, batch_size=32):
+        Document.objects.filter(id=self.document.id).update(content=content)
+        config = {
+            'vector_store_backend': 'numpy',
+            'vector_store_dir': self.vector_store_dir,
+            'embedding_batch_size': batch_size,
+        }
+        # 按行分块，便于控制哪些分块内容发生变化
+        with mock.patch('inquiryspring_backend.ai_services.rag_engine.embedding_provider') as provider, \
+                mock.patch.object(RAGEngine, '_split_document', lambda engine, text: text.split('\n')):
+            provider.embed_documents_cached.side_effect = embed or self.fake_embed
+            engine = RAGEngine(document_id=self.document.id, llm_client=mock.Mock(), config=config)
+            result = engine.process_and_embed_document(force_reprocess=True)
+        return engine, result
+
+    def chunks(self):
+        return {chunk.content: chunk.id for chunk in DocumentChunk.objects.filter(document=self.document)}
+
+    def persisted_ids(self, store):
+        return {int(vector_id) for vector_id in store._segment(self.document.id).ids}
+
+    def test_reprocessing_reuses_unchanged_chunks(self):
+        self.process('alpha\nbeta\ngamma')
+        before = self.chunks()
+        self.embedded_texts = []
+
+        engine, result = self.process('alpha\ndelta\ngamma')
+
+        self.assertTrue(result)
+        self.assertEqual(self.embedded_texts, ['delta'])
+        after = self.chunks()
+        self.assertEqual(set(after), {'alpha', 'delta', 'gamma'})
+        self.assertEqual(after['alpha'], before['alpha'])
+        self.assertEqual(after['gamma'], before['gamma'])
+        self.assertEqual(self.persisted_ids(engine.vector_store), set(after.values()))
+        self.assertEqual(engine.last_embedding_stats['total_chunks'], 3)
+        self.assertEqual(engine.last_embedding_stats['reused_chunks'], 2)
+        self.assertEqual(engine.last_embedding_stats['embedded_chunks'], 1)
+        self.assertEqual(engine.last_embedding_stats['deleted_chunks'], 1)
+        self.assertEqual(
+            list(DocumentChunk.objects.filter(document=self.document).order_by('chunk_index')
+                 .values_list('content', flat=True)),
+            ['alpha', 'delta', 'gamma']
+        )
+
+    def test_embedding_failure_keeps_existing_chunks_and_vectors(self):
+        engine, _ = self.process('alpha\nbeta\ngamma')
+        before = self.chunks()
+
+        def failing_embed(texts, batch_size=None):
+            raise RuntimeError('embedding failed')
+
+        _, result = self.process('alpha\ndelta\ngamma', embed=failing_embed)
+
+        self.assertFalse(result)
+        self.assertEqual(self.chunks(), before)
+        self.assertEqual(self.persisted_ids(engine.vector_store), set(before.values()))
+
+    def test_write_failure_rolls_back_chunks_and_discards_pending_vectors(self):
+        engine, _ = self.process('alpha\nbeta\ngamma')
+        store = engine.vector_store
+        before = self.chunks()
+        upsert = store.upsert
+        calls = []
+
+        def failing_upsert(*args, **kwargs):
+            # 第一批写入内存后，第二批写入失败
+            calls.append(kwargs['ids'])
+            if len(calls) > 1:
+                raise RuntimeError('write failed')
+            upsert(*args, **kwargs)
+
+        with mock.patch.object(store, 'upsert', side_effect=failing_upsert):
+            _, result = self.process('alpha\ndelta\nepsilon', batch_size=1)
+
+        self.assertFalse(result)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.chunks(), before)
+        self.assertNotIn(self.document.id, store._pending)
+        store.persist()
+        self.assertEqual(self.persisted_ids(store), set(before.values()))
+
+    def test_deleting_document_index_removes_persisted_vectors(self):
+        from ..utils import delete_document_index
+
+        engine, _ = self.process('alpha\nbeta\ngamma')
+        self.assertEqual(engine.vector_store.count(self.document.id), 3)
+
+        with mock.patch.object(RAGEngine, 'DEFAULT_CONFIG', engine.config):
+            delete_document_index(self.document.id)
+
+        self.assertEqual(engine.vector_store.count(self.document.id), 0)
+        self.assertIsNone(engine.vector_store._segment(self.document.id))
@@ -0,0 +1,214 @@
+"""
+向量存储模块 - 所有文档共享同一个Chroma集合，通过 document_id 元数据过滤
+
+相比每个文档一个持久化目录，共享集合只需在进程内打开一次，
+并且可以在一次查询中跨多个文档检索。文档数量很大时可以按 document_id 分片到多个集合。
+配置 vector_store_backend 为 numpy 或 int8 时改用 numpy_vector_store 中基于 mmap 的存储。
+"""
+import logging
+import os
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import chromadb
+from chromadb.config import Settings as ChromaSettings
+
+from .numpy_vector_store import NumpyVectorStore, QuantizedVectorStore
+
+logger = logging.getLogger(__name__)
+
+# 共享向量库所在的子目录和集合名
+SHARED_STORE_DIRNAME = "shared"
+NUMPY_STORE_DIRNAME = "numpy"
+QUANTIZED_STORE_DIRNAME = "int8"
+DEFAULT_COLLECTION_NAME = "document_chunks"
+
+# 旧版按文档存储时 LangChain 使用的默认集合名
+LEGACY_COLLECTION_NAME = "langchain"
+
+
+class ChromaVectorStore:
+    """共享的Chroma向量存储"""
+
+    def __init__(self, persist_directory: str, collection_name: str = DEFAULT_COLLECTION_NAME,
+                 shard_count: int = 1):
+        self.persist_directory = persist_directory
+        self.collection_name = collection_name
+        self.shard_count = max(1, shard_count)
+
+        self._client = None
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        if self._client is None:
+            os.makedirs(self.persist_directory, exist_ok=True)
+            self._client = chromadb.PersistentClient(
+                path=self.persist_directory,
+                settings=ChromaSettings(anonymized_telemetry=False)
+            )
+        return self._client
+
+    def _shard_name(self, document_id: int) -> str:
+        if self.shard_count == 1:
+            return self.collection_name
+        return f"{self.collection_name}_{int(document_id) % self.shard_count}"
+
+    def _get_collection(self, name: str):
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                # 使用余弦距离，检索得分 = 1 - 距离
+                collection = self._get_client().get_or_create_collection(
+                    name=name,
+                    metadata={"hnsw:space": "cosine"}
+                )
+                self._collections[name] = collection
+            return collection
+
+    @staticmethod
+    def _document_filter(document_ids: List[int]) -> Dict[str, Any]:
+        document_ids = [str(doc_id) for doc_id in document_ids]
+        if len(document_ids) == 1:
+            return {"document_id": document_ids[0]}
+        return {"document_id": {"$in": document_ids}}
+
+    def upsert(self, document_id: int, ids: List[str], embeddings: List[List[float]],
+               texts: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """写入或更新一个文档的若干向量"""
+        if not ids:
+            return
+        for metadata in metadatas:
+            metadata["document_id"] = str(document_id)
+        self._get_collection(self._shard_name(document_id)).upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=metadatas
+        )
+
+    def delete(self, document_id: int, ids: List[str]) -> None:
+        """删除一个文档的指定向量"""
+        if not ids:
+            return
+        self._get_collection(self._shard_name(document_id)).delete(ids=ids)
+
+    def delete_document(self, document_id: int) -> None:
+        """删除一个文档的全部向量"""
+        self._get_collection(self._shard_name(document_id)).delete(
+            where=self._document_filter([document_id])
+        )
+
+    def discard(self, document_id: int) -> None:
+        """Chroma 立即写入，没有待持久化的修改，保留此方法以与 numpy 存储保持一致"""
+        pass
+
+    def export(self, document_id: int) -> Tuple[List[str], List[List[float]]]:
+        """导出一个文档的全部向量，返回 (向量ID列表, 向量列表)"""
+        result = self._get_collection(self._shard_name(document_id)).get(
+            where=self._document_filter([document_id]),
+            include=["embeddings"]
+        )
+        return result["ids"], [list(vector) for vector in result["embeddings"]]
+
+    def count(self, document_id: int) -> int:
+        """统计一个文档已写入的向量数量"""
+        result = self._get_collection(self._shard_name(document_id)).get(
+            where=self._document_filter([document_id]),
+            include=[]
+        )
+        return len(result["ids"])
+
+    def query(self, query_embedding: List[float], k: int,
+              document_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """检索与查询向量最相近的分块
+
+        Args:
+            query_embedding: 查询向量
+            k: 返回结果数量
+            document_ids: 限定检索的文档ID列表，为空时检索全部文档
+
+        Returns:
+            按相似度从高到低排序的结果列表，每项包含 id、chunk_id、document_id、text、score
+        """
+        if document_ids:
+            shards = {}
+            for doc_id in document_ids:
+                shards.setdefault(self._shard_name(doc_id), []).append(doc_id)
+        elif self.shard_count == 1:
+            shards = {self.collection_name: None}
+        else:
+            shards = {f"{self.collection_name}_{i}": None for i in range(self.shard_count)}
+
+        hits = []
+        for shard_name, shard_document_ids in shards.items():
+            collection = self._get_collection(shard_name)
+            result = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=k,
+                where=self._document_filter(shard_document_ids) if shard_document_ids else None,
+                include=["documents", "metadatas", "distances"]
+            )
+            for vector_id, text, metadata, distance in zip(
+                result["ids"][0], result["documents"][0],
+                result["metadatas"][0], result["distances"][0]
+            ):
+                metadata = metadata or {}
+                hits.append({
+                    "id": vector_id,
+                    "chunk_id": metadata.get("chunk_id"),
+                    "document_id": metadata.get("document_id"),
+                    "text": text,
+                    "score": 1.0 - distance,
+                })
+
+        hits.sort(key=lambda hit: hit["score"], reverse=True)
+        return hits[:k]
+
+    def persist(self, document_id: int = None) -> None:
+        """PersistentClient 会自动持久化，保留此方法以兼容旧接口"""
+        pass
+
+
+_stores: Dict[tuple, Any] = {}
+_stores_lock = threading.Lock()
+
+
+def get_vector_store(config: Dict[str, Any]):
+    """按配置获取进程内共享的向量存储实例
+
+    vector_store_backend 为 chroma（默认）时使用共享的Chroma集合，
+    为 numpy 时使用 float32 的 mmap 存储，为 int8 时使用量化存储。
+    """
+    backend = config.get('vector_store_backend', 'chroma')
+    if backend == 'numpy':
+        root_dir = os.path.join(config['vector_store_dir'], NUMPY_STORE_DIRNAME)
+        key = (backend, root_dir)
+    elif backend == 'int8':
+        root_dir = os.path.join(config['vector_store_dir'], QUANTIZED_STORE_DIRNAME)
+        key = (backend, root_dir, config['quantized_rescore'], config['quantized_rescore_factor'])
+    elif backend == 'chroma':
+        persist_directory = os.path.join(config['vector_store_dir'], SHARED_STORE_DIRNAME)
+        key = (persist_directory, config['vector_collection'], config['vector_store_shards'])
+    else:
+        raise ValueError(f"不支持的向量存储后端: {backend}")
+
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            if backend == 'numpy':
+                store = NumpyVectorStore(root_dir=root_dir)
+            elif backend == 'int8':
+                store = QuantizedVectorStore(
+                    root_dir=root_dir,
+                    rescore=config['quantized_rescore'],
+                    rescore_factor=config['quantized_rescore_factor']
+                )
+            else:
+                store = ChromaVectorStore(
+                    persist_directory=persist_directory,
+                    collection_name=config['vector_collection'],
+                    shard_count=config['vector_store_shards']
+                )
+            _stores[key] = store
+        return store
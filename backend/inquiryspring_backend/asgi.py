@@ -0,0 +1,13 @@
+"""
+ASGI config for InquirySpring Backend.
+
+聊天、测验和总结视图为异步视图，在ASGI服务器下等待AI服务时不占用工作线程，例如：
+    uvicorn inquiryspring_backend.asgi:application --workers 1
+"""
+
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'inquiryspring_backend.settings')
+
+application = get_asgi_application()
@@ -3,11 +3,5 @@ from django.apps import AppConfig
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-<<<<<<< HEAD:backend/inquiryspring_backend/chat/apps.py
     name = 'inquiryspring_backend.chat'
     verbose_name = '聊天功能'
-=======
-    name = 'apps.chat'
-    verbose_name = '对话管理'
-#try
->>>>>>> a8cbec81e8695ac4bba2c6ac122dbabeee188b7d:apps/chat/apps.py
@@ -0,0 +1,112 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from ..ai_service_wrapper import ai_service
+from ..ai_services.response_cache import response_cache
+from .models import ChatSession, Message
+
+
+def parse_events(payload):
+    """把SSE文本解析为 [(事件名, 数据)]"""
+    events = []
+    for block in payload.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+class FakeLLMClient:
+    """ai_services 的LLM客户端替身，按顺序返回给定的文本片段"""
+    model_id = 'local-model'
+    provider = 'local'
+
+    def __init__(self, *pieces):
+        self.pieces = pieces
+        self.prompts = []
+
+    def is_mock(self):
+        return False
+
+    async def agenerate_text(self, prompt, task_type='chat'):
+        self.prompts.append(prompt)
+        return {'text': ''.join(self.pieces), 'model': self.model_id, 'tokens_used': 10}
+
+    async def agenerate_text_stream(self, prompt, task_type='chat'):
+        self.prompts.append(prompt)
+        for text in self.pieces:
+            yield text
+
+
+class ChatViewTests(TestCase):
+
+    def test_reply_is_generated_by_llm_client_when_available(self):
+        llm_client = FakeLLMClient('本地模型回答')
+        with mock.patch.object(response_cache, 'lookup', return_value=(None, None)), \
+                mock.patch.object(response_cache, 'store') as store, \
+                mock.patch('inquiryspring_backend.ai_service_wrapper.get_llm_client', return_value=llm_client):
+            response = self.client.post('/api/chat/', {'message': '你好'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(llm_client.prompts, ['你好'])
+        self.assertEqual(ChatSession.objects.get().ai_response, '本地模型回答')
+        self.assertEqual(store.call_args.args[3]['provider'], 'local')
+
+
+class ChatStreamViewTests(TestCase):
+
+    async def test_meta_event_is_sent_before_generation_finishes(self):
+        release = asyncio.Event()
+        finished = asyncio.Event()
+
+        async def fake_stream(prompt, context=None, info=None):
+            yield '第一段'
+            # 客户端收到 meta 和第一段之前不继续生成
+            await release.wait()
+            yield '第二段'
+            finished.set()
+
+        with mock.patch.object(response_cache, 'lookup', return_value=(None, None)), \
+                mock.patch.object(response_cache, 'store'), \
+                mock.patch.object(ai_service, 'achat_stream', fake_stream):
+            response = await self.async_client.post(
+                '/api/chat/stream/', {'message': '你好'}, content_type='application/json'
+            )
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+            chunks = aiter(response.streaming_content)
+            first = await asyncio.wait_for(anext(chunks), timeout=5)
+            self.assertEqual(parse_events(first.decode())[0][0], 'meta')
+            self.assertFalse(finished.is_set())
+
+            second = await asyncio.wait_for(anext(chunks), timeout=5)
+            self.assertEqual(parse_events(second.decode()), [('delta', {'text': '第一段'})])
+            self.assertFalse(finished.is_set())
+
+            release.set()
+            rest = b''.join([chunk async for chunk in chunks]).decode()
+
+        events = parse_events(rest)
+        self.assertEqual(events[0], ('delta', {'text': '第二段'}))
+        self.assertEqual(events[-1][0], 'done')
+        session = await ChatSession.objects.aget(id=events[-1][1]['session_id'])
+        self.assertEqual(session.ai_response, '第一段第二段')
+
+    async def test_stream_goes_through_llm_client_when_available(self):
+        llm_client = FakeLLMClient('本地', '模型')
+        with mock.patch.object(response_cache, 'lookup', return_value=(None, None)), \
+                mock.patch.object(response_cache, 'store') as store, \
+                mock.patch('inquiryspring_backend.ai_service_wrapper.get_llm_client', return_value=llm_client):
+            response = await self.async_client.post(
+                '/api/chat/stream/', {'message': '你好'}, content_type='application/json'
+            )
+            payload = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        events = parse_events(payload)
+        self.assertEqual([data for event, data in events if event == 'delta'], [{'text': '本地'}, {'text': '模型'}])
+        self.assertEqual(llm_client.prompts, ['你好'])
+        self.assertEqual(store.call_args.args[3]['provider'], 'local')
+        reply = await Message.objects.aget(is_user=False)
+        self.assertEqual(reply.ai_model, 'local-model')
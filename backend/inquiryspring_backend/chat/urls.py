@@ -6,6 +6,7 @@ app_name = 'chat'
 urlpatterns = [
     # 主聊天接口 - 兼容前端
     path('', views.ChatView.as_view(), name='chat'),
+    path('stream/', views.ChatStreamView.as_view(), name='chat_stream'),
 
     # 文档上传接口
     path('upload/', views.ChatDocumentUploadView.as_view(), name='chat_upload'),
@@ -13,5 +14,6 @@ urlpatterns = [
 
     # API接口
     path('history/', views.chat_history, name='chat_history'),
+    path('cache-stats/', views.chat_cache_stats, name='chat_cache_stats'),
     # 删除了反馈功能路由
 ]
@@ -1,5 +1,7 @@
 import logging
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
@@ -8,20 +10,28 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 import json
+import time
 from datetime import datetime
 
 from .models import ChatSession, Message, Conversation
 from ..ai_service_wrapper import ai_service
 from ..documents.models import Document, UploadedFile
+from ..projects.models import Project, ProjectDocument
+from ..ai_services.context_assembler import ContextAssembler, DEFAULT_TOKEN_BUDGET
+from ..ai_services.response_cache import response_cache
+from ..utils import get_rag_engine_class
 
 logger = logging.getLogger(__name__)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
 class ChatView(View):
-    """聊天视图 - 兼容前端的POST和GET请求"""
+    """聊天视图 - 兼容前端的POST和GET请求
+
+    异步视图：在ASGI下等待AI服务响应时不占用工作线程，数据库和检索操作在线程池中执行。
+    """
     
-    def post(self, request):
+    async def post(self, request):
         """处理用户消息"""
         try:
             data = json.loads(request.body)
@@ -32,48 +42,29 @@ class ChatView(View):
 
             logger.info(f"收到用户消息: {user_message}")
 
-            # 自动使用最近上传的文档作为上下文
-            context = ""
-            used_document = None
-
-            # 获取最近上传的已处理文档
-            recent_documents = Document.objects.filter(
-                is_processed=True
-            ).order_by('-uploaded_at')[:1]
-
-            if recent_documents.exists():
-                # 始终使用最近的文档作为上下文
-                latest_document = recent_documents.first()
-                context = latest_document.content
-                used_document = latest_document
-                logger.info(f"使用最近文档作为上下文: {latest_document.title}")
-
-            # 使用AI服务生成回复（带上下文）
-            if context:
-                # 构建带文档上下文的提示
-                enhanced_message = f"""
-基于以下文档内容回答用户问题：
-
-文档标题：{used_document.title}
-文档内容：
-{context[:3000]}  # 限制上下文长度
-
-用户问题：
-{user_message}
-
-请基于文档内容给出准确、详细的回答。如果问题与文档内容无关，请说明并尝试给出一般性回答。
-"""
-                ai_result = ai_service.chat(enhanced_message)
-
-                # 在回复前添加文档引用信息
-                ai_response = ai_result.get("text", "抱歉，AI服务暂时不可用")
-                ai_response = f"📄 基于文档《{used_document.title}》回答：\n\n{ai_response}"
-            else:
-                ai_result = ai_service.chat(user_message)
-                ai_response = ai_result.get("text", "抱歉，AI服务暂时不可用")
+            project_id = data.get('project_id')
+            try:
+                project, documents = await sync_to_async(self._resolve_documents)(project_id)
+            except (Project.DoesNotExist, ValueError):
+                return JsonResponse({'error': '项目不存在'}, status=404)
+
+            used_document = documents[0] if documents else None
+            document_ids = [document.id for document in documents]
+
+            # 同一文档范围内语义相近的问题直接复用缓存的回答
+            reply, cache_probe = await sync_to_async(response_cache.lookup)('chat', user_message, document_ids)
+            cache_hit = reply is not None
+            if not cache_hit:
+                start_time = time.time()
+                reply = await self._agenerate_reply(user_message, documents, project)
+                await sync_to_async(response_cache.store)(
+                    'chat', cache_probe, document_ids, reply, time.time() - start_time
+                )
+            ai_response = reply['text']
+            citations = reply['citations']
 
             # 保存到数据库
-            chat_session = ChatSession.objects.create(
+            chat_session = await ChatSession.objects.acreate(
                 user_message=user_message,
                 ai_response=ai_response
             )
@@ -84,8 +75,11 @@ class ChatView(View):
                 'status': 'success',
                 'message': '消息已发送',
                 'session_id': chat_session.id,
-                'has_context': bool(context),
-                'used_document': used_document.title if used_document else None
+                'has_context': bool(used_document),
+                'used_document': used_document.title if used_document else None,
+                'project_id': project_id,
+                'citations': citations,
+                'cache_hit': cache_hit
             })
             
         except Exception as e:
@@ -95,10 +89,139 @@ class ChatView(View):
                 'error': f'处理失败: {str(e)}'
             }, status=500)
     
-    def get(self, request):
+    @staticmethod
+    def _resolve_documents(project_id=None):
+        """确定回答所依据的文档
+
+        指定项目时使用项目的全部已处理文档，否则使用最近上传的文档。
+
+        Returns:
+            (项目或None, 文档列表)
+        """
+        if not project_id:
+            # 自动使用最近上传的文档作为上下文
+            return None, list(Document.objects.filter(
+                is_processed=True
+            ).order_by('-uploaded_at')[:1])
+
+        project = Project.objects.get(id=project_id, is_active=True)
+        # 在项目的所有已处理文档中检索
+        project_documents = ProjectDocument.objects.filter(
+            project=project,
+            document__is_processed=True
+        ).select_related('document').order_by('-document__uploaded_at')
+        return project, [project_document.document for project_document in project_documents]
+
+    def _prepare_prompt(self, user_message, documents, project=None):
+        """检索上下文并构建提示
+
+        Returns:
+            包含 prompt、prefix（回复前的文档引用说明）、citations 的字典
+        """
+        used_document = documents[0] if documents else None
+        assembled = self._retrieve_context([document.id for document in documents], user_message)
+
+        if assembled:
+            citations = assembled['citations']
+            cited_titles = '》《'.join(dict.fromkeys(c['document_title'] for c in citations))
+            if project:
+                prefix = f"📄 基于项目《{project.name}》中的文档《{cited_titles}》回答：\n\n"
+            else:
+                prefix = f"📄 基于文档《{cited_titles}》回答：\n\n"
+            return {
+                'prompt': self._build_rag_prompt(user_message, assembled['sections']),
+                'prefix': prefix,
+                'citations': citations,
+            }
+
+        if used_document:
+            # 检索不可用时退回到整篇文档，按token预算截断
+            logger.info(f"使用最近文档作为上下文: {used_document.title}")
+            context = ContextAssembler(token_budget=self._context_token_budget()).truncate(used_document.content)
+            enhanced_message = f"""
+基于以下文档内容回答用户问题：
+
+文档标题：{used_document.title}
+文档内容：
+{context}
+
+用户问题：
+{user_message}
+
+请基于文档内容给出准确、详细的回答。如果问题与文档内容无关，请说明并尝试给出一般性回答。
+"""
+            return {
+                'prompt': enhanced_message,
+                'prefix': f"📄 基于文档《{used_document.title}》回答：\n\n",
+                'citations': [],
+            }
+
+        return {'prompt': user_message, 'prefix': '', 'citations': []}
+
+    async def _agenerate_reply(self, user_message, documents, project=None):
+        """检索上下文并调用AI服务生成回复"""
+        prepared = await sync_to_async(self._prepare_prompt)(user_message, documents, project)
+        return self._build_reply(prepared, await ai_service.achat(prepared['prompt']))
+
+    @staticmethod
+    def _build_reply(prepared, ai_result):
+        # 在回复前添加文档引用信息
+        ai_response = prepared['prefix'] + ai_result.get("text", "抱歉，AI服务暂时不可用")
+
+        # provider 为 mock 的模拟回复不会被语义缓存保存
+        reply = {'text': ai_response, 'citations': prepared['citations'], 'provider': ai_result.get('provider')}
+        if ai_result.get('error'):
+            reply['error'] = ai_result['error']
+        return reply
+
+    @staticmethod
+    def _context_token_budget():
+        return getattr(settings, 'CHAT_CONTEXT_TOKEN_BUDGET', DEFAULT_TOKEN_BUDGET)
+
+    def _retrieve_context(self, document_ids, query):
+        """在给定文档中检索相关分块，并在token预算内组装上下文
+
+        RAG不可用或没有检索结果时返回None。
+        """
+        if not document_ids:
+            return None
+
+        rag_engine_class = get_rag_engine_class()
+        if rag_engine_class is None:
+            return None
+
+        engine = rag_engine_class(config={'context_token_budget': self._context_token_budget()})
+        chunks = engine.retrieve_from_documents(query, document_ids, top_k=engine.config['top_k_context'])
+        if not chunks:
+            return None
+
+        assembled = engine.assemble_context(chunks)
+        assembled['citations'] = engine.build_citations([chunk for chunk, _ in assembled['sections']])
+        logger.info(f"组装上下文: {len(assembled['sections'])} 个分块, 约 {assembled['tokens']} tokens")
+        return assembled
+
+    @staticmethod
+    def _build_rag_prompt(user_message, sections):
+        """根据组装好的上下文构建提示，每个片段标注来源文档"""
+        sources = "\n\n".join(
+            f"[{i}] 《{chunk.document.title}》\n{text}"
+            for i, (chunk, text) in enumerate(sections, 1)
+        )
+        return f"""
+基于以下文档中的相关片段回答用户问题：
+
+{sources}
+
+用户问题：
+{user_message}
+
+请基于上述片段给出准确、详细的回答，并用 [编号] 标注引用的片段。如果问题与文档内容无关，请说明并尝试给出一般性回答。
+"""
+
+    async def get(self, request):
         """获取最新的AI回复"""
         try:
-            latest_message = ChatSession.objects.order_by('-timestamp').first()
+            latest_message = await ChatSession.objects.order_by('-timestamp').afirst()
 
             if latest_message:
                 # 返回包含status字段的响应，以便中间件不再包装
@@ -128,6 +251,128 @@ class ChatView(View):
             }, status=500)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatStreamView(ChatView):
+    """流式聊天视图 - 通过Server-Sent Events逐段返回AI回复
+
+    事件依次为：meta（引用信息）、若干 delta（回复片段）、done（会话ID）；出错时发送 error。
+    回复完成后保存到 ChatSession 和 Message。
+    响应内容是异步生成器：ASGI下每个片段生成后立即发送；WSGI下Django会先读完整个回复再发送。
+    """
+
+    http_method_names = ['post', 'options']
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': '请求格式错误'}, status=400)
+
+        user_message = data.get('message', '').strip()
+        if not user_message:
+            return JsonResponse({'error': '消息不能为空'}, status=400)
+
+        project_id = data.get('project_id')
+        try:
+            project, documents = await sync_to_async(self._resolve_documents)(project_id)
+        except (Project.DoesNotExist, ValueError):
+            return JsonResponse({'error': '项目不存在'}, status=404)
+
+        conversation = None
+        if data.get('conversation_id'):
+            conversation = await Conversation.objects.filter(id=data['conversation_id']).afirst()
+
+        logger.info(f"收到流式聊天消息: {user_message}")
+        response = StreamingHttpResponse(
+            self._stream_reply(user_message, documents, project, conversation),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # 禁止反向代理缓冲，保证片段及时送达
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    def _event(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def _stream_reply(self, user_message, documents, project, conversation):
+        start_time = time.time()
+        document_ids = [document.id for document in documents]
+        used_document = documents[0] if documents else None
+
+        # 本次回复使用的模型和提供商，由 achat_stream 填入
+        stream_info = {}
+
+        try:
+            cached, cache_probe = await sync_to_async(response_cache.lookup)('chat', user_message, document_ids)
+            if cached is not None:
+                ai_response = cached['text']
+                citations = cached['citations']
+                yield self._event('meta', {
+                    'used_document': used_document.title if used_document else None,
+                    'project_id': project.id if project else None,
+                    'citations': citations,
+                    'cache_hit': True
+                })
+                yield self._event('delta', {'text': ai_response})
+            else:
+                prepared = await sync_to_async(self._prepare_prompt)(user_message, documents, project)
+                citations = prepared['citations']
+                yield self._event('meta', {
+                    'used_document': used_document.title if used_document else None,
+                    'project_id': project.id if project else None,
+                    'citations': citations,
+                    'cache_hit': False
+                })
+
+                pieces = [prepared['prefix']]
+                if prepared['prefix']:
+                    yield self._event('delta', {'text': prepared['prefix']})
+                async for text in ai_service.achat_stream(prepared['prompt'], info=stream_info):
+                    pieces.append(text)
+                    yield self._event('delta', {'text': text})
+
+                ai_response = ''.join(pieces)
+                await sync_to_async(response_cache.store)(
+                    'chat', cache_probe, document_ids,
+                    {'text': ai_response, 'citations': citations,
+                     'provider': stream_info.get('provider', 'mock')},
+                    time.time() - start_time
+                )
+
+            # 回复完成后保存到数据库
+            chat_session = await ChatSession.objects.acreate(
+                user_message=user_message,
+                ai_response=ai_response
+            )
+            await Message.objects.acreate(conversation=conversation, content=user_message, is_user=True)
+            await Message.objects.acreate(
+                conversation=conversation,
+                content=ai_response,
+                is_user=False,
+                ai_model=stream_info.get('model') or (ai_service.model_name if ai_service.client else 'mock'),
+                processing_time=time.time() - start_time
+            )
+
+            logger.info(f"流式AI回复完成: {ai_response[:100]}...")
+            yield self._event('done', {'session_id': chat_session.id})
+
+        except Exception as e:
+            logger.error(f"流式聊天处理失败: {e}")
+            yield self._event('error', {'error': f'处理失败: {str(e)}'})
+
+
+@api_view(['GET'])
+def chat_cache_stats(request):
+    """获取语义响应缓存的命中率和节省的延迟"""
+    try:
+        return Response(response_cache.get_stats())
+    except Exception as e:
+        logger.error(f"获取缓存统计失败: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['GET'])
 def chat_history(request):
     """获取聊天历史"""
@@ -169,20 +414,9 @@ class ChatDocumentUploadView(View):
                 return JsonResponse({'error': '没有选择文件'}, status=400)
 
             # 导入文档处理相关模块
-            from ..documents.views import allowed_file
+            from ..documents.views import allowed_file, secure_filename, save_upload
             from ..documents.document_processor import document_processor
-            from django.conf import settings
-            from django.utils import timezone
             import os
-            import re
-
-            def secure_filename(filename):
-                """安全的文件名处理"""
-                # 移除路径分隔符和危险字符
-                filename = re.sub(r'[^\w\s\-\.]', '', filename).strip()
-                # 替换空格为下划线
-                filename = re.sub(r'[\-\s]+', '_', filename)
-                return filename
 
             if not allowed_file(file.name):
                 return JsonResponse({'error': '不支持的文件类型'}, status=400)
@@ -193,77 +427,26 @@ class ChatDocumentUploadView(View):
                     'error': '文档处理功能不可用'
                 }, status=500)
 
-            # 保存文件到临时位置
             filename = secure_filename(file.name)
-            upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
-            os.makedirs(upload_dir, exist_ok=True)
-
-            file_path = os.path.join(upload_dir, filename)
-
-            with open(file_path, 'wb+') as destination:
-                for chunk in file.chunks():
-                    destination.write(chunk)
-
-            # 验证文件
-            validation = document_processor.validate_file(file_path, filename)
-            if not validation['valid']:
-                # 删除临时文件
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                return JsonResponse({'error': validation['error']}, status=400)
-
-            # 创建Document记录
-            document = Document.objects.create(
-                title=filename,  # 使用原始文件名
-                file_type=validation['file_type'],
-                file_size=validation['file_size'],
-                processing_status='processing'
-            )
-
-            # 更新文件路径（包含document ID）
-            final_dir = os.path.join(settings.MEDIA_ROOT, 'documents', str(document.id))
-            os.makedirs(final_dir, exist_ok=True)
-            final_path = os.path.join(final_dir, filename)
-
-            # 移动文件到最终位置
-            os.rename(file_path, final_path)
-
-            # 更新document记录
-            document.file.name = f'documents/{document.id}/{filename}'
-            document.save()
-
-            # 提取文档内容
-            extraction_result = document_processor.extract_text(final_path, filename)
-
-            if extraction_result['success']:
-                # 更新文档记录
-                document.content = extraction_result['content']
-                document.metadata = extraction_result['metadata']
-                document.is_processed = True
-                document.processing_status = 'completed'
-                document.processed_at = timezone.now()
-                document.save()
-
-                logger.info(f"聊天文档处理成功: {filename}")
-
-                return JsonResponse({
-                    'message': '文档上传成功，现在可以基于此文档进行问答',
-                    'document_id': document.id,
-                    'filename': filename,
-                    'content_length': len(extraction_result['content']),
-                    'file_type': validation['file_type'],
-                    'status': 'success'
-                })
+            document, duplicate, error = save_upload(file, filename)
+            if document is None:
+                return JsonResponse({'error': error}, status=400)
+            filename = os.path.basename(document.file.name) if document.file else filename
+            if duplicate:
+                logger.info(f"聊天文档与已有文档 {document.id} 内容相同: {filename}")
             else:
-                # 处理失败
-                document.processing_status = 'failed'
-                document.error_message = extraction_result['error']
-                document.save()
+                logger.info(f"聊天文档已加入处理队列: {filename}")
 
-                return JsonResponse({
-                    'error': f'文档处理失败: {extraction_result["error"]}',
-                    'document_id': document.id
-                }, status=500)
+            return JsonResponse({
+                'message': '文档上传成功，正在后台处理，完成后即可基于此文档进行问答',
+                'document_id': document.id,
+                'filename': filename,
+                'content_length': len(document.content or ''),
+                'file_type': document.file_type,
+                'processing_status': document.processing_status,
+                'duplicate': duplicate,
+                'status': 'success'
+            })
 
         except Exception as e:
             logger.error(f"聊天文档上传失败: {e}")
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Document, DocumentChunk, UploadedFile
+from .models import Document, DocumentAlias, DocumentChunk, DocumentSummary, IngestionJob, UploadedFile
 
 
 @admin.register(Document)
@@ -27,6 +27,13 @@ class DocumentAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(DocumentAlias)
+class DocumentAliasAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'document', 'created_at']
+    search_fields = ['name', 'document__title']
+    readonly_fields = ['created_at']
+
+
 @admin.register(DocumentChunk)
 class DocumentChunkAdmin(admin.ModelAdmin):
     list_display = ['id', 'document', 'chunk_index', 'content_preview', 'created_at']
@@ -39,6 +46,22 @@ class DocumentChunkAdmin(admin.ModelAdmin):
     content_preview.short_description = '内容预览'
 
 
+@admin.register(DocumentSummary)
+class DocumentSummaryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'document', 'summary_length', 'include_outline', 'template_version', 'model', 'updated_at']
+    list_filter = ['summary_length', 'include_outline', 'updated_at']
+    search_fields = ['document__title', 'summary']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'document', 'status', 'stage', 'progress', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['document__title', 'error_message']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
+
+
 @admin.register(UploadedFile)
 class UploadedFileAdmin(admin.ModelAdmin):
     list_display = ['id', 'filename', 'file_size', 'upload_time']
@@ -4,7 +4,9 @@
 import logging
 import os
 import tempfile
-from typing import Dict, Any, Optional
+from concurrent.futures import Executor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
@@ -25,6 +27,26 @@ except ImportError:
 PROCESSING_AVAILABLE = PDF_AVAILABLE or DOCX_AVAILABLE
 logger.info(f"Document processing capabilities: PDF={PDF_AVAILABLE}, DOCX={DOCX_AVAILABLE}")
 
+# PDF页之间的分隔符，page_offsets 按该分隔符计算
+PAGE_SEPARATOR = '\n'
+
+
+def count_pdf_pages(file_path: str) -> int:
+    """获取PDF的页数"""
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def extract_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    """提取PDF中第 start 到 end-1 页（从0开始）的文本
+
+    在进程池的工作进程中执行，每个任务只解析自己负责的页。
+    """
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        end = min(end, len(pdf_reader.pages))
+        return [pdf_reader.pages[index].extract_text() or '' for index in range(start, end)]
+
 
 class DocumentProcessor:
     """文档处理器 - 使用textract提取文档内容"""
@@ -63,13 +85,15 @@ class DocumentProcessor:
         """检查文件是否支持"""
         return self.get_file_type(filename) is not None
     
-    def extract_text(self, file_path: str, filename: str = None) -> Dict[str, Any]:
+    def extract_text(self, file_path: str, filename: str = None,
+                     executor: Executor = None) -> Dict[str, Any]:
         """
         从文档中提取文本内容
         
         Args:
             file_path: 文件路径
             filename: 文件名（用于确定文件类型）
+            executor: 进程池，提供时PDF按页范围并行提取
         
         Returns:
             包含提取结果的字典
@@ -110,29 +134,33 @@ class DocumentProcessor:
             # 获取文件大小
             file_size = os.path.getsize(file_path)
             
+            page_offsets = None
+            
             # 根据文件类型选择提取方法
             if file_type == 'text':
                 # 对于纯文本文件，直接读取
-                content = self._extract_text_file(file_path)
+                content = self._clean_content(self._extract_text_file(file_path))
                 extraction_method = 'direct'
             elif file_type == 'pdf':
-                content = self._extract_pdf(file_path)
+                # 逐页清理，内容已是清理后的结果
+                content, page_offsets = self._extract_pdf(file_path, executor)
                 extraction_method = 'PyPDF2'
             elif file_type == 'office':
-                content = self._extract_docx(file_path)
+                content = self._clean_content(self._extract_docx(file_path))
                 extraction_method = 'python-docx'
             else:
                 raise Exception(f"Unsupported file type: {file_type}")
             
-            # 清理和处理内容
-            content = self._clean_content(content)
-            
             metadata = {
                 'file_type': file_type,
                 'file_size': file_size,
                 'content_length': len(content),
                 'extraction_method': extraction_method
             }
+            if page_offsets is not None:
+                # 每页在 content 中的起始位置，用于分块的页码引用
+                metadata['page_count'] = len(page_offsets)
+                metadata['page_offsets'] = page_offsets
             
             logger.info(f"Successfully extracted {len(content)} characters from {filename}")
             
@@ -143,6 +171,9 @@ class DocumentProcessor:
                 'error': None
             }
             
+        except BrokenProcessPool:
+            # 由调用方重建进程池
+            raise
         except Exception as e:
             logger.error(f"Failed to extract content from {filename}: {e}")
             return {
@@ -167,18 +198,68 @@ class DocumentProcessor:
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
             return f.read()
     
-    def _extract_pdf(self, file_path: str) -> str:
-        """使用PyPDF2提取PDF内容"""
+    def iter_pdf_pages(self, file_path: str, executor: Executor = None,
+                       pages_per_task: int = None) -> Iterator[Tuple[int, str]]:
+        """按页码顺序逐页产出 (页码, 文本)，页码从1开始
+
+        提供进程池且页数较多时，按页范围分成多个任务并行提取；同时提交的任务数有上限，
+        已完成的页按顺序产出后即可释放，内存占用与页范围大小有关而与文档总页数无关。
+        """
         if not self.pdf_available:
             raise Exception("PyPDF2 not available")
 
+        pages_per_task = pages_per_task or getattr(settings, 'PDF_PAGES_PER_TASK', 16)
+        page_count = count_pdf_pages(file_path)
+
+        if executor is None or page_count <= pages_per_task:
+            for start in range(0, page_count, pages_per_task):
+                for offset, text in enumerate(extract_pdf_pages(file_path, start, start + pages_per_task)):
+                    yield start + offset + 1, text
+            return
+
+        max_pending = max(1, getattr(settings, 'PDF_MAX_PENDING_TASKS', 4))
+        ranges = iter(range(0, page_count, pages_per_task))
+        pending = []
+
+        def submit_next() -> bool:
+            start = next(ranges, None)
+            if start is None:
+                return False
+            pending.append((start, executor.submit(extract_pdf_pages, file_path, start, start + pages_per_task)))
+            return True
+
+        while len(pending) < max_pending and submit_next():
+            pass
         try:
-            content = []
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    content.append(page.extract_text())
-            return '\n'.join(content)
+            while pending:
+                start, future = pending.pop(0)
+                texts = future.result()
+                submit_next()
+                for offset, text in enumerate(texts):
+                    yield start + offset + 1, text
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def _extract_pdf(self, file_path: str, executor: Executor = None) -> Tuple[str, List[int]]:
+        """使用PyPDF2提取PDF内容
+
+        Returns:
+            (清理后的内容, 每页在内容中的起始位置)
+        """
+        try:
+            parts = []
+            page_offsets = []
+            length = 0
+            for _, text in self.iter_pdf_pages(file_path, executor):
+                text = self._clean_content(text)
+                if text and parts:
+                    length += len(PAGE_SEPARATOR)
+                page_offsets.append(length)
+                if text:
+                    parts.append(text)
+                    length += len(text)
+            return PAGE_SEPARATOR.join(parts), page_offsets
         except Exception as e:
             logger.error(f"PDF extraction failed: {e}")
             raise
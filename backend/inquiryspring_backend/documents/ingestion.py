@@ -0,0 +1,318 @@
+"""
+文档后台处理队列 - 上传接口只负责保存文件，提取、分块和向量化在后台完成
+
+任务记录保存在数据库（IngestionJob）中，可由Web进程内的调度线程处理，
+也可以通过 `python manage.py run_ingestion_worker` 在独立进程中处理。
+文本提取是CPU密集型操作，在进程池中执行，不占用Web进程的GIL；PDF按页范围拆分到多个进程并行提取。
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Document, IngestionJob
+from .document_processor import document_processor
+from ..ai_services.response_cache import response_cache
+from ..utils import get_rag_engine_class
+
+logger = logging.getLogger(__name__)
+
+# 提取阶段占总进度的比例，其余为分块和向量化
+EXTRACTION_WEIGHT = 50
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # 进程存在但属于其他用户
+        return True
+    return True
+
+
+class IngestionQueue:
+    """基于数据库的文档处理队列"""
+
+    def __init__(self, max_workers: int = None, poll_interval: float = None):
+        self.max_workers = max_workers or getattr(settings, 'DOCUMENT_INGESTION_WORKERS', 2)
+        self.poll_interval = poll_interval or getattr(settings, 'DOCUMENT_INGESTION_POLL_INTERVAL', 5.0)
+        self.stale_timeout = getattr(settings, 'DOCUMENT_INGESTION_STALE_TIMEOUT', 1800)
+
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._inflight = set()
+
+    def enqueue(self, document: Document) -> IngestionJob:
+        """为文档创建处理任务，并唤醒进程内的调度线程"""
+        job = IngestionJob.objects.create(document=document, stage='queued')
+        Document.objects.filter(id=document.id).update(processing_status='queued')
+        document.processing_status = 'queued'
+
+        if getattr(settings, 'DOCUMENT_INGESTION_INLINE_WORKER', True):
+            self.start()
+            self._wakeup.set()
+        return job
+
+    def start(self) -> None:
+        """启动后台调度线程（幂等），启动前将上次进程退出时中断的任务重新放回队列"""
+        with self._lock:
+            if self._dispatcher and self._dispatcher.is_alive():
+                return
+            try:
+                self.recover_stale_jobs(self.stale_timeout)
+            except Exception as e:
+                logger.exception(f"恢复中断的文档处理任务失败: {e}")
+            self._dispatcher = threading.Thread(
+                target=self.serve_forever,
+                name='document-ingestion',
+                daemon=True
+            )
+            self._dispatcher.start()
+
+    def serve_forever(self) -> None:
+        """循环领取并执行待处理任务"""
+        logger.info(f"文档处理队列已启动，并发数: {self.max_workers}")
+        while True:
+            # 先清除再检查任务，检查期间到达的唤醒信号不会丢失
+            self._wakeup.clear()
+            try:
+                self.dispatch_pending()
+            except Exception as e:
+                logger.exception(f"调度文档处理任务失败: {e}")
+            finally:
+                close_old_connections()
+            self._wakeup.wait(self.poll_interval)
+
+    def dispatch_pending(self) -> int:
+        """领取等待中的任务并提交到线程池，返回本次提交的任务数"""
+        free_slots = self.max_workers - len(self._inflight)
+        if free_slots <= 0:
+            return 0
+
+        pending_ids = list(
+            IngestionJob.objects.filter(status='pending')
+            .order_by('created_at')
+            .values_list('id', flat=True)[:free_slots]
+        )
+
+        submitted = 0
+        for job_id in pending_ids:
+            if not self._claim(job_id):
+                # 已被其他进程领取
+                continue
+            self._inflight.add(job_id)
+            future = self._get_thread_pool().submit(self._run_claimed, job_id)
+            future.add_done_callback(lambda _, job_id=job_id: self._on_job_done(job_id))
+            submitted += 1
+        return submitted
+
+    def _on_job_done(self, job_id: int) -> None:
+        self._inflight.discard(job_id)
+        # 有空闲槽位后立即检查是否还有等待的任务
+        self._wakeup.set()
+
+    @staticmethod
+    def _claim(job_id: int) -> bool:
+        """原子地将任务从pending改为running，多个worker进程不会重复处理"""
+        now = timezone.now()
+        return IngestionJob.objects.filter(id=job_id, status='pending').update(
+            status='running',
+            started_at=now,
+            heartbeat_at=now,
+            worker=_worker_id(),
+            attempts=F('attempts') + 1
+        ) == 1
+
+    def _run_claimed(self, job_id: int) -> None:
+        try:
+            job = IngestionJob.objects.select_related('document').get(id=job_id)
+            self.run_job(job)
+        except Exception as e:
+            logger.exception(f"执行文档处理任务 {job_id} 失败: {e}")
+        finally:
+            close_old_connections()
+
+    def run_job(self, job: IngestionJob) -> None:
+        """执行单个任务：提取文本 -> 分块与向量化"""
+        document = job.document
+        logger.info(f"开始后台处理文档: {document.title} (任务 {job.id})")
+
+        try:
+            # 1. 在进程池中提取文本
+            self._update_progress(job, 'extracting', 0)
+            extraction_result = self._extract(document.file.path, document.title)
+
+            if not extraction_result['success']:
+                self._fail(job, extraction_result['error'])
+                return
+
+            document.content = extraction_result['content']
+            document.metadata = extraction_result['metadata']
+            document.is_processed = True
+            document.processing_status = 'extracted'
+            document.processed_at = timezone.now()
+            document.save()
+            response_cache.invalidate_document(document.id)
+            self._update_progress(job, 'extracted', EXTRACTION_WEIGHT)
+
+            # 2. 分块和向量化（需要启用ai_services）
+            rag_engine_class = get_rag_engine_class()
+            embedding_stats = {}
+            if rag_engine_class is None:
+                logger.info(f"RAG引擎不可用，跳过文档 {document.title} 的向量化")
+            else:
+                def on_progress(stage: str, percent: int):
+                    overall = EXTRACTION_WEIGHT + percent * (100 - EXTRACTION_WEIGHT) // 100
+                    self._update_progress(job, stage, overall, update_document=False)
+
+                engine = rag_engine_class(document_id=document.id)
+                if not engine.process_and_embed_document(force_reprocess=True,
+                                                         progress_callback=on_progress):
+                    document.refresh_from_db()
+                    self._fail(job, document.error_message or '文档向量化失败')
+                    return
+                # 复用和新向量化的分块数
+                embedding_stats = engine.last_embedding_stats
+
+            # update() 不会触发 auto_now，手动更新 updated_at，使其他进程中基于旧分块的缓存回答失效
+            Document.objects.filter(id=document.id).update(processing_status='completed', updated_at=timezone.now())
+            job.status = 'completed'
+            job.stage = 'completed'
+            job.progress = 100
+            job.result = {
+                'content_length': len(document.content),
+                'file_type': document.file_type,
+                **embedding_stats,
+            }
+            job.finished_at = timezone.now()
+            job.save()
+            logger.info(f"文档后台处理成功: {document.title}")
+
+        except Exception as e:
+            logger.exception(f"文档后台处理失败: {document.title}")
+            self._fail(job, str(e))
+
+    def _extract(self, file_path: str, filename: str) -> Dict[str, Any]:
+        try:
+            if document_processor.get_file_type(filename) == 'pdf':
+                # PDF按页范围拆分为多个任务，在进程池中并行提取
+                return document_processor.extract_text(file_path, filename, executor=self._get_process_pool())
+            # document_processor模块不依赖Django模型，可在spawn方式启动的子进程中直接导入
+            future = self._get_process_pool().submit(document_processor.extract_text, file_path, filename)
+            return future.result()
+        except BrokenProcessPool:
+            # 工作进程异常退出（如内存不足），重建进程池后由调用方标记失败
+            with self._lock:
+                self._process_pool = None
+            raise
+
+    @staticmethod
+    def _update_progress(job: IngestionJob, stage: str, progress: int,
+                         update_document: bool = True) -> None:
+        job.stage = stage
+        job.progress = progress
+        IngestionJob.objects.filter(id=job.id).update(stage=stage, progress=progress, heartbeat_at=timezone.now())
+        if update_document:
+            Document.objects.filter(id=job.document_id).update(processing_status=stage)
+
+    @staticmethod
+    def _fail(job: IngestionJob, error: str) -> None:
+        Document.objects.filter(id=job.document_id).update(
+            processing_status='failed',
+            error_message=error
+        )
+        job.status = 'failed'
+        job.stage = 'failed'
+        job.error_message = error
+        job.finished_at = timezone.now()
+        job.save()
+        logger.error(f"文档处理任务 {job.id} 失败: {error}")
+
+    def recover_stale_jobs(self, timeout: Optional[float] = None) -> int:
+        """将异常中断（仍为running）的任务重新放回队列，返回恢复的数量
+
+        timeout 为None时恢复所有running任务，只应在确认没有其他worker运行时使用；
+        否则只恢复所属进程已退出（同一主机上）或超过 timeout 秒没有进度更新的任务。
+        """
+        running = IngestionJob.objects.filter(status='running')
+        if timeout is not None:
+            hostname, current_pid = socket.gethostname(), os.getpid()
+            dead_ids = []
+            for job_id, worker in running.exclude(worker='').values_list('id', 'worker'):
+                host, _, pid = worker.rpartition(':')
+                if host != hostname or not pid.isdigit():
+                    continue
+                pid = int(pid)
+                # 进程ID与当前进程相同但不在本进程处理中的任务属于重启前的进程
+                if (pid == current_pid and job_id not in self._inflight) or \
+                        (pid != current_pid and not _process_alive(pid)):
+                    dead_ids.append(job_id)
+            cutoff = timezone.now() - timedelta(seconds=timeout)
+            running = running.filter(
+                Q(id__in=dead_ids) | Q(heartbeat_at__lt=cutoff) |
+                Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+            )
+
+        stale = list(running.values_list('id', 'document_id'))
+        recovered = IngestionJob.objects.filter(
+            id__in=[job_id for job_id, _ in stale], status='running'
+        ).update(status='pending', stage='queued', worker='')
+        if recovered:
+            Document.objects.filter(id__in=[document_id for _, document_id in stale]).update(processing_status='queued')
+            logger.warning(f"已将 {recovered} 个中断的文档处理任务重新放回队列")
+        return recovered
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._process_pool is None:
+                # Web进程中有调度线程、数据库连接和模型预加载线程，fork可能继承其他线程持有的锁而死锁，
+                # 因此用spawn启动全新的解释器
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._process_pool
+
+    def _get_thread_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='document-ingestion'
+                )
+            return self._thread_pool
+
+    def shutdown(self) -> None:
+        """关闭进程池和线程池"""
+        with self._lock:
+            if self._thread_pool:
+                self._thread_pool.shutdown(wait=False)
+                self._thread_pool = None
+            if self._process_pool:
+                self._process_pool.shutdown(wait=False)
+                self._process_pool = None
+
+
+# 全局文档处理队列实例
+ingestion_queue = IngestionQueue()
+atexit.register(ingestion_queue.shutdown)
@@ -0,0 +1,33 @@
+"""
+文档后台处理worker管理命令
+"""
+import logging
+from django.core.management.base import BaseCommand
+from inquiryspring_backend.documents.ingestion import ingestion_queue
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = '在独立进程中处理文档后台任务（提取、分块和向量化）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='并发处理的任务数')
+        parser.add_argument('--recover', action='store_true', help='启动前将所有running任务重新放回队列（默认只恢复所属进程已退出或长时间没有进度的任务）')
+
+    def handle(self, *args, **options):
+        if options['workers']:
+            ingestion_queue.max_workers = options['workers']
+
+        # 默认只恢复所属进程已退出或长时间没有进度的任务，--recover 时恢复全部running任务
+        recovered = ingestion_queue.recover_stale_jobs(
+            None if options['recover'] else ingestion_queue.stale_timeout
+        )
+        self.stdout.write(f"已重新排队 {recovered} 个中断的任务")
+
+        self.stdout.write(self.style.SUCCESS(f'文档处理worker已启动，并发数: {ingestion_queue.max_workers}'))
+        try:
+            ingestion_queue.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write('正在停止文档处理worker...')
+        finally:
+            ingestion_queue.shutdown()
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', '等待中'), ('running', '处理中'), ('completed', '已完成'), ('failed', '失败')], db_index=True, default='pending', max_length=20, verbose_name='状态')),
+                ('stage', models.CharField(blank=True, max_length=50, verbose_name='当前阶段')),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='进度(%)')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='尝试次数')),
+                ('error_message', models.TextField(blank=True, verbose_name='错误信息')),
+                ('result', models.JSONField(blank=True, default=dict, verbose_name='处理结果')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='开始时间')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完成时间')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingestion_jobs', to='documents.document')),
+            ],
+            options={
+                'verbose_name': '文档处理任务',
+                'verbose_name_plural': '文档处理任务',
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
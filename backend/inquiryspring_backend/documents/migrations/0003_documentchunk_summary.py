@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='summary',
+            field=models.TextField(blank=True, verbose_name='分块概括'),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='summary_version',
+            field=models.CharField(blank=True, max_length=20, verbose_name='概括提示词版本'),
+        ),
+    ]
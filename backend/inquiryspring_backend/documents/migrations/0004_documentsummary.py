@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_documentchunk_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary_length', models.CharField(max_length=20, verbose_name='摘要长度')),
+                ('include_outline', models.BooleanField(default=False, verbose_name='是否包含大纲')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='内容哈希')),
+                ('template_version', models.CharField(max_length=64, verbose_name='模板版本')),
+                ('summary', models.TextField(verbose_name='摘要')),
+                ('model', models.CharField(blank=True, max_length=100, verbose_name='生成模型')),
+                ('provider', models.CharField(blank=True, max_length=50, verbose_name='提供商')),
+                ('generation_time', models.FloatField(default=0.0, verbose_name='生成耗时(秒)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='documents.document')),
+            ],
+            options={
+                'verbose_name': '文档摘要',
+                'verbose_name_plural': '文档摘要',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='documentsummary',
+            constraint=models.UniqueConstraint(fields=('document', 'summary_length', 'include_outline'), name='unique_document_summary_options'),
+        ),
+    ]
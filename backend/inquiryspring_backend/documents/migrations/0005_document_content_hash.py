@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:58
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    """为已有文档计算文件哈希；内容重复的文档只有最早上传的一份记录哈希"""
+    Document = apps.get_model('documents', 'Document')
+    seen = set()
+    for document in Document.objects.order_by('uploaded_at').iterator():
+        if not document.file:
+            continue
+        digest = hashlib.sha256()
+        try:
+            with document.file.open('rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        except (OSError, ValueError):
+            continue
+        content_hash = digest.hexdigest()
+        if content_hash in seen:
+            continue
+        seen.add(content_hash)
+        Document.objects.filter(pk=document.pk).update(content_hash=content_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_documentsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='内容哈希'),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_document_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='metadata',
+            field=models.JSONField(blank=True, default=dict, verbose_name='元数据'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:02
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    """为已有分块计算内容哈希"""
+    DocumentChunk = apps.get_model('documents', 'DocumentChunk')
+    batch = []
+    for chunk in DocumentChunk.objects.only('id', 'content').iterator():
+        chunk.content_hash = hashlib.sha256(chunk.content.encode('utf-8')).hexdigest()
+        batch.append(chunk)
+        if len(batch) >= 500:
+            DocumentChunk.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_documentchunk_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, verbose_name='内容哈希'),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
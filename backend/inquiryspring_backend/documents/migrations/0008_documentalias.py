@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_documentchunk_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=200, verbose_name='文件名')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='documents.document')),
+            ],
+            options={
+                'verbose_name': '文档别名',
+                'verbose_name_plural': '文档别名',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='documentalias',
+            constraint=models.UniqueConstraint(fields=('document', 'name'), name='unique_document_alias'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_documentalias'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最近更新时间'),
+        ),
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='worker',
+            field=models.CharField(blank=True, max_length=255, verbose_name='处理进程'),
+        ),
+    ]
@@ -14,6 +14,8 @@ class Document(models.Model):
     file = models.FileField('文件', upload_to=upload_to)
     file_type = models.CharField('文件类型', max_length=50)
     file_size = models.BigIntegerField('文件大小', default=0)
+    # 文件内容的SHA-256，相同内容的文件只保存和处理一次
+    content_hash = models.CharField('内容哈希', max_length=64, unique=True, null=True, blank=True)
     
     # 处理状态
     is_processed = models.BooleanField('是否已处理', default=False)
@@ -30,6 +32,8 @@ class Document(models.Model):
     # 时间戳
     uploaded_at = models.DateTimeField('上传时间', auto_now_add=True)
     processed_at = models.DateTimeField('处理时间', null=True, blank=True)
+    # 每次保存时更新，语义响应缓存据此判断缓存的回答是否基于旧内容
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
     
     # 用户关联
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
@@ -47,15 +51,44 @@ class Document(models.Model):
         return os.path.basename(self.file.name) if self.file else ''
 
 
+class DocumentAlias(models.Model):
+    """文档的其他文件名
+
+    内容相同的文件以新文件名重新上传时复用已有文档，新文件名记录为别名，按文件名查找文档时同样可以找到。
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='aliases')
+    name = models.CharField('文件名', max_length=200, db_index=True)
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+
+    class Meta:
+        verbose_name = '文档别名'
+        verbose_name_plural = '文档别名'
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'name'], name='unique_document_alias'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} -> {self.document.title}'
+
+
 class DocumentChunk(models.Model):
     """文档分块"""
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
     content = models.TextField('分块内容')
+    # 分块内容的SHA-256，重新处理文档时用于复用内容未变化的分块和向量
+    content_hash = models.CharField('内容哈希', max_length=64, blank=True, db_index=True)
     chunk_index = models.IntegerField('分块索引')
     
     # 向量化相关
     embedding = models.JSONField('向量嵌入', null=True, blank=True)
     
+    # 分块在文档内容中的位置（start/end），PDF还包含起止页码（page_start/page_end）
+    metadata = models.JSONField('元数据', default=dict, blank=True)
+    
+    # 分层摘要时生成的分块要点概括
+    summary = models.TextField('分块概括', blank=True)
+    summary_version = models.CharField('概括提示词版本', max_length=20, blank=True)
+    
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
 
     class Meta:
@@ -67,6 +100,78 @@ class DocumentChunk(models.Model):
         return f'{self.document.title} - 分块 {self.chunk_index}'
 
 
+class DocumentSummary(models.Model):
+    """缓存的文档摘要
+
+    每个文档的每种摘要参数保留一条记录，并记录生成时的内容哈希和提示词模板版本；
+    两者与当前不一致时记录视为过期。
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='summaries')
+    summary_length = models.CharField('摘要长度', max_length=20)
+    include_outline = models.BooleanField('是否包含大纲', default=False)
+
+    content_hash = models.CharField('内容哈希', max_length=64)
+    template_version = models.CharField('模板版本', max_length=64)
+
+    summary = models.TextField('摘要')
+    model = models.CharField('生成模型', max_length=100, blank=True)
+    provider = models.CharField('提供商', max_length=50, blank=True)
+    generation_time = models.FloatField('生成耗时(秒)', default=0.0)
+
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '文档摘要'
+        verbose_name_plural = '文档摘要'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['document', 'summary_length', 'include_outline'],
+                name='unique_document_summary_options'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.document.title} - {self.summary_length}'
+
+
+class IngestionJob(models.Model):
+    """文档后台处理任务"""
+
+    STATUS_CHOICES = [
+        ('pending', '等待中'),
+        ('running', '处理中'),
+        ('completed', '已完成'),
+        ('failed', '失败'),
+    ]
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    status = models.CharField('状态', max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    stage = models.CharField('当前阶段', max_length=50, blank=True)
+    progress = models.PositiveSmallIntegerField('进度(%)', default=0)
+    attempts = models.PositiveIntegerField('尝试次数', default=0)
+    error_message = models.TextField('错误信息', blank=True)
+
+    # 领取任务的worker（主机名:进程ID）和最近一次进度更新时间，用于发现中断的任务
+    worker = models.CharField('处理进程', max_length=255, blank=True)
+    heartbeat_at = models.DateTimeField('最近更新时间', null=True, blank=True)
+
+    # 处理结果统计
+    result = models.JSONField('处理结果', default=dict, blank=True)
+
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    started_at = models.DateTimeField('开始时间', null=True, blank=True)
+    finished_at = models.DateTimeField('完成时间', null=True, blank=True)
+
+    class Meta:
+        verbose_name = '文档处理任务'
+        verbose_name_plural = '文档处理任务'
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f'{self.document.title} - {self.get_status_display()}'
+
+
 class UploadedFile(models.Model):
     """上传文件（兼容旧版本）"""
     filename = models.CharField('文件名', max_length=255)
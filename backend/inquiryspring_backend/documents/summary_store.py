@@ -0,0 +1,156 @@
+"""
+文档摘要存储 - 已生成的摘要直接返回，只有文档内容或提示词模板变化时才重新生成
+
+摘要按（文档, 摘要长度, 是否包含大纲）保存，并记录生成时的内容哈希和模板版本。
+查询时哈希和版本一致则直接返回；不一致时先返回旧摘要，同时在后台重新生成；
+没有任何记录时才需要调用方同步生成。
+"""
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Document, DocumentSummary
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content: str) -> str:
+    """计算文档内容的哈希"""
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+class SummaryStore:
+    """文档摘要的持久化缓存"""
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or getattr(settings, 'SUMMARY_REFRESH_WORKERS', 2)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # 正在后台重新生成的 (文档ID, 摘要长度, 是否包含大纲)
+        self._refreshing = set()
+
+    def lookup(self, document: Document, summary_length: str, include_outline: bool,
+               template_version: str) -> Tuple[Optional[DocumentSummary], bool]:
+        """查找已保存的摘要
+
+        Returns:
+            (摘要记录或None, 是否与当前内容和模板一致)
+        """
+        entry = DocumentSummary.objects.filter(
+            document=document,
+            summary_length=summary_length,
+            include_outline=include_outline
+        ).first()
+        if entry is None:
+            return None, False
+        fresh = (entry.content_hash == content_hash(document.content)
+                 and entry.template_version == template_version)
+        return entry, fresh
+
+    def save(self, document: Document, summary_length: str, include_outline: bool,
+             template_version: str, result: Dict[str, Any], generation_time: float = 0.0,
+             hash_value: str = None) -> DocumentSummary:
+        """保存生成的摘要，同时更新 Document.summary 以兼容旧接口"""
+        entry, _ = DocumentSummary.objects.update_or_create(
+            document=document,
+            summary_length=summary_length,
+            include_outline=include_outline,
+            defaults={
+                'content_hash': hash_value or content_hash(document.content),
+                'template_version': template_version,
+                'summary': result.get('text', ''),
+                'model': result.get('model', ''),
+                'provider': result.get('provider', ''),
+                'generation_time': generation_time,
+            }
+        )
+        Document.objects.filter(id=document.id).update(summary=entry.summary)
+        document.summary = entry.summary
+        return entry
+
+    def get_or_generate(self, document: Document, summary_length: str, include_outline: bool,
+                        template_version: str,
+                        generate_fn: Callable[[Document], Dict[str, Any]],
+                        force: bool = False) -> Tuple[Dict[str, Any], str]:
+        """获取摘要，没有可用摘要时同步生成
+
+        Args:
+            generate_fn: 生成摘要的函数，参数为文档，返回包含 text 的结果字典（失败时包含 error）
+            force: 忽略已保存的摘要，同步重新生成
+
+        Returns:
+            (结果字典, 状态)；状态为 fresh（缓存有效）、stale（返回旧摘要并在后台重新生成）或 generated
+        """
+        entry, fresh = (None, False) if force else self.lookup(
+            document, summary_length, include_outline, template_version
+        )
+        if entry is not None:
+            if not fresh:
+                self.refresh_in_background(document.id, summary_length, include_outline,
+                                           template_version, generate_fn)
+            return self.to_result(entry), 'fresh' if fresh else 'stale'
+
+        hash_value = content_hash(document.content)
+        start_time = time.time()
+        result = generate_fn(document)
+        if not result.get('error'):
+            self.save(document, summary_length, include_outline, template_version, result,
+                      time.time() - start_time, hash_value)
+        return result, 'generated'
+
+    @staticmethod
+    def to_result(entry: DocumentSummary) -> Dict[str, Any]:
+        return {
+            'text': entry.summary,
+            'model': entry.model,
+            'provider': entry.provider,
+            'generated_at': entry.updated_at.isoformat(),
+        }
+
+    def refresh_in_background(self, document_id: int, summary_length: str, include_outline: bool,
+                              template_version: str,
+                              generate_fn: Callable[[Document], Dict[str, Any]]) -> bool:
+        """在后台重新生成摘要；同一摘要已在生成中时不重复提交，返回是否提交了新任务"""
+        key = (document_id, summary_length, include_outline)
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='summary-refresh')
+        self._executor.submit(self._refresh, key, template_version, generate_fn)
+        return True
+
+    def _refresh(self, key, template_version: str, generate_fn: Callable[[Document], Dict[str, Any]]) -> None:
+        document_id, summary_length, include_outline = key
+        try:
+            document = Document.objects.filter(id=document_id).first()
+            if document is None:
+                return
+            # 以生成开始时的内容为准，生成期间内容再次变化时下次查询仍会判定为过期
+            hash_value = content_hash(document.content)
+            start_time = time.time()
+            result = generate_fn(document)
+            if result.get('error'):
+                logger.warning(f"后台重新生成文档 {document_id} 的摘要失败: {result['error']}")
+                return
+            self.save(document, summary_length, include_outline, template_version, result,
+                      time.time() - start_time, hash_value)
+            logger.info(f"文档 {document_id} 的摘要已在后台更新 ({summary_length})")
+        except Exception as e:
+            logger.exception(f"后台重新生成文档 {document_id} 的摘要失败: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+            close_old_connections()
+
+
+# 全局文档摘要存储实例
+summary_store = SummaryStore()
@@ -0,0 +1,193 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import views
+from .ingestion import IngestionQueue, ingestion_queue
+from .models import Document, IngestionJob
+
+
+def json_body(response):
+    """取出响应数据，API中间件会把结果包装在 data 字段中"""
+    payload = response.json()
+    return payload.get('data', payload)
+
+
+class DuplicateUploadTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+        self.enqueue = self.enterContext(mock.patch.object(ingestion_queue, 'enqueue'))
+
+    def upload(self, name, content):
+        response = self.client.post('/api/documents/upload/', {'file': SimpleUploadedFile(name, content)})
+        self.assertEqual(response.status_code, 200)
+        return json_body(response)
+
+    def test_reupload_under_new_name_can_be_summarized(self):
+        first = self.upload('notes.txt', b'same content')
+        second = self.upload('notes_copy.txt', b'same content')
+
+        self.assertTrue(second['duplicate'])
+        self.assertEqual(second['file_id'], first['file_id'])
+        self.assertEqual(Document.objects.count(), 1)
+        self.enqueue.assert_called_once()
+
+        Document.objects.filter(id=first['file_id']).update(is_processed=True, content='same content')
+        summary = mock.AsyncMock(return_value=({'text': '文档总结'}, 'fresh'))
+        with mock.patch.object(views, 'get_document_summary', summary):
+            for name in ('notes.txt', 'notes_copy.txt'):
+                response = self.client.get('/api/documents/summarize/', {'fileName': name})
+                self.assertEqual(response.status_code, 200, name)
+                self.assertEqual(json_body(response)['AIMessage'], '文档总结')
+
+    def test_different_content_creates_new_document(self):
+        first = self.upload('notes.txt', b'first version')
+        second = self.upload('notes.txt', b'second version')
+
+        self.assertFalse(second['duplicate'])
+        self.assertNotEqual(second['file_id'], first['file_id'])
+        for document in Document.objects.all():
+            with open(document.file.path, 'rb') as f:
+                self.assertIn(f.read(), (b'first version', b'second version'))
+
+    def test_interleaved_uploads_with_same_name_keep_their_own_bytes(self):
+        write = views.write_uploaded_file
+        results = []
+
+        def write_then_interleave(file, file_path):
+            file_hash = write(file, file_path)
+            if not results:
+                results.append(None)
+                # 第一个上传写完临时文件后，另一个同名上传在它完成前执行完毕
+                results[0] = views.save_upload(SimpleUploadedFile('notes.txt', b'second upload'), 'notes.txt')
+            return file_hash
+
+        with mock.patch.object(views, 'write_uploaded_file', write_then_interleave):
+            first, duplicate, error = views.save_upload(SimpleUploadedFile('notes.txt', b'first upload'), 'notes.txt')
+        second = results[0][0]
+
+        self.assertIsNone(error)
+        self.assertFalse(duplicate)
+        self.assertNotEqual(first.id, second.id)
+        for document, content in ((first, b'first upload'), (second, b'second upload')):
+            document.refresh_from_db()
+            with open(document.file.path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [])
+
+
+class DocumentDeleteTests(TestCase):
+
+    def test_delete_removes_vectors_and_keyword_index(self):
+        document = Document.objects.create(title='notes.txt', file_type='text', is_processed=True)
+
+        with mock.patch.object(views, 'delete_document_index') as delete_document_index:
+            response = self.client.delete(f'/api/documents/{document.id}/delete/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Document.objects.filter(id=document.id).exists())
+        delete_document_index.assert_called_once_with(document.id)
+
+
+class StaleIngestionJobTests(TestCase):
+
+    def setUp(self):
+        self.queue = IngestionQueue()
+        self.document = Document.objects.create(title='notes.txt', file_type='text', processing_status='extracting')
+
+    @staticmethod
+    def dead_pid():
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        return process.pid
+
+    def running_job(self, pid, heartbeat_age=0):
+        heartbeat = timezone.now() - timedelta(seconds=heartbeat_age)
+        return IngestionJob.objects.create(
+            document=self.document, status='running', worker=f'{socket.gethostname()}:{pid}',
+            started_at=heartbeat, heartbeat_at=heartbeat
+        )
+
+    def test_recovers_jobs_of_exited_worker(self):
+        job = self.running_job(self.dead_pid())
+
+        self.assertEqual(self.queue.recover_stale_jobs(timeout=1800), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.processing_status, 'queued')
+
+    def test_keeps_jobs_of_live_worker_until_timeout(self):
+        live = self.running_job(os.getppid())
+        stale = self.running_job(os.getppid(), heartbeat_age=3600)
+
+        self.assertEqual(self.queue.recover_stale_jobs(timeout=1800), 1)
+        self.assertEqual(IngestionJob.objects.get(id=live.id).status, 'running')
+        self.assertEqual(IngestionJob.objects.get(id=stale.id).status, 'pending')
+
+    def test_job_of_previous_process_with_same_pid_is_recovered(self):
+        job = self.running_job(os.getpid())
+
+        self.assertEqual(self.queue.recover_stale_jobs(timeout=1800), 1)
+        self.assertEqual(IngestionJob.objects.get(id=job.id).status, 'pending')
+
+    def test_start_recovers_stale_jobs(self):
+        job = self.running_job(self.dead_pid())
+        self.queue.serve_forever = mock.Mock()
+
+        self.queue.start()
+        self.queue._dispatcher.join()
+
+        self.assertEqual(IngestionJob.objects.get(id=job.id).status, 'pending')
+        self.queue.serve_forever.assert_called_once()
+
+
+class IngestionDispatcherTests(SimpleTestCase):
+
+    def test_wakeup_during_dispatch_is_not_lost(self):
+        class Stop(BaseException):
+            pass
+
+        queue = IngestionQueue(poll_interval=60)
+        calls = []
+
+        def dispatch_pending():
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                # 任务在本轮检查期间入队
+                queue._wakeup.set()
+            else:
+                raise Stop
+
+        queue.dispatch_pending = dispatch_pending
+        with mock.patch('inquiryspring_backend.documents.ingestion.close_old_connections'):
+            with self.assertRaises(Stop):
+                queue.serve_forever()
+        self.assertLess(calls[1] - calls[0], 1)
+
+    def test_extraction_pool_uses_spawn(self):
+        queue = IngestionQueue(max_workers=1)
+        self.addCleanup(queue.shutdown)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'notes.txt')
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write('第一段\n\n第二段')
+
+            result = queue._extract(file_path, 'notes.txt')
+
+        self.assertTrue(result['success'])
+        self.assertIn('第二段', result['content'])
+        self.assertEqual(queue._get_process_pool()._mp_context.get_start_method(), 'spawn')
@@ -8,7 +8,7 @@ urlpatterns = [
     path('list/', views.document_list, name='document_list'),
     path('<int:doc_id>/delete/', views.document_delete, name='document_delete'),
     path('<int:doc_id>/content/', views.document_content, name='document_content'),
-    path('<int:doc_id>/summarize/', views.document_summarize, name='document_summarize_new'),
+    path('<int:doc_id>/summarize/', views.DocumentSummarizeView.as_view(), name='document_summarize_new'),
     path('<int:doc_id>/status/', views.document_status, name='document_status'),
     path('formats/', views.document_formats, name='document_formats'),
 
@@ -1,19 +1,27 @@
 import logging
 import os
 import re
+import tempfile
+import time
+from asgiref.sync import sync_to_async
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.conf import settings
+from django.db import IntegrityError
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from django.utils import timezone
 
-from .models import Document
+from .models import Document, DocumentAlias
 from ..ai_service_wrapper import ai_service
 from .document_processor import document_processor
+from .ingestion import ingestion_queue
+from ..ai_services.response_cache import response_cache
+from .summary_store import summary_store
+from ..utils import delete_document_index, write_uploaded_file
 
 logger = logging.getLogger(__name__)
 
@@ -42,15 +50,131 @@ def secure_filename(filename):
     return filename
 
 
+def save_upload(file, filename):
+    """保存上传的文件并创建文档，内容相同的文件只保存一份
+
+    文件写入唯一的临时文件的同时计算哈希，同名文件的并发上传互不影响；
+    已有相同哈希的文档时删除临时文件并直接返回已有文档，
+    不再重复提取和向量化（已有文档处理失败时重新加入处理队列），新文件名记录为文档的别名。
+
+    Returns:
+        (文档, 是否为重复上传, 错误信息)；验证失败时文档为None
+    """
+    upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+    fd, file_path = tempfile.mkstemp(dir=upload_dir, prefix='upload-', suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+
+    try:
+        file_hash = write_uploaded_file(file, file_path)
+
+        existing = Document.objects.filter(content_hash=file_hash).first()
+        if existing is None:
+            # 验证文件
+            validation = document_processor.validate_file(file_path, filename)
+            if not validation['valid']:
+                return None, False, validation['error']
+
+            try:
+                document = Document.objects.create(
+                    title=filename,
+                    file_type=validation['file_type'],
+                    file_size=validation['file_size'],
+                    content_hash=file_hash,
+                    processing_status='queued'
+                )
+            except IntegrityError:
+                # 相同文件的并发上传已先创建了文档
+                existing = Document.objects.filter(content_hash=file_hash).first()
+                if existing is None:
+                    raise
+
+        if existing is not None:
+            if filename != existing.title:
+                # 记录新文件名，之后按新文件名请求总结时也能找到该文档
+                DocumentAlias.objects.get_or_create(document=existing, name=filename)
+            if existing.processing_status == 'failed':
+                ingestion_queue.enqueue(existing)
+            logger.info(f"上传的文件与文档 {existing.id} 内容相同，复用已有文档: {filename}")
+            return existing, True, None
+
+        # 确定不是重复文件后再移动到最终位置
+        final_dir = os.path.join(settings.MEDIA_ROOT, 'documents', str(document.id))
+        os.makedirs(final_dir, exist_ok=True)
+        os.replace(file_path, os.path.join(final_dir, filename))
+    finally:
+        # 重复文件、验证失败或出错时删除临时文件
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    # 更新document记录
+    document.file.name = f'documents/{document.id}/{filename}'
+    document.save()
+
+    # 加入后台处理队列，提取和向量化不再阻塞上传请求
+    ingestion_queue.enqueue(document)
+    return document, False, None
+
+
+def _summarize_for_store(document):
+    """后台重新生成总结，离线模式的模拟响应视为失败，不覆盖已保存的总结"""
+    result = ai_service.summarize_document(document)
+    if result.get('provider') == 'mock':
+        return {'error': 'AI服务处于离线模式'}
+    return result
+
+
+async def get_document_summary(document, force=False):
+    """获取文档总结
+
+    已保存且与当前内容、提示词一致的总结直接返回；已过期的先返回旧总结，同时在后台重新生成；
+    没有保存过总结（或 force 为 True）时才同步调用AI服务。
+
+    Returns:
+        (结果字典, 状态)；状态为 fresh、stale 或 generated
+    """
+    summary_length = ai_service.SUMMARY_LENGTH
+    template_version = ai_service.summary_template_version()
+
+    if not force:
+        entry, fresh = await sync_to_async(summary_store.lookup)(
+            document, summary_length, False, template_version
+        )
+        if entry is not None or document.summary:
+            if not fresh:
+                summary_store.refresh_in_background(
+                    document.id, summary_length, False, template_version, _summarize_for_store
+                )
+            if entry is None:
+                # 旧版本保存在 Document.summary 上的总结，先返回再在后台补全记录
+                return {'text': document.summary, 'model': 'cached', 'provider': 'cached'}, 'stale'
+            return summary_store.to_result(entry), 'fresh' if fresh else 'stale'
+
+    start_time = time.time()
+    result = await ai_service.asummarize_document(document)
+    # 模拟响应不保存，配置API密钥后可直接生成真实总结
+    if not result.get('error') and result.get('provider') != 'mock':
+        await sync_to_async(summary_store.save)(
+            document, summary_length, False, template_version, result, time.time() - start_time
+        )
+    return result, 'generated'
+
+
 # 删除了低级的FileUploadView，使用高级的DocumentProcessView代替
 
 
 @method_decorator(csrf_exempt, name='dispatch')
 class SummarizeView(View):
-    """文档总结视图 - 兼容前端调用方式"""
+    """文档总结视图 - 兼容前端调用方式
+
+    异步视图：生成总结时等待AI服务不占用工作线程；文件上传在线程池中执行。
+    """
 
-    def post(self, request):
-        """处理文件上传并生成文档 - 使用高级文档处理"""
+    async def post(self, request):
+        """处理文件上传并创建文档，内容提取在后台队列中完成"""
+        return await sync_to_async(self._upload)(request)
+
+    def _upload(self, request):
         try:
             if 'file' not in request.FILES:
                 return JsonResponse({'error': '没有选择文件'}, status=400)
@@ -69,80 +193,33 @@ class SummarizeView(View):
                     'error': '文档处理功能不可用'
                 }, status=500)
 
-            # 使用高级文档处理
             filename = secure_filename(file.name)
-            upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
-            os.makedirs(upload_dir, exist_ok=True)
-
-            file_path = os.path.join(upload_dir, filename)
-
-            with open(file_path, 'wb+') as destination:
-                for chunk in file.chunks():
-                    destination.write(chunk)
-
-            # 验证文件
-            validation = document_processor.validate_file(file_path, filename)
-            if not validation['valid']:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                return JsonResponse({'error': validation['error']}, status=400)
-
-            # 创建Document记录
-            document = Document.objects.create(
-                title=filename,
-                file_type=validation['file_type'],
-                file_size=validation['file_size'],
-                processing_status='processing'
-            )
-
-            # 移动文件到最终位置
-            final_dir = os.path.join(settings.MEDIA_ROOT, 'documents', str(document.id))
-            os.makedirs(final_dir, exist_ok=True)
-            final_path = os.path.join(final_dir, filename)
-            os.rename(file_path, final_path)
-
-            # 更新document记录
-            document.file.name = f'documents/{document.id}/{filename}'
-            document.save()
-
-            # 提取文档内容
-            extraction_result = document_processor.extract_text(final_path, filename)
-
-            if extraction_result['success']:
-                document.content = extraction_result['content']
-                document.metadata = extraction_result['metadata']
-                document.is_processed = True
-                document.processing_status = 'completed'
-                document.processed_at = timezone.now()
-                document.save()
-
-                logger.info(f"文档处理成功: {filename}")
-
-                # 兼容旧版本响应格式
-                return JsonResponse({
-                    'message': '文件上传成功',
+            document, duplicate, error = save_upload(file, filename)
+            if document is None:
+                return JsonResponse({'error': error}, status=400)
+            filename = os.path.basename(document.file.name) if document.file else filename
+            if not duplicate:
+                logger.info(f"文档已加入处理队列: {filename}")
+
+            # 兼容旧版本响应格式
+            return JsonResponse({
+                'message': '文件上传成功',
+                'filename': filename,
+                'file_id': document.id,  # 使用新的document ID
+                'url': f'/media/documents/{document.id}/{filename}',
+                'processing_status': document.processing_status,
+                'duplicate': duplicate,
+                'data': {
                     'filename': filename,
-                    'file_id': document.id,  # 使用新的document ID
-                    'url': f'/media/documents/{document.id}/{filename}',
-                    'data': {
-                        'filename': filename,
-                        'file_id': document.id
-                    }
-                })
-            else:
-                document.processing_status = 'failed'
-                document.error_message = extraction_result['error']
-                document.save()
-
-                return JsonResponse({
-                    'error': f'文档处理失败: {extraction_result["error"]}'
-                }, status=500)
+                    'file_id': document.id
+                }
+            })
 
         except Exception as e:
             logger.error(f"文件上传失败: {e}")
             return JsonResponse({'error': f'上传失败: {str(e)}'}, status=500)
 
-    def get(self, request):
+    async def get(self, request):
         """生成文档总结 - 兼容前端调用方式"""
         try:
             filename = request.GET.get('fileName')
@@ -151,38 +228,30 @@ class SummarizeView(View):
                 return JsonResponse({'error': '缺少文件名参数'}, status=400)
 
             # 查找已处理的文档
-            document = Document.objects.filter(title=filename, is_processed=True).first()
+            document = await Document.objects.filter(title=filename, is_processed=True).afirst()
+            if document is None:
+                # 以其他文件名重新上传的相同文件
+                document = await Document.objects.filter(aliases__name=filename, is_processed=True).afirst()
 
             if not document or not document.content:
                 return JsonResponse({'error': '文档不存在或未处理完成'}, status=404)
 
-            # 如果已有总结，直接返回
-            if document.summary:
-                logger.info(f"返回已有总结: {filename}")
-                response_data = {
-                    'AIMessage': document.summary,
-                    'filename': filename,
-                    'model': 'cached',
-                    'provider': 'cached'
-                }
-                return JsonResponse(response_data)
-
-            # 使用AI生成总结
-            summary_result = ai_service.summarize(document.content)
+            # 已有总结直接返回，内容变化后在后台重新生成
+            summary_result, summary_status = await get_document_summary(document)
             summary = summary_result.get("text", "无法生成总结")
 
-            # 保存总结
-            document.summary = summary
-            document.save()
-
-            logger.info(f"文档总结生成成功: {filename}")
+            if summary_status == 'generated':
+                logger.info(f"文档总结生成成功: {filename}")
+            else:
+                logger.info(f"返回已有总结 ({summary_status}): {filename}")
 
             # 确保响应格式兼容前端期望
             response_data = {
                 'AIMessage': summary,
                 'filename': filename,
-                'model': summary_result.get('model', ''),
-                'provider': summary_result.get('provider', '')
+                'model': summary_result.get('model', '') if summary_status == 'generated' else 'cached',
+                'provider': summary_result.get('provider', '') if summary_status == 'generated' else 'cached',
+                'summary_status': summary_status
             }
 
             return JsonResponse(response_data)
@@ -233,8 +302,11 @@ def document_delete(request, doc_id):
             except OSError:
                 pass  # 目录不为空或不存在
 
-        # 删除数据库记录
+        # 删除数据库记录，以及该文档的向量、关键词索引和缓存回答
+        document_id = document.id
+        response_cache.invalidate_document(document_id)
         document.delete()
+        delete_document_index(document_id)
 
         return Response({'message': '文档删除成功'})
 
@@ -273,49 +345,52 @@ def document_content(request, doc_id):
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(['POST'])
-def document_summarize(request, doc_id):
-    """生成文档总结"""
-    try:
-        document = Document.objects.get(id=doc_id)
+@method_decorator(csrf_exempt, name='dispatch')
+class DocumentSummarizeView(View):
+    """生成文档总结（异步视图，DRF的api_view不支持异步处理函数）"""
+
+    http_method_names = ['post', 'options']
 
-        if not document.is_processed:
-            return Response({
-                'error': '文档尚未处理完成'
-            }, status=status.HTTP_400_BAD_REQUEST)
+    async def post(self, request, doc_id):
+        """生成文档总结，已保存的总结直接返回；?force=1 时强制重新生成"""
+        try:
+            document = await Document.objects.aget(id=doc_id)
 
-        if not document.content:
-            return Response({
-                'error': '文档内容为空'
-            }, status=status.HTTP_400_BAD_REQUEST)
+            if not document.is_processed:
+                return JsonResponse({
+                    'error': '文档尚未处理完成'
+                }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 生成总结
-        summary_result = ai_service.summarize(document.content)
+            if not document.content:
+                return JsonResponse({
+                    'error': '文档内容为空'
+                }, status=status.HTTP_400_BAD_REQUEST)
 
-        if 'error' not in summary_result:
-            # 保存总结到数据库
-            document.summary = summary_result.get('text', '')
-            document.save()
+            # 获取或生成总结
+            force = request.GET.get('force', '').lower() in ('1', 'true', 'yes')
+            summary_result, summary_status = await get_document_summary(document, force=force)
 
-            logger.info(f"文档总结生成成功: {document.title}")
+            if 'error' not in summary_result:
+                logger.info(f"文档总结获取成功 ({summary_status}): {document.title}")
 
-            return Response({
-                'document_id': document.id,
-                'title': document.title,
-                'summary': summary_result.get('text', ''),
-                'model': summary_result.get('model', ''),
-                'provider': summary_result.get('provider', '')
-            })
-        else:
-            return Response({
-                'error': f'总结生成失败: {summary_result.get("error", "未知错误")}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                return JsonResponse({
+                    'document_id': document.id,
+                    'title': document.title,
+                    'summary': summary_result.get('text', ''),
+                    'model': summary_result.get('model', ''),
+                    'provider': summary_result.get('provider', ''),
+                    'summary_status': summary_status
+                })
+            else:
+                return JsonResponse({
+                    'error': f'总结生成失败: {summary_result.get("error", "未知错误")}'
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    except Document.DoesNotExist:
-        return Response({'error': '文档不存在'}, status=status.HTTP_404_NOT_FOUND)
-    except Exception as e:
-        logger.error(f"文档总结失败: {e}")
-        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except Document.DoesNotExist:
+            return JsonResponse({'error': '文档不存在'}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            logger.error(f"文档总结失败: {e}")
+            return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 @api_view(['GET'])
@@ -342,6 +417,7 @@ def document_status(request, doc_id):
     """获取文档处理状态"""
     try:
         document = Document.objects.get(id=doc_id)
+        latest_job = document.ingestion_jobs.order_by('-created_at').first()
 
         return Response({
             'id': document.id,
@@ -354,7 +430,17 @@ def document_status(request, doc_id):
             'file_type': document.file_type,
             'file_size': document.file_size,
             'content_length': len(document.content) if document.content else 0,
-            'has_summary': bool(document.summary)
+            'has_summary': bool(document.summary),
+            'job': {
+                'id': latest_job.id,
+                'status': latest_job.status,
+                'stage': latest_job.stage,
+                'progress': latest_job.progress,
+                'attempts': latest_job.attempts,
+                'error_message': latest_job.error_message,
+                'started_at': latest_job.started_at.isoformat() if latest_job.started_at else None,
+                'finished_at': latest_job.finished_at.isoformat() if latest_job.finished_at else None
+            } if latest_job else None
         })
 
     except Document.DoesNotExist:
@@ -1,5 +1,6 @@
 import logging
 import json
+from asgiref.sync import sync_to_async
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
@@ -18,25 +19,13 @@ logger = logging.getLogger(__name__)
 
 @method_decorator(csrf_exempt, name='dispatch')
 class TestGenerationView(View):
-    """测验生成视图"""
+    """测验生成视图（异步，在ASGI下等待AI服务时不占用工作线程）"""
 
-    def get(self, request):
+    async def get(self, request):
         """获取测验列表或历史"""
         try:
             # 返回最近的测验尝试
-            attempts = QuizAttempt.objects.filter(is_completed=True)[:10]
-            quiz_list = []
-
-            for attempt in attempts:
-                quiz_list.append({
-                    'id': attempt.id,
-                    'quiz_title': attempt.quiz.title,
-                    'score': attempt.score,
-                    'total_points': attempt.total_points,
-                    'percentage': (attempt.score / attempt.total_points * 100) if attempt.total_points > 0 else 0,
-                    'completed_at': attempt.completed_at.isoformat() if attempt.completed_at else None
-                })
-
+            quiz_list = await sync_to_async(self._recent_attempts)()
             return JsonResponse({
                 'quizzes': quiz_list,
                 'message': '获取测验列表成功'
@@ -46,7 +35,23 @@ class TestGenerationView(View):
             logger.error(f"获取测验列表失败: {e}")
             return JsonResponse({'error': str(e)}, status=500)
 
-    def post(self, request):
+    @staticmethod
+    def _recent_attempts():
+        attempts = QuizAttempt.objects.filter(is_completed=True).select_related('quiz')[:10]
+        quiz_list = []
+
+        for attempt in attempts:
+            quiz_list.append({
+                'id': attempt.id,
+                'quiz_title': attempt.quiz.title,
+                'score': attempt.score,
+                'total_points': attempt.total_points,
+                'percentage': (attempt.score / attempt.total_points * 100) if attempt.total_points > 0 else 0,
+                'completed_at': attempt.completed_at.isoformat() if attempt.completed_at else None
+            })
+        return quiz_list
+
+    async def post(self, request):
         """生成测验"""
         try:
             data = json.loads(request.body)
@@ -60,14 +65,14 @@ class TestGenerationView(View):
             logger.info(f"生成测验请求: 题目数量={question_count}, 难度={difficulty}, 类型={question_types}")
 
             # 获取最近上传的文档内容
-            recent_document = Document.objects.filter(
+            recent_document = await Document.objects.filter(
                 is_processed=True
-            ).order_by('-uploaded_at').first()
+            ).order_by('-uploaded_at').afirst()
 
             if recent_document and recent_document.content:
                 # 基于文档内容生成测验
                 logger.info(f"基于文档生成测验: {recent_document.title}")
-                quiz_result = ai_service.generate_quiz(
+                quiz_result = await ai_service.agenerate_quiz(
                     content=recent_document.content,
                     topic=f"基于文档《{recent_document.title}》",
                     question_count=question_count,
@@ -77,7 +82,7 @@ class TestGenerationView(View):
             else:
                 # 没有文档时使用主题生成
                 logger.info("没有可用文档，基于主题生成测验")
-                quiz_result = ai_service.generate_quiz(
+                quiz_result = await ai_service.agenerate_quiz(
                     topic=topic or "通用知识",
                     question_count=question_count,
                     question_types=question_types,
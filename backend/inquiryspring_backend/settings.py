@@ -70,6 +70,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'inquiryspring_backend.wsgi.application'
+ASGI_APPLICATION = 'inquiryspring_backend.asgi.application'
 
 # Database
 DATABASES = {
@@ -136,6 +137,91 @@ REST_FRAMEWORK = {
 FILE_UPLOAD_MAX_MEMORY_SIZE = 16 * 1024 * 1024  # 16MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 16 * 1024 * 1024  # 16MB
 
+# 文档后台处理队列
+DOCUMENT_INGESTION_WORKERS = 2  # 并发处理的文档数（同时也是文本提取进程池大小）
+DOCUMENT_INGESTION_POLL_INTERVAL = 5.0  # 轮询数据库中新任务的间隔（秒）
+DOCUMENT_INGESTION_INLINE_WORKER = True  # 是否在Web进程内处理任务，False时需运行 manage.py run_ingestion_worker
+DOCUMENT_INGESTION_STALE_TIMEOUT = 1800  # running任务超过该时间（秒）没有进度更新时视为中断，启动调度时重新排队
+PDF_PAGES_PER_TASK = 16  # PDF按页范围并行提取时每个任务的页数，页数不超过该值时不拆分
+PDF_MAX_PENDING_TASKS = 4  # 同时提交到进程池的页范围任务数上限，限制提取结果占用的内存
+
+# 聊天上下文
+CHAT_CONTEXT_TOKEN_BUDGET = 2000  # 放入提示词的文档片段token预算
+
+# 长文档分层摘要
+SUMMARY_DIRECT_TOKEN_BUDGET = 6000  # 文档不超过该token数时直接整篇总结，否则先逐块概括再合并
+SUMMARY_REDUCE_TOKEN_BUDGET = 4000  # 一次合并的分块概括总token数上限，超出时分组逐层合并
+SUMMARY_MAP_CONCURRENCY = 4  # 逐块概括的最大并发数
+SUMMARY_SPLIT_CHARS = 2000  # 文档没有分块时按段落切分的片段长度（字符）
+SUMMARY_REFRESH_WORKERS = 2  # 后台重新生成过期摘要的线程数
+
+# 向量存储
+# chroma：共享的Chroma集合；numpy：float32向量的mmap文件，暴力检索，适合中小规模文档；
+# int8：int8量化的NumPy存储，另存 float16 向量对候选重新打分，磁盘占用约为 numpy 的 3/4。
+# manage.py benchmark_vector_store --migrate <后端> 可迁移已有向量
+VECTOR_STORE_BACKEND = 'chroma'
+
+# 嵌入模型预加载：Web服务进程（runserver、gunicorn、uvicorn）启动时在后台线程中加载嵌入模型，
+# 管理命令（migrate、shell、run_ingestion_worker 等）不预加载；False 时总是在第一次使用时加载
+AI_EMBEDDING_WARMUP = True
+
+# 嵌入向量缓存：按（嵌入模型名, 规范化文本哈希）保存分块向量，重复的分块不再运行模型
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = os.path.join(BASE_DIR, 'vector_store', 'embedding_cache.sqlite3')
+
+# 关键词检索
+KEYWORD_INDEX_MAX_DOCUMENTS = 64  # 进程内最多缓存的文档倒排索引数，超出后按LRU淘汰
+
+# 交叉编码器重排序（需要安装 sentence-transformers）
+RERANK_ENABLED = False  # 是否对检索结果重排序
+RERANK_MODEL = 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1'  # 重排序模型
+RERANK_CANDIDATES = 20  # 参与重排序的候选分块数量，越大越准确但越慢
+RERANK_BATCH_SIZE = 16  # 每批打分的（问题, 分块）对数
+RERANK_CACHE_SIZE = 10000  # 缓存的（问题, 分块）得分数量
+
+# 语义响应缓存（同一文档下相近问题复用回答）
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_THRESHOLD = 0.95  # 问题向量的余弦相似度阈值
+RESPONSE_CACHE_TTL = 3600  # 缓存有效期（秒）
+RESPONSE_CACHE_MAX_ENTRIES = 1000  # 最大条目数，超出后按LRU淘汰
+
+# 缓存
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # 持久化到磁盘的LLM结果缓存，LLM_CACHE_BACKEND 为 django 时使用
+    'llm': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'llm',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+# LLM结果缓存（相同模型、提示词和参数的请求复用结果）
+LLM_CACHE_BACKEND = 'memory'  # memory / django / none
+LLM_CACHE_MAX_ENTRIES = 512  # memory 后端的最大条目数
+LLM_CACHE_ALIAS = 'llm'  # django 后端使用的 CACHES 别名
+LLM_CACHE_TIMEOUT = 7 * 24 * 3600  # django 后端的过期时间（秒）
+LLM_CACHE_SAMPLED_RESPONSES = False  # temperature > 0 的请求默认不缓存
+
+# 本地模型动态批处理
+LOCAL_MODEL_BATCHING = True  # 是否将并发的生成请求合并为批次
+LOCAL_MODEL_MAX_BATCH_SIZE = 8  # 每批最多合并的请求数
+LOCAL_MODEL_BATCH_WAIT_MS = 20  # 收到第一个请求后等待凑批的最长时间（毫秒）
+
+# 本地模型注册表
+LOCAL_MODEL_MEMORY_LIMIT_MB = None  # 已加载模型的总内存上限（MB），超出时卸载最久未使用的空闲模型，None表示不限制
+LOCAL_MODEL_IDLE_TIMEOUT = None  # 模型空闲多少秒后卸载，None表示常驻
+
+# AI任务日志写入
+AI_TASK_LOG_ASYNC = True  # 是否在后台线程中批量写入任务日志
+AI_TASK_LOG_QUEUE_SIZE = 1000  # 内存队列最多缓存的日志条数
+AI_TASK_LOG_BATCH_SIZE = 100  # 每次批量写入的最大条数
+AI_TASK_LOG_FLUSH_INTERVAL = 1.0  # 最多隔多久写入一次（秒）
+AI_TASK_LOG_OVERFLOW = 'drop'  # 队列写满时：drop 丢弃新日志 / block 阻塞等待
+AI_TASK_LOG_BLOCK_TIMEOUT = 1.0  # block 策略下的最长等待时间（秒），超时仍丢弃
+
 # Logging
 LOGGING = {
     'version': 1,
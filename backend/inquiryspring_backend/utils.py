@@ -3,6 +3,7 @@ InquirySpring Backend 工具函数
 """
 import os
 import hashlib
+import logging
 import mimetypes
 from typing import Dict, Any, Optional
 from django.conf import settings
@@ -11,8 +12,18 @@ from django.core.files.base import ContentFile
 
 
 def get_file_hash(file_content: bytes) -> str:
-    """计算文件内容的MD5哈希值"""
-    return hashlib.md5(file_content).hexdigest()
+    """计算文件内容的SHA-256哈希值（与 Document.content_hash 一致）"""
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def write_uploaded_file(file, file_path: str) -> str:
+    """把上传的文件逐块写入 file_path，写入的同时计算哈希，返回与 get_file_hash 相同的哈希值"""
+    digest = hashlib.sha256()
+    with open(file_path, 'wb+') as destination:
+        for chunk in file.chunks():
+            digest.update(chunk)
+            destination.write(chunk)
+    return digest.hexdigest()
 
 
 def get_file_type(filename: str) -> str:
@@ -133,6 +144,66 @@ def get_ai_service_status() -> Dict[str, Any]:
         }
 
 
+def get_rag_engine_class():
+    """获取RAGEngine类，ai_services未启用或依赖缺失时返回None"""
+    from django.apps import apps
+
+    if not apps.is_installed('inquiryspring_backend.ai_services'):
+        return None
+
+    try:
+        from .ai_services.rag_engine import RAGEngine
+        return RAGEngine
+    except ImportError as e:
+        logging.getLogger(__name__).warning(f"RAG引擎不可用: {e}")
+        return None
+
+
+def get_llm_client():
+    """获取默认的LLM客户端，ai_services未启用或依赖缺失时返回None
+
+    第一次调用会查询 AIModel 配置，异步代码中需通过 sync_to_async 调用。
+    """
+    from django.apps import apps
+
+    if not apps.is_installed('inquiryspring_backend.ai_services'):
+        return None
+
+    try:
+        from .ai_services.llm_client import LLMClientFactory
+    except ImportError as e:
+        logging.getLogger(__name__).warning(f"LLM客户端不可用: {e}")
+        return None
+    return LLMClientFactory.create_client()
+
+
+def delete_document_index(document_id: int) -> None:
+    """删除文档的向量和关键词索引，ai_services未启用或依赖缺失时跳过
+
+    删除失败只记录日志：数据库中的文档已经删除，检索时找不到对应分块的向量会被忽略。
+    """
+    from django.apps import apps
+
+    if not apps.is_installed('inquiryspring_backend.ai_services'):
+        return
+
+    try:
+        from .ai_services.keyword_index import keyword_index
+        from .ai_services.rag_engine import RAGEngine
+        from .ai_services.vector_store import get_vector_store
+    except ImportError as e:
+        logging.getLogger(__name__).warning(f"向量存储不可用，跳过删除文档 {document_id} 的向量: {e}")
+        return
+
+    keyword_index.invalidate_document(document_id)
+    try:
+        vector_store = get_vector_store(RAGEngine.DEFAULT_CONFIG)
+        vector_store.delete_document(document_id)
+        vector_store.persist(document_id)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"删除文档 {document_id} 的向量失败: {e}")
+
+
 def format_response(data: Any, message: str = None, status: str = 'success') -> Dict[str, Any]:
     """格式化API响应"""
     response = {